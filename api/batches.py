@@ -0,0 +1,284 @@
+"""Jobs de lote: vários prompts com a mesma configuração numa só requisição."""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from budgets import BudgetExceededError, BudgetLedger
+from compaction import estimate_tokens
+from scheduler import QueueFullError, TurnScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class BatchJob:
+    """Um lote em execução ou concluído e seus resultados."""
+
+    def __init__(
+        self,
+        prompts: List[str],
+        config,
+        parallelism: int,
+        client_ip: Optional[str] = None,
+        api_key: Optional[str] = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.prompts = prompts
+        self.config = config
+        self.parallelism = parallelism
+        # A quem o uso do lote é cobrado nos orçamentos
+        self.client_ip = client_ip
+        self.api_key = api_key
+        self.status = "running"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Resultados na ordem em que terminaram; cada um traz seu `index`
+        self.results: List[Dict[str, Any]] = []
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    async def add(self, result: Dict[str, Any]):
+        async with self._changed:
+            self.results.append(result)
+            self._changed.notify_all()
+
+    async def finish(self, status: str):
+        async with self._changed:
+            self.status = status
+            self.finished_at = time.time()
+            self._changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[Dict[str, Any]]:
+        """Resultados já prontos e os próximos, até o fim do lote."""
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.results) > sent or self.done)
+                ready = self.results[sent:]
+                finished = self.done
+            for result in ready:
+                yield result
+            sent += len(ready)
+            if finished and sent == len(self.results):
+                return
+
+    def summary(self) -> Dict[str, Any]:
+        counts = {"completed": 0, "error": 0, "cancelled": 0}
+        for result in self.results:
+            counts[result["status"]] += 1
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.prompts),
+            "completed": counts["completed"],
+            "failed": counts["error"],
+            "cancelled": counts["cancelled"],
+            "parallelism": self.parallelism,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class BatchRunner:
+    """Executa lotes com paralelismo limitado sobre os workers do handler.
+
+    Cada prompt roda numa sessão própria (`batch-{job}-{índice}`) criada com a
+    configuração do lote e removida ao terminar; configurações iguais
+    reaproveitam os workers aquecidos do pool. Os turnos passam pelo
+    `TurnScheduler` como os de `/api/chat`: com a fila cheia o prompt espera
+    em vez de falhar. Com `budgets`, cada prompt é cobrado do IP e da chave
+    do lote, falha quando o orçamento rígido se esgota e, acima do flexível,
+    é cortado no teto de tokens como em `/api/chat`. Lotes concluídos
+    ficam disponíveis por `result_ttl` segundos.
+    """
+
+    def __init__(
+        self,
+        handler,
+        scheduler: TurnScheduler,
+        parallelism: int = 4,
+        max_prompts: int = 1000,
+        result_ttl: float = 3600.0,
+        max_turn_time: float = 3600.0,
+        budgets: Optional[BudgetLedger] = None,
+    ):
+        self.handler = handler
+        self.scheduler = scheduler
+        self.budgets = budgets
+        self.parallelism = parallelism
+        self.max_prompts = max_prompts
+        self.result_ttl = result_ttl
+        self.max_turn_time = max_turn_time
+        self._jobs: Dict[str, BatchJob] = {}
+
+    @classmethod
+    def from_env(cls, handler, scheduler: TurnScheduler, budgets: Optional[BudgetLedger] = None) -> "BatchRunner":
+        """Cria o executor a partir das variáveis de ambiente."""
+        return cls(
+            handler,
+            scheduler,
+            parallelism=int(os.getenv("BATCH_PARALLELISM", "4")),
+            max_prompts=int(os.getenv("BATCH_MAX_PROMPTS", "1000")),
+            result_ttl=float(os.getenv("BATCH_RESULT_TTL", "3600")),
+            max_turn_time=float(os.getenv("MAX_SESSION_TIME", "3600")),
+            budgets=budgets,
+        )
+
+    def submit(
+        self,
+        prompts: List[str],
+        config,
+        parallelism: Optional[int] = None,
+        client_ip: Optional[str] = None,
+        api_key: Optional[str] = None,
+    ) -> BatchJob:
+        """Cria o lote e inicia sua execução.
+
+        Levanta `ValueError` com prompts demais e `BudgetExceededError` se o
+        IP ou a chave já esgotaram o orçamento.
+        """
+        if len(prompts) > self.max_prompts:
+            raise ValueError(f"Máximo de {self.max_prompts} prompts por lote")
+        if self.budgets is not None:
+            self.budgets.admit(None, client_ip, api_key)
+        self._expire()
+        parallelism = min(parallelism or self.parallelism, self.parallelism)
+        job = BatchJob(prompts, config, parallelism, client_ip, api_key)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[BatchJob]:
+        """Cancela o lote e aguarda o registro dos resultados parciais."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if not job.done:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        return job
+
+    async def close(self):
+        for job_id in list(self._jobs):
+            await self.cancel(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "jobs": len(self._jobs),
+            "running": sum(1 for job in self._jobs.values() if not job.done),
+        }
+
+    @staticmethod
+    def encode(item: Dict[str, Any]) -> bytes:
+        """Uma linha NDJSON."""
+        return json.dumps(item, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.done and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    async def _run(self, job: BatchJob):
+        slots = asyncio.Semaphore(job.parallelism)
+        tasks = [asyncio.create_task(self._run_prompt(job, index, slots)) for index in range(len(job.prompts))]
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await job.finish("cancelled")
+        else:
+            await job.finish("completed")
+
+    async def _run_prompt(self, job: BatchJob, index: int, slots: asyncio.Semaphore):
+        result = {"index": index, "status": "cancelled", "content": ""}
+        try:
+            async with slots:
+                await self._execute(job, index, result)
+        except asyncio.CancelledError:
+            result["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.exception("Falha no prompt %d do lote %s", index, job.id)
+            result["status"] = "error"
+            result["error"] = str(e)
+        finally:
+            await job.add(result)
+
+    async def _execute(self, job: BatchJob, index: int, result: Dict[str, Any]):
+        session_id = f"batch-{job.id}-{index}"
+        token_limit = None
+        if self.budgets is not None:
+            try:
+                token_limit = self.budgets.admit(session_id, job.client_ip, job.api_key)
+            except BudgetExceededError as e:
+                result["status"] = "error"
+                result["error"] = str(e)
+                return
+        await self.handler.create_session(session_id, job.config)
+        ticket = None
+        try:
+            while ticket is None:
+                try:
+                    ticket = self.scheduler.submit(session_id)
+                except QueueFullError as e:
+                    await asyncio.sleep(min(e.retry_after, 5))
+            await ticket.wait()
+
+            reply = []
+            result["status"] = "running"
+
+            async def consume():
+                output_tokens = 0
+                truncated = False
+                async for event in self.handler.send_message(session_id, job.prompts[index]):
+                    if token_limit is not None and event["type"] in ("assistant_text", "tool_use", "tool_result"):
+                        if truncated:
+                            # Resto do turno já interrompido; só o `result` segue
+                            continue
+                        if event["type"] == "assistant_text":
+                            output_tokens += estimate_tokens(event["content"])
+                        if output_tokens > token_limit:
+                            truncated = True
+                            self.budgets.truncate(session_id)
+                            result["error"] = "Orçamento de tokens atingido; resposta truncada"
+                            await self.handler.interrupt_session(session_id)
+                            continue
+                    if event["type"] == "assistant_text":
+                        reply.append(event["content"])
+                    elif event["type"] == "result":
+                        for key in ("input_tokens", "output_tokens", "cost_usd", "cached"):
+                            if event.get(key) is not None:
+                                result[key] = event[key]
+                        if event.get("is_error"):
+                            result.setdefault("error", "Turno terminou com erro")
+                    elif event["type"] == "error":
+                        result.setdefault("error", event["error"])
+
+            try:
+                await asyncio.wait_for(consume(), self.max_turn_time)
+            except asyncio.TimeoutError:
+                result["error"] = "Tempo máximo do turno excedido"
+            finally:
+                result["content"] = "".join(reply)
+            result["status"] = "error" if "error" in result else "completed"
+        finally:
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            await self.handler.close_session(session_id)
+            if self.budgets is not None:
+                self.budgets.forget(session_id)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Benchmark de carga do streaming SSE com um handler determinístico.
+
+Sobe o `server.py` no próprio processo (uvicorn em loopback) com a resposta
+simulada do `ClaudeHandler` trocada por uma de ritmo configurável e dispara clientes SSE
+concorrentes. Mede TTFT (p50/p95/p99), frames e KB por segundo, memória por
+sessão e CPU por KB enviado, e compara com um baseline salvo:
+
+    python3 bench_api.py --clients 2000 --save-baseline baseline.json
+    python3 bench_api.py --clients 2000 --baseline baseline.json
+
+Sai com código 1 se alguma métrica piorar além de `--tolerance`. Clientes e
+servidor dividem o mesmo processo: CPU e memória incluem os dois lados.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import sys
+import time
+from typing import Any, AsyncGenerator, Dict, List
+
+# Precisa valer antes de importar o servidor
+os.environ["CLAUDE_CLI"] = "/nonexistent"
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+os.environ.pop("REDIS_URL", None)
+
+# (métrica, True se maior é melhor)
+COMPARED = (
+    ("ttft_p50_ms", False),
+    ("ttft_p95_ms", False),
+    ("ttft_p99_ms", False),
+    ("chunks_per_s", True),
+    ("kb_per_s", True),
+    ("mem_per_session_kb", False),
+    ("cpu_ms_per_kb", False),
+)
+
+LOREM = (
+    "O processamento de linguagem natural combina estatística, linguística e "
+    "aprendizado de máquina para transformar texto em representações úteis. "
+)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Percentil por posição mais próxima."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def rss_kb() -> float:
+    """RSS atual em KB (pico do processo onde /proc não existe)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 if sys.platform == "darwin" else peak
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def make_fake_simulate(args):
+    """Resposta sintética com ritmo de tokens fixo, no lugar de `_simulate`."""
+    async def simulate(message: str) -> AsyncGenerator[Dict[str, Any], None]:
+        text = LOREM * (args.chunk_size // len(LOREM) + 2)
+        interval = max(1, args.chunk_size // 4) / args.token_rate
+        for i in range(args.chunks):
+            await asyncio.sleep(interval)
+            start = (i * args.chunk_size) % len(LOREM)
+            yield {"type": "assistant_text", "content": text[start:start + args.chunk_size]}
+            if args.tool_every and (i + 1) % args.tool_every == 0:
+                tool_id = f"tool-{i}"
+                yield {"type": "tool_use", "tool": "Read", "id": tool_id, "input": {"path": "README.md"}}
+                yield {"type": "tool_result", "tool_id": tool_id, "content": text[:args.chunk_size * 4]}
+        yield {
+            "type": "result",
+            "input_tokens": len(message) // 4,
+            "output_tokens": args.chunks * args.chunk_size // 4,
+            "cost_usd": 0.0,
+        }
+
+    return simulate
+
+
+class Stats:
+    def __init__(self):
+        self.ttft: List[float] = []
+        self.chunks = 0
+        self.bytes = 0
+        self.turns = 0
+        self.errors = 0
+
+
+async def run_client(port: int, session_id: str, args, stats: Stats, delay: float):
+    await asyncio.sleep(delay)
+    for turn in range(args.turns):
+        payload = {"message": f"pergunta {turn} da sessão {session_id}", "session_id": session_id}
+        if args.coalesce_ms is not None:
+            payload["coalesce_ms"] = args.coalesce_ms
+        body = json.dumps(payload).encode()
+        request = (
+            f"POST /api/chat HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n"
+        ).encode() + body
+
+        try:
+            started = time.perf_counter()
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            status = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            if b" 200 " not in status:
+                stats.errors += 1
+                writer.close()
+                continue
+
+            # Corpo em chunked transfer encoding, um ou mais frames por bloco
+            buffer = b""
+            first = True
+            done = False
+            while not done:
+                size = int((await reader.readline()).strip() or b"0", 16)
+                if size == 0:
+                    break
+                data = await reader.readexactly(size + 2)
+                stats.bytes += size
+                buffer += data[:-2]
+                *frames, buffer = buffer.split(b"\n\n")
+                for frame in frames:
+                    if b"event: assistant_text" in frame:
+                        if first:
+                            stats.ttft.append(time.perf_counter() - started)
+                            first = False
+                        stats.chunks += 1
+                    elif b"event: done" in frame:
+                        done = True
+            stats.turns += 1
+            writer.close()
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            stats.errors += 1
+
+
+async def serve(app, sock):
+    import uvicorn
+
+    config = uvicorn.Config(app, log_level="warning", lifespan="on", backlog=4096)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def run(args) -> Dict[str, Any]:
+    raise_fd_limit()
+    total = args.clients * args.turns
+    os.environ["MAX_CONCURRENT_TURNS"] = str(args.max_concurrent or args.clients)
+    os.environ["MAX_QUEUED_TURNS"] = str(total)
+    os.environ["MAX_SESSIONS_PER_IP"] = str(args.clients + 1)
+    os.environ["MAX_SESSIONS"] = str(max(args.clients, 10000))
+
+    import server as api
+
+    # Sem CLI o handler usa o caminho simulado; troca só a resposta
+    handler = api.claude_handler
+    handler._simulate = make_fake_simulate(args)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server, task = await serve(api.app, sock)
+
+    stats = Stats()
+    rss_before = rss_kb()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(port, f"bench-{i}", args, stats, args.ramp * i / args.clients)
+        for i in range(args.clients)
+    ))
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    sessions = await handler.store.count()
+    mem_per_session = (rss_kb() - rss_before) / max(1, sessions)
+
+    server.should_exit = True
+    await task
+
+    kb = stats.bytes / 1024
+    return {
+        "clients": args.clients,
+        "turns": stats.turns,
+        "errors": stats.errors,
+        "wall_s": round(wall, 3),
+        "ttft_p50_ms": round(percentile(stats.ttft, 50) * 1000, 2),
+        "ttft_p95_ms": round(percentile(stats.ttft, 95) * 1000, 2),
+        "ttft_p99_ms": round(percentile(stats.ttft, 99) * 1000, 2),
+        "chunks_per_s": round(stats.chunks / wall, 1),
+        "kb_per_s": round(kb / wall, 1),
+        "mem_per_session_kb": round(mem_per_session, 2),
+        "cpu_ms_per_kb": round(cpu * 1000 / max(kb, 1e-9), 4),
+        "params": {
+            "chunks": args.chunks,
+            "chunk_size": args.chunk_size,
+            "token_rate": args.token_rate,
+            "tool_every": args.tool_every,
+            "coalesce_ms": args.coalesce_ms,
+        },
+    }
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """Imprime a variação de cada métrica; False se alguma regrediu."""
+    ok = True
+    if baseline.get("params") != result["params"]:
+        print("aviso: parâmetros diferentes do baseline")
+    for name, higher_is_better in COMPARED:
+        old, new = baseline.get(name), result[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "REGRESSÃO" if worse > tolerance else ""
+        ok = ok and not flag
+        print(f"{name:>20}: {old:>12} -> {new:>12}  ({change:+.1%}) {flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500, help="clientes SSE concorrentes")
+    parser.add_argument("--turns", type=int, default=1, help="turnos por cliente")
+    parser.add_argument("--chunks", type=int, default=50, help="trechos de texto por resposta")
+    parser.add_argument("--chunk-size", type=int, default=16, help="caracteres por trecho")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="tokens/s por resposta")
+    parser.add_argument("--tool-every", type=int, default=0, help="tool_use/tool_result a cada N trechos (0 desativa)")
+    parser.add_argument("--coalesce-ms", type=int, default=None, help="coalesce_ms enviado no pedido")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="MAX_CONCURRENT_TURNS (padrão: clientes)")
+    parser.add_argument("--ramp", type=float, default=1.0, help="segundos para iniciar todos os clientes")
+    parser.add_argument("--baseline", help="JSON de baseline para comparar")
+    parser.add_argument("--save-baseline", help="grava o resultado como baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="piora relativa aceita")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
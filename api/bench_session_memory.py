@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Benchmark de memória por sessão ociosa: layout anterior x registros compactos.
+
+O layout anterior (dict por sessão, `SessionConfig` próprio e lista de dicts
+de mensagens) é reconstruído aqui só para comparação:
+
+    python3 bench_session_memory.py --sessions 20000 --messages 10
+"""
+
+import argparse
+import asyncio
+import gc
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from claude_handler import SessionConfig
+from compaction import history_entry
+from session_store import InMemorySessionStore
+
+SYSTEM_PROMPTS = [None, "Você é um assistente útil", "Responda em inglês", "Você revisa código Python"]
+
+
+@dataclass
+class LegacySessionConfig:
+    """`SessionConfig` como era: mutável, sem slots, uma instância por sessão."""
+    system_prompt: Optional[str] = None
+    allowed_tools: List[str] = field(default_factory=list)
+    max_turns: Optional[int] = None
+    permission_mode: str = "acceptEdits"
+    cwd: Optional[str] = None
+    max_tokens: int = 4096
+    temperature: float = 0.7
+
+
+def conversation(index: int, messages: int, size: int):
+    for turn in range(messages):
+        role = "user" if turn % 2 == 0 else "assistant"
+        text = f"sessão {index} mensagem {turn} " + "conteúdo da conversa " * (size // 21)
+        yield history_entry(role, text[:size])
+
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used
+
+
+def build_legacy(args):
+    sessions = {}
+    for i in range(args.sessions):
+        sessions[f"s{i}"] = {
+            "config": LegacySessionConfig(system_prompt=SYSTEM_PROMPTS[i % len(SYSTEM_PROMPTS)]),
+            "history": list(conversation(i, args.messages, args.size)),
+            "created_at": 0.0,
+            "updated_at": 0.0,
+            "total_tokens": 0,
+            "total_cost": 0.0,
+            "replica": "bench",
+            "history_tokens": 0,
+            "compactions": 0,
+            "compacted_messages": 0,
+            "last_compacted_at": None,
+        }
+    return sessions
+
+
+def build_compact(args):
+    store = InMemorySessionStore()
+
+    async def fill():
+        for i in range(args.sessions):
+            session_id = f"s{i}"
+            await store.create(session_id, SessionConfig(system_prompt=SYSTEM_PROMPTS[i % len(SYSTEM_PROMPTS)]))
+            await store.append_history(session_id, *conversation(i, args.messages, args.size))
+
+    asyncio.run(fill())
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=10, help="mensagens por sessão")
+    parser.add_argument("--size", type=int, default=200, help="caracteres por mensagem")
+    args = parser.parse_args()
+
+    legacy = measure(lambda: build_legacy(args)) / args.sessions
+    compact = measure(lambda: build_compact(args)) / args.sessions
+    print(f"{args.sessions} sessões, {args.messages} mensagens de {args.size} caracteres")
+    print(f"  layout anterior: {legacy:10.0f} bytes/sessão")
+    print(f"  compacto:        {compact:10.0f} bytes/sessão  ({compact / legacy - 1:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Benchmark de tempo até o primeiro token: worker frio x aquecido x reutilizado.
+
+Usa o `fake_claude_cli.py` no lugar do CLI real, sem rede:
+
+    FAKE_CLAUDE_STARTUP=1.5 python3 bench_worker_pool.py --rounds 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from claude_handler import SessionConfig
+from worker_pool import WorkerPool
+
+FAKE_CLI = [sys.executable, str(Path(__file__).with_name("fake_claude_cli.py"))]
+
+
+async def first_token(pool: WorkerPool, session_id: str, config: SessionConfig) -> float:
+    """Mede do acquire até o primeiro evento de texto e completa o turno."""
+    started = time.perf_counter()
+    ttft = None
+    worker = await pool.acquire(session_id, config)
+    try:
+        async for event in worker.run_turn("ping"):
+            if ttft is None and event.get("type") == "assistant":
+                ttft = time.perf_counter() - started
+    finally:
+        await pool.release(worker)
+    return ttft
+
+
+async def run(rounds: int, warmup_wait: float):
+    config = SessionConfig()
+    results = {"cold": [], "warm": [], "reused": []}
+
+    pool = WorkerPool(command=FAKE_CLI, max_size=rounds * 2 + 2, prewarm=0)
+    for _ in range(rounds):
+        results["cold"].append(await first_token(pool, str(uuid.uuid4()), config))
+    await pool.close()
+
+    pool = WorkerPool(command=FAKE_CLI, max_size=rounds * 2 + 2, prewarm=1)
+    for _ in range(rounds):
+        await pool.prewarm(config, 1)
+        # Dá tempo para a reserva terminar de inicializar
+        await asyncio.sleep(warmup_wait)
+        session_id = str(uuid.uuid4())
+        results["warm"].append(await first_token(pool, session_id, config))
+        results["reused"].append(await first_token(pool, session_id, config))
+    print(f"pool: {pool.stats()}")
+    await pool.close()
+
+    for name, samples in results.items():
+        print(
+            f"{name:>7}: mediana {statistics.median(samples) * 1000:8.1f} ms"
+            f"  max {max(samples) * 1000:8.1f} ms  (n={len(samples)})"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--warmup-wait", type=float, default=2.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.rounds, args.warmup_wait))
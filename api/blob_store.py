@@ -0,0 +1,242 @@
+"""Armazenamento endereçado por conteúdo para resultados grandes de ferramentas."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BLOB_ID = re.compile(r"^[0-9a-f]{64}$")
+
+# Tipo gravado na extensão do arquivo; o conteúdo nunca é inspecionado
+MEDIA_TYPES = {".json": "application/json", ".txt": "text/plain; charset=utf-8"}
+
+# Leitura dos blobs servidos por /api/blobs
+READ_CHUNK = 64 * 1024
+
+
+def _text_of(content: Any) -> str:
+    """Texto de um `content` de tool_result (string ou lista de blocos)."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "") for block in content
+            if isinstance(block, dict) and block.get("type") == "text"
+        )
+    return ""
+
+
+def _approx_size(content: Any) -> int:
+    """Limite inferior barato do tamanho serializado, sem serializar."""
+    if isinstance(content, str):
+        # Cada caractere ocupa ao menos um byte
+        return len(content)
+    size = 0
+    for block in content if isinstance(content, list) else ():
+        if isinstance(block, dict):
+            size += len(block.get("text") or "") + len((block.get("source") or {}).get("data") or "")
+    return size
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """`(início, fim inclusivo)` de um header `Range: bytes=...` com um intervalo.
+
+    Retorna None sem header (ou com vários intervalos, servidos inteiros) e
+    levanta ValueError se o intervalo não puder ser atendido.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Sufixo: os últimos N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        raise ValueError("Range inválido")
+    if start >= size or end < start:
+        raise ValueError("Range fora do blob")
+    return start, min(end, size - 1)
+
+
+class BlobStore:
+    """Blobs em `{dir}/{id[:2]}/{id}.{json|txt}`, com id = sha256 do conteúdo.
+
+    Resultados de ferramenta acima de `threshold` bytes saem do stream e do
+    buffer de replay: o evento passa a levar só uma prévia e a referência
+    `blob` (id, tamanho, tipo e URL). Conteúdos iguais são gravados uma vez.
+    Hash e escrita rodam numa thread; acima de `max_bytes` os blobs usados
+    há mais tempo são removidos. O tipo é decidido na escrita (string ou
+    lista de blocos) e guardado na extensão.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        threshold: int = 32 * 1024,
+        preview_chars: int = 512,
+        max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.threshold = threshold
+        self.preview_chars = preview_chars
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blob-store")
+        self._total: Optional[int] = None
+        # id -> extensão dos blobs já vistos: evita sondar o disco por tipo
+        self._suffixes: Dict[str, str] = {}
+        self.stored = 0
+        self.deduplicated = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["BlobStore"]:
+        """Cria o store se `BLOB_STORE_DIR` estiver definido."""
+        directory = os.getenv("BLOB_STORE_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            threshold=int(os.getenv("BLOB_THRESHOLD_BYTES", str(32 * 1024))),
+            preview_chars=int(os.getenv("BLOB_PREVIEW_CHARS", "512")),
+            max_bytes=int(os.getenv("BLOB_STORE_MAX_BYTES", str(1024 * 1024 * 1024))),
+        )
+
+    def path(self, blob_id: str) -> Optional[str]:
+        """Caminho do blob, ou None se o id for inválido ou não existir."""
+        if not BLOB_ID.match(blob_id):
+            return None
+        base = os.path.join(self.directory, blob_id[:2], blob_id)
+        known = self._suffixes.get(blob_id)
+        if known is not None and os.path.isfile(base + known):
+            return base + known
+        for suffix in MEDIA_TYPES:
+            if suffix != known and os.path.isfile(base + suffix):
+                self._suffixes[blob_id] = suffix
+                return base + suffix
+        self._suffixes.pop(blob_id, None)
+        return None
+
+    async def externalize(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Troca o `content` de um tool_result grande por prévia e referência."""
+        content = event.get("content")
+        if _approx_size(content) <= self.threshold:
+            return event
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(self._executor, self._store, content)
+        if stored is None:
+            return event
+        blob_id, size, media_type = stored
+        preview = _text_of(content)[:self.preview_chars]
+        return {
+            **event,
+            "content": preview,
+            "blob": {
+                "id": blob_id,
+                "size": size,
+                "media_type": media_type,
+                "url": f"/api/blobs/{blob_id}",
+            },
+        }
+
+    @staticmethod
+    def media_type(path: str) -> str:
+        """Tipo registrado na escrita do blob."""
+        return MEDIA_TYPES[os.path.splitext(path)[1]]
+
+    def read(self, path: str, start: int, end: int) -> Iterator[bytes]:
+        """Bytes `start..end` (inclusivo) do blob, em pedaços."""
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "bytes": self._total,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "evicted": self.evicted,
+        }
+
+    def _store(self, content: Any) -> Optional[Tuple[str, int, str]]:
+        if isinstance(content, str):
+            data = content.encode()
+            suffix = ".txt"
+        else:
+            data = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+            suffix = ".json"
+        if len(data) <= self.threshold:
+            return None
+        blob_id = hashlib.sha256(data).hexdigest()
+        folder = os.path.join(self.directory, blob_id[:2])
+        path = os.path.join(folder, blob_id + suffix)
+        if self._total is None:
+            self._total = self._scan()
+        if os.path.exists(path):
+            # Marca como recente para a limpeza por LRU
+            os.utime(path)
+            self.deduplicated += 1
+        else:
+            os.makedirs(folder, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._total += len(data)
+            self.stored += 1
+            if self._total > self.max_bytes:
+                self._evict(keep=path)
+        self._suffixes[blob_id] = suffix
+        return blob_id, len(data), MEDIA_TYPES[suffix]
+
+    def _blobs(self) -> List[Tuple[float, int, str]]:
+        blobs = []
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        return blobs
+
+    def _scan(self) -> int:
+        return sum(size for _, size, _ in self._blobs())
+
+    def _evict(self, keep: str):
+        """Remove os blobs menos recentes até caber em 90% de `max_bytes`."""
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(self._blobs()):
+            if self._total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            self._total -= size
+            self.evicted += 1
+            self._suffixes.pop(os.path.splitext(os.path.basename(path))[0], None)
+        logger.info("Blob store reduzido para %d bytes", self._total)
@@ -0,0 +1,260 @@
+"""Orçamentos de tokens e custo por sessão, IP e chave de API em janelas deslizantes."""
+
+import hashlib
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import BUDGET
+
+SCOPES = ("session", "ip", "key")
+
+# Registros entre varreduras das janelas vazias
+PRUNE_EVERY = 1000
+
+
+class BudgetExceededError(Exception):
+    """O orçamento rígido de algum escopo foi atingido."""
+
+    def __init__(self, message: str, retry_after: int, scope: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+class UsageWindow:
+    """Soma de tokens e custo dos últimos `buckets * width` segundos.
+
+    Um anel de baldes com os totais correntes: registrar é O(1) e avançar o
+    tempo só zera os baldes que saíram da janela.
+    """
+
+    __slots__ = ("width", "tokens", "cost", "_head", "_slots")
+
+    def __init__(self, width: float, buckets: int):
+        self.width = width
+        self.tokens = 0
+        self.cost = 0.0
+        self._head = 0
+        # [índice do balde, tokens, custo]
+        self._slots: List[List[Any]] = [[0, 0, 0.0] for _ in range(buckets)]
+
+    def add(self, now: float, tokens: int, cost: float):
+        slot = self._advance(now)
+        slot[1] += tokens
+        slot[2] += cost
+        self.tokens += tokens
+        self.cost += cost
+
+    def totals(self, now: float) -> Tuple[int, float]:
+        self._advance(now)
+        return self.tokens, self.cost
+
+    def retry_after(self, now: float, tokens: int, cost: float) -> float:
+        """Segundos até o uso da janela cair abaixo dos limites dados (0 = sem limite)."""
+        self._advance(now)
+        used_tokens, used_cost = self.tokens, self.cost
+        size = len(self._slots)
+        for index in range(self._head - size + 1, self._head + 1):
+            slot = self._slots[index % size]
+            if slot[0] == index:
+                used_tokens -= slot[1]
+                used_cost -= slot[2]
+            if (not tokens or used_tokens < tokens) and (not cost or used_cost < cost):
+                # O balde `index` sai da janela quando o atual passar de index + size - 1
+                return max(0.0, (index + size) * self.width - now)
+        return self.width * size
+
+    def _advance(self, now: float) -> List[Any]:
+        index = int(now // self.width)
+        size = len(self._slots)
+        if index != self._head:
+            # Zera os baldes entre o último usado e o atual (no máximo uma volta)
+            for stale in range(max(self._head + 1, index - size + 1), index + 1):
+                slot = self._slots[stale % size]
+                self.tokens -= slot[1]
+                self.cost -= slot[2]
+                slot[0], slot[1], slot[2] = stale, 0, 0.0
+            self._head = index
+        return self._slots[index % size]
+
+
+class BudgetLimit:
+    """Limites rígidos de um escopo; o flexível é `soft_ratio` deles (0 = sem limite)."""
+
+    __slots__ = ("tokens", "cost")
+
+    def __init__(self, tokens: int = 0, cost: float = 0.0):
+        self.tokens = tokens
+        self.cost = cost
+
+    def __bool__(self) -> bool:
+        return bool(self.tokens or self.cost)
+
+
+class BudgetLedger:
+    """Contabiliza uso e decide a admissão de turnos.
+
+    O uso chega dos eventos `result` (via `ClaudeHandler.on_usage`) e é
+    somado na janela da sessão e nas do IP e da chave de API associados a
+    ela. Antes do turno, `admit` rejeita com `BudgetExceededError` se algum
+    limite rígido foi atingido; acima do limite flexível o turno é admitido
+    com um teto de tokens de saída (o que falta até o rígido), e é cortado
+    ao passar dele.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, BudgetLimit]] = None,
+        window: float = 3600.0,
+        buckets: int = 60,
+        soft_ratio: float = 0.8,
+    ):
+        self.limits = {scope: (limits or {}).get(scope) or BudgetLimit() for scope in SCOPES}
+        self.window = window
+        self.buckets = buckets
+        self.soft_ratio = soft_ratio
+        self._windows: Dict[str, Dict[str, UsageWindow]] = {scope: {} for scope in SCOPES}
+        # session_id -> (ip, chave) a quem o uso da sessão também é cobrado
+        self._owners: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        # session_id -> escopo que impôs o teto do turno atual
+        self._capped_by: Dict[str, str] = {}
+        self._records = 0
+        self.rejected = 0
+        self.truncated = 0
+
+    @classmethod
+    def from_env(cls) -> "BudgetLedger":
+        """Cria o controle a partir das variáveis de ambiente."""
+        limits = {
+            scope: BudgetLimit(
+                tokens=int(os.getenv(f"BUDGET_{scope.upper()}_TOKENS", "0")),
+                cost=float(os.getenv(f"BUDGET_{scope.upper()}_COST", "0")),
+            )
+            for scope in SCOPES
+        }
+        return cls(
+            limits=limits,
+            window=float(os.getenv("BUDGET_WINDOW", "3600")),
+            soft_ratio=float(os.getenv("BUDGET_SOFT_RATIO", "0.8")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.limits.values())
+
+    @staticmethod
+    def key_id(api_key: Optional[str]) -> Optional[str]:
+        """Identificador da chave de API sem guardar a chave em si."""
+        if not api_key:
+            return None
+        return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    def bind(self, session_id: str, client_ip: Optional[str], key: Optional[str]):
+        """Associa a sessão ao IP e à chave que pagam pelo seu uso."""
+        if client_ip or key:
+            self._owners[session_id] = (client_ip, key)
+
+    def forget(self, session_id: str):
+        """Esquece a sessão removida (o uso já cobrado do IP e da chave continua)."""
+        self._owners.pop(session_id, None)
+        self._capped_by.pop(session_id, None)
+        self._windows["session"].pop(session_id, None)
+
+    def record(self, session_id: str, tokens: int, cost: float):
+        """Soma o uso de um turno; O(1), chamado no caminho do stream."""
+        if not self.enabled:
+            return
+        now = time.time()
+        client_ip, key = self._owners.get(session_id, (None, None))
+        for scope, subject in (("session", session_id), ("ip", client_ip), ("key", key)):
+            if subject is not None and self.limits[scope]:
+                self._window(scope, subject).add(now, tokens, cost)
+        self._records += 1
+        if self._records % PRUNE_EVERY == 0:
+            self.prune(now)
+
+    def admit(
+        self,
+        session_id: Optional[str],
+        client_ip: Optional[str] = None,
+        key: Optional[str] = None,
+    ) -> Optional[int]:
+        """Teto de tokens de saída do próximo turno (None = sem teto).
+
+        Levanta `BudgetExceededError` com o `retry_after` até a janela liberar
+        espaço quando algum limite rígido foi atingido. Sem `session_id` só
+        verifica o IP e a chave.
+        """
+        if not self.enabled:
+            return None
+        if session_id is not None:
+            self.bind(session_id, client_ip, key)
+            self._capped_by.pop(session_id, None)
+        now = time.time()
+        cap: Optional[int] = None
+        for scope, subject in (("session", session_id), ("ip", client_ip), ("key", key)):
+            limit = self.limits[scope]
+            window = self._windows[scope].get(subject) if subject is not None else None
+            if not limit or window is None:
+                continue
+            tokens, cost = window.totals(now)
+            if (limit.tokens and tokens >= limit.tokens) or (limit.cost and cost >= limit.cost):
+                self.rejected += 1
+                BUDGET.inc(1, scope, "rejected")
+                retry_after = window.retry_after(now, limit.tokens, limit.cost)
+                raise BudgetExceededError(
+                    f"Orçamento de uso por {scope} esgotado", max(1, int(retry_after + 0.999)), scope
+                )
+            remaining = self._remaining(limit, tokens, cost)
+            if remaining is not None and (cap is None or remaining < cap):
+                cap = remaining
+                if session_id is not None:
+                    self._capped_by[session_id] = scope
+        return cap
+
+    def truncate(self, session_id: str):
+        """Registra um turno cortado pelo teto do limite flexível."""
+        self.truncated += 1
+        BUDGET.inc(1, self._capped_by.get(session_id, "session"), "truncated")
+
+    def usage(self, scope: str, subject: str) -> Dict[str, Any]:
+        """Uso na janela atual e os limites do escopo."""
+        window = self._windows[scope].get(subject)
+        tokens, cost = window.totals(time.time()) if window is not None else (0, 0.0)
+        limit = self.limits[scope]
+        return {"tokens": tokens, "cost_usd": round(cost, 6), "max_tokens": limit.tokens, "max_cost_usd": limit.cost}
+
+    def prune(self, now: Optional[float] = None):
+        """Descarta janelas sem uso dentro do período."""
+        now = time.time() if now is None else now
+        for windows in self._windows.values():
+            for subject, window in list(windows.items()):
+                tokens, cost = window.totals(now)
+                if not tokens and cost <= 0:
+                    del windows[subject]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "tracked": {scope: len(windows) for scope, windows in self._windows.items()},
+            "rejected": self.rejected,
+            "truncated": self.truncated,
+        }
+
+    def _window(self, scope: str, subject: str) -> UsageWindow:
+        window = self._windows[scope].get(subject)
+        if window is None:
+            window = self._windows[scope][subject] = UsageWindow(self.window / self.buckets, self.buckets)
+        return window
+
+    def _remaining(self, limit: BudgetLimit, tokens: int, cost: float) -> Optional[int]:
+        """Tokens até o limite rígido, se o uso já passou do flexível."""
+        remaining: Optional[int] = None
+        if limit.tokens and tokens >= limit.tokens * self.soft_ratio:
+            remaining = limit.tokens - tokens
+        if limit.cost and cost >= limit.cost * self.soft_ratio and tokens:
+            # Converte o custo restante pelo preço médio por token da janela
+            by_cost = int((limit.cost - cost) / (cost / tokens))
+            remaining = by_cost if remaining is None else min(remaining, by_cost)
+        return None if remaining is None else max(1, remaining)
@@ -1,59 +1,454 @@
-"""Handler simplificado para Claude sem SDK."""
+"""Handler para Claude via processos do Claude Code CLI."""
 
 import asyncio
-from typing import AsyncGenerator, Optional, Dict, Any
-from dataclasses import dataclass
-import json
+from typing import AsyncGenerator, Callable, Optional, Dict, Any, List, Tuple
+from dataclasses import dataclass, asdict, astuple
+from datetime import datetime
+import os
+import shutil
 import time
+import weakref
 
-@dataclass
+from worker_pool import WorkerPool, WorkerError, PoolExhaustedError
+from session_store import SessionStore, store_from_env
+from response_cache import ResponseCache, replay_events
+from blob_store import BlobStore
+from config_profile import ToolRules, config_profile
+from compaction import HistoryCompactor, history_entry, ROLE_LABELS
+from metrics import COST, TOKENS
+
+# Recebe (session_id, tokens, custo) a cada evento `result`
+UsageListener = Callable[[str, int, float], None]
+
+# Histórico reenviado (em caracteres) quando um worker novo assume uma sessão
+CONTEXT_REPLAY_CHARS = 20000
+
+
+class SnapshotLimitError(Exception):
+    """A sessão já tem o máximo de snapshots."""
+
+
+@dataclass(frozen=True, slots=True, weakref_slot=True)
 class SessionConfig:
-    """Configuração de sessão."""
-    session_id: str
+    """Configuração de sessão (imutável; instâncias iguais são compartilhadas)."""
+    system_prompt: Optional[str] = None
+    allowed_tools: Tuple[str, ...] = ()
+    max_turns: Optional[int] = None
+    permission_mode: str = "acceptEdits"
+    cwd: Optional[str] = None
     max_tokens: int = 4096
     temperature: float = 0.7
-    
+
+    def __post_init__(self):
+        object.__setattr__(self, "allowed_tools", tuple(self.allowed_tools or ()))
+
+# Configurações em uso, uma instância por combinação de valores
+_configs: "weakref.WeakValueDictionary[tuple, SessionConfig]" = weakref.WeakValueDictionary()
+
+def intern_config(config: SessionConfig) -> SessionConfig:
+    """Instância canônica da configuração (milhares de sessões usam poucas)."""
+    key = astuple(config)
+    canonical = _configs.get(key)
+    if canonical is None:
+        _configs[key] = canonical = config
+    return canonical
+
 class ClaudeHandler:
-    """Handler básico para simular respostas do Claude."""
-    
-    def __init__(self):
-        self.sessions = {}
-        
-    async def create_session(self, config: SessionConfig) -> Dict[str, Any]:
+    """Handler que encaminha turnos para workers do CLI pré-aquecidos.
+
+    Sem o CLI instalado, as respostas são simuladas localmente.
+    """
+
+    def __init__(
+        self,
+        pool: Optional[WorkerPool] = None,
+        store: Optional[SessionStore] = None,
+        cache: Optional[ResponseCache] = None,
+        blobs: Optional[BlobStore] = None,
+        max_snapshots: Optional[int] = None
+    ):
+        self.store = store or store_from_env()
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+        # Resultados de ferramenta grandes vão para o disco em vez do stream
+        self.blobs = blobs if blobs is not None else BlobStore.from_env()
+        self.compactor = HistoryCompactor.from_env(self.store)
+        if pool is None:
+            pool = WorkerPool.from_env()
+            if not shutil.which(pool.command[0]):
+                pool = None
+        self.pool = pool
+        self.max_snapshots = (
+            max_snapshots if max_snapshots is not None
+            else int(os.getenv("SESSION_MAX_SNAPSHOTS", "20"))
+        )
+        self._usage_listeners: List[UsageListener] = []
+
+    def on_usage(self, listener: UsageListener):
+        """Registra um callback síncrono chamado com o uso de cada turno."""
+        self._usage_listeners.append(listener)
+
+    async def create_session(
+        self,
+        session_id: str,
+        config: Optional[SessionConfig] = None
+    ) -> Dict[str, Any]:
         """Cria uma nova sessão."""
-        self.sessions[config.session_id] = {
-            "config": config,
-            "history": [],
-            "created_at": time.time()
-        }
-        return {"session_id": config.session_id, "status": "created"}
-    
+        config = config or SessionConfig()
+        await self.store.create(session_id, config, time.time())
+        # Aquece um worker para a configuração antes do primeiro turno
+        if self.pool is not None:
+            self.pool.prewarm_later(config)
+        return {"session_id": session_id, "status": "created"}
+
     async def send_message(
-        self, 
+        self,
         session_id: str,
-        message: str
-    ) -> AsyncGenerator[str, None]:
-        """Envia mensagem e retorna resposta simulada."""
-        
-        # Simula resposta do Claude
+        message: str,
+        pin: bool = False
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Envia mensagem e emite os eventos estruturados da resposta.
+
+        Com `pin=True` a mensagem do usuário nunca é resumida pela compactação.
+        """
+        user_entry = history_entry("user", message, **({"pinned": True} if pin else {}))
+        config = await self.store.get_config(session_id)
+        if config is None:
+            await self.create_session(session_id)
+            config = await self.store.get_config(session_id)
+        profile = config_profile(config)
+
+        # Só o primeiro turno de sessões sem ferramentas é cacheável:
+        # depois dele a resposta depende do histórico
+        fingerprint = None
+        if self.cache is not None and self.cache.cacheable(config):
+            meta = await self.store.get_meta(session_id)
+            if meta and meta["message_count"] == 0:
+                fingerprint = profile.fingerprint
+                entry = self.cache.lookup(fingerprint, message)
+                if entry is not None:
+                    await self.store.append_history(
+                        session_id,
+                        user_entry,
+                        history_entry("assistant", entry.text, cached=True)
+                    )
+                    for event in replay_events(entry):
+                        yield event
+                    return
+
+        await self.store.append_history(session_id, user_entry)
+        # Esta réplica passa a manter o worker da sessão
+        await self.store.claim(session_id)
+
+        if self.pool is None:
+            async for chunk in self._simulate(message):
+                yield chunk
+            await self.store.append_history(
+                session_id,
+                history_entry("assistant", f"Esta é uma resposta simulada para: {message}")
+            )
+            await self._schedule_compaction(session_id)
+            return
+
+        try:
+            worker = await self.pool.acquire(session_id, config)
+        except PoolExhaustedError as e:
+            yield {"type": "error", "error": str(e)}
+            return
+
+        reply = []
+        result = None
+        used_tools = False
+        emitted = False
+        try:
+            while True:
+                prompt = await self._with_context(worker, session_id, message)
+                try:
+                    async for event in worker.run_turn(prompt):
+                        for item in self._translate(event, profile.tools):
+                            if item["type"] == "assistant_text":
+                                reply.append(item["content"])
+                            elif item["type"] in ("tool_use", "tool_result"):
+                                used_tools = True
+                                if item["type"] == "tool_result" and self.blobs is not None:
+                                    item = await self.blobs.externalize(item)
+                            elif item["type"] == "result":
+                                result = item
+                                await self.store.add_usage(
+                                    session_id,
+                                    item["input_tokens"] + item["output_tokens"],
+                                    item["cost_usd"] or 0.0
+                                )
+                                self._record_usage(session_id, config, item)
+                            emitted = True
+                            yield item
+                    break
+                except WorkerError:
+                    if not worker.resumed or emitted:
+                        raise
+                # O CLI não retomou a conversa do fork: um worker novo recebe o histórico
+                await self.pool.release(worker)
+                worker = await self.pool.acquire(session_id, config)
+        except (WorkerError, PoolExhaustedError) as e:
+            yield {"type": "error", "error": str(e)}
+        finally:
+            await self.pool.release(worker)
+            if reply:
+                await self.store.append_history(
+                    session_id, history_entry("assistant", "".join(reply))
+                )
+                await self._schedule_compaction(session_id)
+
+        if fingerprint and result and not result.get("is_error") and not used_tools and reply:
+            self.cache.store(
+                fingerprint, message, "".join(reply),
+                result["input_tokens"], result["output_tokens"]
+            )
+
+    def _record_usage(self, session_id: str, config: SessionConfig, result: Dict[str, Any]):
+        """Tokens e custo do turno nas métricas, agrupados por configuração, e nos listeners."""
+        label = config_profile(config).label
+        TOKENS.inc(result["input_tokens"], label, "input")
+        TOKENS.inc(result["output_tokens"], label, "output")
+        COST.inc(result["cost_usd"] or 0.0, label)
+        for listener in self._usage_listeners:
+            listener(session_id, result["input_tokens"] + result["output_tokens"], result["cost_usd"] or 0.0)
+
+    async def _schedule_compaction(self, session_id: str):
+        """Dispara a compactação em background se o histórico cresceu demais."""
+        meta = await self.store.get_meta(session_id)
+        if meta is not None:
+            self.compactor.maybe_schedule(session_id, meta["history_tokens"])
+
+    async def _with_context(self, worker, session_id: str, message: str) -> str:
+        """Prefixa o histórico quando o worker ainda não viu a conversa.
+
+        Acontece com respostas servidas do cache, workers despejados do pool
+        ou sessões vindas de outra réplica.
+        """
+        if worker.turns or worker.resumed:
+            return message
+        history = (await self.store.get_history(session_id))[:-1]
+        if not history:
+            return message
+        lines = []
+        size = 0
+        for entry in reversed(history):
+            line = f"{ROLE_LABELS.get(entry['role'], entry['role'])}: {entry['content']}"
+            size += len(line)
+            if size > CONTEXT_REPLAY_CHARS:
+                break
+            lines.append(line)
+        transcript = "\n\n".join(reversed(lines))
+        return f"Conversa anterior:\n\n{transcript}\n\nNova mensagem:\n\n{message}"
+
+    def _translate(self, event: Dict[str, Any], tools: Optional[ToolRules] = None) -> List[Dict[str, Any]]:
+        """Converte um evento stream-json do CLI para o formato da API.
+
+        `tool_use` fora do allow-set da configuração sai com `permitted: False`.
+        """
+        kind = event.get("type")
+        items = []
+        if kind == "assistant":
+            for block in event.get("message", {}).get("content", []):
+                if block.get("type") == "text":
+                    items.append({"type": "assistant_text", "content": block.get("text", "")})
+                elif block.get("type") == "tool_use":
+                    item = {
+                        "type": "tool_use",
+                        "tool": block.get("name"),
+                        "id": block.get("id"),
+                        "input": block.get("input", {})
+                    }
+                    if tools is not None and not tools.allows(item["tool"], item["input"]):
+                        item["permitted"] = False
+                    items.append(item)
+        elif kind == "user":
+            content = event.get("message", {}).get("content", [])
+            for block in content if isinstance(content, list) else []:
+                if block.get("type") == "tool_result":
+                    items.append({
+                        "type": "tool_result",
+                        "tool_id": block.get("tool_use_id"),
+                        "content": block.get("content")
+                    })
+        elif kind == "result":
+            usage = event.get("usage") or {}
+            item = {
+                "type": "result",
+                "input_tokens": usage.get("input_tokens", 0),
+                "output_tokens": usage.get("output_tokens", 0),
+                "cost_usd": event.get("total_cost_usd", 0.0)
+            }
+            if event.get("is_error"):
+                item["is_error"] = True
+            items.append(item)
+        return items
+
+    async def _simulate(self, message: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """Resposta simulada usada quando o CLI não está disponível."""
         response = f"Esta é uma resposta simulada para: {message}"
-        
+
         # Simula streaming
         words = response.split()
         for word in words:
-            yield json.dumps({
-                "type": "text",
-                "content": word + " "
-            })
+            yield {"type": "assistant_text", "content": word + " "}
             await asyncio.sleep(0.05)
-            
-        # Marca fim da resposta
-        yield json.dumps({
-            "type": "end",
-            "content": ""
-        })
-    
+
+    async def interrupt_session(self, session_id: str) -> bool:
+        """Interrompe o turno em andamento no worker da sessão."""
+        if self.pool is None:
+            return False
+        worker = self.pool.get(session_id)
+        return worker is not None and await worker.interrupt()
+
+    async def update_session_config(self, session_id: str, config: SessionConfig) -> bool:
+        """Troca a configuração mantendo o histórico.
+
+        Configuração idêntica não faz nada; mudanças fora do fingerprint
+        (`max_tokens`, `temperature`) mantêm o worker da sessão.
+        """
+        current = await self.store.get_config(session_id)
+        if current is None:
+            return False
+        if current == config:
+            return True
+        if not await self.store.set_config(session_id, config):
+            return False
+        # O worker atual foi iniciado com a configuração antiga
+        if self.pool is not None and config_profile(current).fingerprint != config_profile(config).fingerprint:
+            await self.pool.discard(session_id)
+        return True
+
+    async def fork_session(self, source_id: str, target_id: str, at: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Cria `target_id` com as primeiras `at` mensagens de `source_id` (todas sem `at`).
+
+        O histórico é compartilhado com a origem (copy-on-write). Num fork do
+        fim da conversa com o worker da origem ocioso, o worker da cópia retoma
+        a conversa salva pelo CLI em vez de receber o histórico de novo.
+        Retorna None sem a origem; levanta ValueError com `at` fora do histórico.
+        """
+        if not await self.store.fork(source_id, target_id, at, time.time()):
+            return None
+        source = await self.store.get_meta(source_id)
+        target = await self.store.get_meta(target_id)
+        resumed = (
+            self.pool is not None
+            and source is not None
+            and target["message_count"] == source["message_count"]
+            and self.pool.fork(source_id, target_id)
+        )
+        return {
+            "session_id": target_id,
+            "source_session_id": source_id,
+            "message_count": target["message_count"],
+            "resumed": resumed
+        }
+
+    async def snapshot_session(self, session_id: str, snapshot_id: str) -> Optional[Dict[str, Any]]:
+        """Guarda configuração e histórico atuais (O(1) em memória); None sem a sessão."""
+        if self.max_snapshots and len(await self.store.list_snapshots(session_id)) >= self.max_snapshots:
+            raise SnapshotLimitError(f"Máximo de {self.max_snapshots} snapshots por sessão")
+        return await self.store.snapshot(session_id, snapshot_id)
+
+    async def restore_session(self, session_id: str, snapshot_id: str) -> bool:
+        """Volta a sessão a um snapshot; o contexto do worker é descartado junto."""
+        if not await self.store.restore(session_id, snapshot_id):
+            return False
+        if self.pool is not None:
+            await self.pool.discard(session_id)
+        return True
+
+    async def clear_session(self, session_id: str):
+        """Limpa o histórico; o contexto do worker é descartado junto."""
+        await self.store.clear_history(session_id)
+        if self.pool is not None:
+            await self.pool.discard(session_id)
+
+    async def destroy_session(self, session_id: str):
+        """Remove a sessão e encerra seu worker."""
+        await self.close_session(session_id)
+
+    async def get_session_info(self, session_id: str) -> Dict[str, Any]:
+        """Informações da sessão no formato de `SessionInfoResponse`."""
+        meta = await self.store.get_meta(session_id)
+        config = await self.store.get_config(session_id)
+        if meta is None or config is None:
+            return {"error": "Session not found"}
+        config = asdict(config)
+        config["created_at"] = datetime.fromtimestamp(meta["created_at"]).isoformat()
+        return {
+            "session_id": session_id,
+            "active": True,
+            "config": config,
+            "history": self._history_info(meta),
+            "compaction": self.compactor.state(session_id, meta)
+        }
+
+    async def describe_sessions(self, summaries: List[Dict[str, Any]], fields: set) -> List[Dict[str, Any]]:
+        """Completa resumos do store só com os campos pedidos.
+
+        `fields` pode conter `config`, `history` e `compaction`; sem eles a
+        listagem não lê configuração nem agrega histórico.
+        """
+        described = []
+        for summary in summaries:
+            item = dict(summary)
+            if summary.get("deleted"):
+                described.append(item)
+                continue
+            item["created_at"] = datetime.fromtimestamp(summary["created_at"]).isoformat()
+            item["updated_at"] = datetime.fromtimestamp(summary["updated_at"]).isoformat()
+            session_id = summary["session_id"]
+            if "config" in fields:
+                config = await self.store.get_config(session_id)
+                item["config"] = asdict(config) if config else None
+            if fields & {"history", "compaction"}:
+                meta = await self.store.get_meta(session_id)
+                if meta is not None:
+                    if "history" in fields:
+                        item["history"] = self._history_info(meta)
+                    if "compaction" in fields:
+                        item["compaction"] = self.compactor.state(session_id, meta)
+            described.append(item)
+        return described
+
+    def _history_info(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "message_count": meta["message_count"],
+            "total_tokens": meta["total_tokens"],
+            "total_cost": meta["total_cost"],
+            "replica": meta["replica"]
+        }
+
+    async def get_all_sessions(self) -> List[Dict[str, Any]]:
+        """Informações de todas as sessões."""
+        sessions = []
+        for session_id in await self.store.list_ids():
+            info = await self.get_session_info(session_id)
+            if "error" not in info:
+                sessions.append(info)
+        return sessions
+
+    async def startup(self):
+        """Inicia a limpeza do pool e aquece a configuração padrão."""
+        if self.pool is not None:
+            self.pool.start()
+            await self.pool.prewarm(SessionConfig(), self.pool.prewarm_count)
+
+    async def shutdown(self):
+        """Encerra os workers do pool e as conexões do store."""
+        await self.compactor.close()
+        if self.pool is not None:
+            await self.pool.close()
+        await self.store.close()
+
     async def close_session(self, session_id: str):
         """Fecha a sessão."""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
\ No newline at end of file
+        await self.store.delete(session_id)
+        await self.release_session(session_id)
+
+    async def release_session(self, session_id: str):
+        """Libera o worker e a compactação de uma sessão removida do store."""
+        self.compactor.discard(session_id)
+        if self.pool is not None:
+            await self.pool.discard(session_id)
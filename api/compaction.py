@@ -0,0 +1,155 @@
+"""Compactação incremental do histórico das sessões."""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from session_store import SessionStore
+
+Message = Dict[str, Any]
+Summarizer = Callable[[List[Message]], Awaitable[str]]
+
+ROLE_LABELS = {"user": "Usuário", "assistant": "Assistente", "system": "Resumo"}
+SUMMARY_HEADER = "Resumo da conversa anterior:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa barata de tokens (~4 caracteres por token)."""
+    return max(1, len(text) // 4)
+
+
+def history_entry(role: str, content: str, **extra: Any) -> Message:
+    """Mensagem do histórico já com a estimativa de tokens."""
+    return {"role": role, "content": content, "tokens": estimate_tokens(content), **extra}
+
+
+def extractive_summarizer(max_chars: int = 4000, per_message: int = 240) -> Summarizer:
+    """Resumo local: início de cada mensagem; resumos anteriores são mantidos
+    e as linhas mais antigas saem quando passa de `max_chars`.
+    """
+    async def summarize(messages: List[Message]) -> str:
+        lines = []
+        size = 0
+        for entry in messages:
+            if entry.get("summary"):
+                # Resumo anterior entra como está, sem resumir de novo
+                new = str(entry.get("content", "")).replace(SUMMARY_HEADER, "", 1).splitlines()
+            else:
+                content = " ".join(str(entry.get("content", "")).split())
+                if len(content) > per_message:
+                    content = content[:per_message] + "…"
+                new = [f"- {ROLE_LABELS.get(entry.get('role'), entry.get('role'))}: {content}"]
+            lines.extend(new)
+            size += sum(len(line) + 1 for line in new)
+        # Mantém as linhas mais recentes dentro de `max_chars`
+        while size > max_chars and len(lines) > 1:
+            size -= len(lines.pop(0)) + 1
+        return "\n".join(lines)
+
+    return summarize
+
+
+class HistoryCompactor:
+    """Resume as mensagens antigas quando o histórico passa do limite.
+
+    As `keep_recent` mensagens finais (e o que couber em `target_tokens`)
+    ficam intactas; as anteriores viram uma única mensagem `system` com
+    `summary: true`. Mensagens com `pinned: true` nunca são resumidas.
+    A compactação roda em background e não bloqueia o turno.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore,
+        threshold_tokens: int = 8000,
+        target_tokens: int = 4000,
+        keep_recent: int = 6,
+        summarizer: Optional[Summarizer] = None,
+    ):
+        self.store = store
+        self.threshold_tokens = threshold_tokens
+        self.target_tokens = target_tokens
+        self.keep_recent = keep_recent
+        self.summarizer = summarizer or extractive_summarizer()
+        self._running: Dict[str, asyncio.Task] = {}
+        self.compactions = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, store: SessionStore) -> "HistoryCompactor":
+        """Cria o compactador a partir das variáveis de ambiente."""
+        return cls(
+            store,
+            threshold_tokens=int(os.getenv("HISTORY_COMPACT_THRESHOLD", "8000")),
+            target_tokens=int(os.getenv("HISTORY_COMPACT_TARGET", "4000")),
+            keep_recent=int(os.getenv("HISTORY_KEEP_RECENT", "6")),
+        )
+
+    def maybe_schedule(self, session_id: str, history_tokens: int):
+        """Agenda a compactação se o histórico passou do limite."""
+        if history_tokens < self.threshold_tokens or session_id in self._running:
+            return
+        task = asyncio.create_task(self.compact(session_id))
+        self._running[session_id] = task
+        task.add_done_callback(lambda _: self._running.pop(session_id, None))
+
+    def running(self, session_id: str) -> bool:
+        return session_id in self._running
+
+    def state(self, session_id: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Estado de compactação exposto em `SessionInfoResponse`."""
+        last = meta.get("last_compacted_at")
+        return {
+            "history_tokens": meta.get("history_tokens", 0),
+            "threshold_tokens": self.threshold_tokens,
+            "compactions": meta.get("compactions", 0),
+            "compacted_messages": meta.get("compacted_messages", 0),
+            "last_compacted_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(last)) if last else None,
+            "running": self.running(session_id),
+        }
+
+    async def compact(self, session_id: str) -> bool:
+        """Compacta o histórico da sessão; retorna True se algo foi resumido."""
+        history = await self.store.get_history(session_id)
+
+        # Mantém as mensagens recentes até o alvo de tokens
+        split = len(history)
+        kept_tokens = 0
+        while split > 0:
+            tokens = history[split - 1].get("tokens", 0)
+            if len(history) - split >= self.keep_recent and kept_tokens + tokens > self.target_tokens:
+                break
+            kept_tokens += tokens
+            split -= 1
+
+        older = history[:split]
+        to_summarize = [m for m in older if not m.get("pinned")]
+        if len(to_summarize) < 2:
+            return False
+
+        try:
+            summary = await self.summarizer(to_summarize)
+        except Exception:
+            self.failures += 1
+            return False
+
+        replacement = [history_entry("system", SUMMARY_HEADER + summary, summary=True)]
+        replacement += [m for m in older if m.get("pinned")]
+        if not await self.store.compact_history(session_id, older, replacement):
+            # O histórico mudou no meio (limpeza ou outra compactação)
+            return False
+        self.compactions += 1
+        return True
+
+    def discard(self, session_id: str):
+        """Cancela a compactação em andamento da sessão."""
+        task = self._running.get(session_id)
+        if task is not None:
+            task.cancel()
+
+    async def close(self):
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,227 @@
+"""Compressão dos streams SSE sem atrasar os frames.
+
+Um compressor por stream mantém o contexto (dicionário) entre os frames, e
+cada frame sai com sync-flush: o cliente decodifica o evento na hora e os
+frames seguintes aproveitam as repetições dos anteriores (`"type"`,
+`"session_id"`...). brotli e zstd são opcionais; gzip sempre está disponível.
+"""
+
+import os
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Optional, Sequence
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependência opcional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - dependência opcional
+    zstandard = None
+
+from metrics import COMPRESSION_BYTES, COMPRESSION_SECONDS
+
+# Níveis baratos: os frames são pequenos e o ganho vem do contexto compartilhado
+DEFAULT_LEVELS = {"gzip": 6, "br": 5, "zstd": 3}
+
+
+class StreamCompressor(ABC):
+    """Compressor incremental com flush a cada chamada."""
+
+    encoding = "identity"
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        """Comprime `data` e devolve tudo o que o cliente já pode decodificar."""
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        """Fecha o stream comprimido."""
+
+
+class GzipCompressor(StreamCompressor):
+    encoding = "gzip"
+
+    def __init__(self, level: int):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(StreamCompressor):
+    encoding = "br"
+
+    def __init__(self, level: int):
+        self._obj = brotli.Compressor(quality=level, mode=brotli.MODE_TEXT)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+class ZstdCompressor(StreamCompressor):
+    encoding = "zstd"
+
+    def __init__(self, level: int):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+COMPRESSORS = {"gzip": GzipCompressor}
+if brotli is not None:
+    COMPRESSORS["br"] = BrotliCompressor
+if zstandard is not None:
+    COMPRESSORS["zstd"] = ZstdCompressor
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Codificações aceitas e seus pesos `q`."""
+    accepted: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+class SSECompression:
+    """Negocia a codificação com o `Accept-Encoding` e comprime os streams.
+
+    `encodings` é a ordem de preferência do servidor (só as instaladas são
+    usadas); sem nenhuma, a compressão fica desligada. O tempo gasto
+    comprimindo é medido: acima de `cpu_budget` (fração de um núcleo, na
+    janela de `window` segundos) os streams novos saem sem compressão, e os
+    já iniciados continuam com o contexto que têm.
+    """
+
+    def __init__(
+        self,
+        encodings: Sequence[str] = (),
+        levels: Optional[Dict[str, int]] = None,
+        cpu_budget: float = 0.5,
+        window: float = 10.0,
+    ):
+        self.encodings = [name for name in encodings if name in COMPRESSORS]
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.cpu_budget = cpu_budget
+        self.window = window
+        self._window_start = time.monotonic()
+        self._spent = 0.0
+        self._previous = 0.0
+        self.streams = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_env(cls) -> "SSECompression":
+        """Cria a partir de `SSE_COMPRESSION` (ex.: `zstd,br,gzip`; vazio desliga)."""
+        encodings = [name.strip().lower() for name in os.getenv("SSE_COMPRESSION", "").split(",") if name.strip()]
+        level = os.getenv("SSE_COMPRESSION_LEVEL")
+        return cls(
+            encodings,
+            levels={name: int(level) for name in encodings} if level else None,
+            cpu_budget=float(os.getenv("SSE_COMPRESSION_CPU_BUDGET", "0.5")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.encodings)
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """Codificação a usar no stream, ou None para enviar sem compressão."""
+        if not self.encodings:
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        best = None
+        best_q = 0.0
+        for name in self.encodings:
+            q = accepted.get(name, wildcard)
+            if q > best_q:
+                best, best_q = name, q
+        if best is not None and self._over_budget():
+            self.skipped += 1
+            return None
+        return best
+
+    async def wrap(self, frames: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+        """Comprime cada frame com flush, mantendo o contexto do stream."""
+        compressor = COMPRESSORS[encoding](self.levels[encoding])
+        self.streams += 1
+        finished = False
+        try:
+            async for frame in frames:
+                started = time.perf_counter()
+                chunk = compressor.compress(frame)
+                self._charge(time.perf_counter() - started, encoding, len(frame), len(chunk))
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                # Conexão encerrada: descarta o contexto sem fechar o stream
+                await _aclose(frames)
+        tail = compressor.finish()
+        COMPRESSION_BYTES.inc(len(tail), encoding, "output")
+        yield tail
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "encodings": list(self.encodings),
+            "streams": self.streams,
+            "skipped": self.skipped,
+            "cpu_share": round(self._share(), 4),
+        }
+
+    def _charge(self, seconds: float, encoding: str, raw: int, compressed: int):
+        self._rotate()
+        self._spent += seconds
+        COMPRESSION_SECONDS.inc(seconds, encoding)
+        COMPRESSION_BYTES.inc(raw, encoding, "input")
+        COMPRESSION_BYTES.inc(compressed, encoding, "output")
+
+    def _rotate(self):
+        now = time.monotonic()
+        if now - self._window_start >= self.window:
+            # Janela anterior só conta se foi a imediatamente anterior
+            self._previous = self._spent if now - self._window_start < 2 * self.window else 0.0
+            self._spent = 0.0
+            self._window_start = now
+
+    def _share(self) -> float:
+        """Fração de um núcleo gasta comprimindo, suavizada entre duas janelas."""
+        self._rotate()
+        elapsed = time.monotonic() - self._window_start
+        weight = max(0.0, 1.0 - elapsed / self.window)
+        return (self._spent + self._previous * weight) / self.window
+
+    def _over_budget(self) -> bool:
+        return self.cpu_budget > 0 and self._share() > self.cpu_budget
+
+
+async def _aclose(frames: AsyncIterator[bytes]):
+    aclose = getattr(frames, "aclose", None)
+    if aclose is not None:
+        await aclose()
@@ -0,0 +1,120 @@
+"""Forma compilada de uma configuração de sessão: fingerprint e permissões.
+
+Calculada uma vez por configuração (as instâncias são internadas em
+`claude_handler.intern_config`) e reaproveitada pelo pool de workers, pelo
+cache de respostas, pelo índice do store e pelas métricas.
+"""
+
+import fnmatch
+import hashlib
+import json
+import weakref
+from dataclasses import asdict
+from typing import Any, Dict, FrozenSet, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from claude_handler import SessionConfig
+
+# Campos que alteram a resposta do modelo (e a linha de comando do worker)
+FINGERPRINT_FIELDS = ("system_prompt", "allowed_tools", "permission_mode", "cwd", "max_turns")
+
+# Ferramentas que o CLI executa sem pedir permissão
+READ_ONLY_TOOLS = frozenset({"Read", "Glob", "Grep", "LS", "NotebookRead", "TodoWrite", "Task"})
+EDIT_TOOLS = frozenset({"Edit", "MultiEdit", "Write", "NotebookEdit"})
+
+# Campo da entrada comparado com a regra `Ferramenta(especificador)`
+RULE_INPUT_FIELDS = ("command", "file_path", "notebook_path", "path", "url", "pattern")
+
+
+def canonical_config(config: "SessionConfig") -> Dict[str, Any]:
+    """Campos do fingerprint em forma canônica (ferramentas ordenadas e sem repetição)."""
+    data = asdict(config)
+    canonical = {name: data.get(name) for name in FINGERPRINT_FIELDS}
+    canonical["allowed_tools"] = sorted(set(canonical["allowed_tools"] or []))
+    return canonical
+
+
+class ToolRules:
+    """Allow-set compilado a partir de `allowed_tools` e `permission_mode`.
+
+    Nomes simples viram um frozenset; regras `Bash(git diff:*)` ou
+    `Edit(src/**)` viram padrões por ferramenta e `mcp__servidor` libera
+    todas as ferramentas do servidor.
+    """
+
+    __slots__ = ("allow_all", "names", "prefixes", "patterns")
+
+    def __init__(self, allowed_tools: Tuple[str, ...] = (), permission_mode: Optional[str] = None):
+        self.allow_all = permission_mode == "bypassPermissions"
+        names = set(READ_ONLY_TOOLS)
+        if permission_mode == "acceptEdits":
+            names |= EDIT_TOOLS
+        prefixes = []
+        patterns: Dict[str, list] = {}
+        for rule in allowed_tools:
+            rule = rule.strip()
+            tool, paren, spec = rule.partition("(")
+            if paren and spec.endswith(")"):
+                spec = spec[:-1]
+                if spec in ("", "*"):
+                    names.add(tool)
+                else:
+                    # "git diff:*" é um prefixo de comando
+                    patterns.setdefault(tool, []).append(spec[:-2] + "*" if spec.endswith(":*") else spec)
+            elif rule.startswith("mcp__") and rule.count("__") == 1:
+                prefixes.append(rule + "__")
+            elif rule:
+                names.add(rule)
+        self.names: FrozenSet[str] = frozenset(names)
+        self.prefixes: Tuple[str, ...] = tuple(prefixes)
+        self.patterns: Dict[str, Tuple[str, ...]] = {tool: tuple(specs) for tool, specs in patterns.items()}
+
+    def allows(self, tool: Optional[str], tool_input: Optional[Dict[str, Any]] = None) -> bool:
+        """Se o uso da ferramenta está pré-autorizado pela configuração."""
+        if self.allow_all or tool in self.names:
+            return True
+        if not tool:
+            return False
+        if self.prefixes and tool.startswith(self.prefixes):
+            return True
+        specs = self.patterns.get(tool)
+        if not specs or not tool_input:
+            return False
+        for field in RULE_INPUT_FIELDS:
+            value = tool_input.get(field)
+            if isinstance(value, str):
+                return any(fnmatch.fnmatchcase(value, spec) for spec in specs)
+        return False
+
+
+class ConfigProfile:
+    """Fingerprint e allow-set de uma configuração, calculados uma única vez."""
+
+    __slots__ = ("fingerprint", "tools")
+
+    def __init__(self, config: "SessionConfig"):
+        canonical = canonical_config(config)
+        self.fingerprint = hashlib.sha1(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+        self.tools = ToolRules(tuple(canonical["allowed_tools"]), config.permission_mode)
+
+    @property
+    def label(self) -> str:
+        """Fingerprint abreviado usado como label de métricas."""
+        return self.fingerprint[:12]
+
+
+# Perfis das configurações vivas; somem junto com a última sessão que as usa
+_profiles: "weakref.WeakKeyDictionary[SessionConfig, ConfigProfile]" = weakref.WeakKeyDictionary()
+
+
+def config_profile(config: "SessionConfig") -> ConfigProfile:
+    """Perfil compilado da configuração (memoizado por valor)."""
+    profile = _profiles.get(config)
+    if profile is None:
+        _profiles[config] = profile = ConfigProfile(config)
+    return profile
+
+
+def config_fingerprint(config: "SessionConfig") -> str:
+    """Hash estável da parte da configuração que influencia a resposta."""
+    return config_profile(config).fingerprint
@@ -0,0 +1,11 @@
+"""Configuração do pytest para os testes em api/."""
+
+import pytest
+
+# Script manual contra um servidor rodando (python test_api.py), não um teste do pytest
+collect_ignore = ["test_api.py"]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Substituto local do Claude Code CLI para benchmarks offline.
+
+Fala o mesmo protocolo stream-json (`--input-format stream-json
+--output-format stream-json`), inclusive `control_request` de interrupção,
+e simula o custo de inicialização do processo.
+
+Variáveis de ambiente:
+    FAKE_CLAUDE_STARTUP      segundos de inicialização (padrão 1.5)
+    FAKE_CLAUDE_CHUNK_DELAY  segundos entre blocos de texto (padrão 0.02)
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+
+
+def emit(event):
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+def read_stdin(inbox):
+    """Lê o stdin numa thread para receber interrupções durante o turno."""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            inbox.put(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    inbox.put(None)
+
+
+def main():
+    # Simula carregamento do runtime Node e autenticação
+    time.sleep(float(os.getenv("FAKE_CLAUDE_STARTUP", "1.5")))
+    chunk_delay = float(os.getenv("FAKE_CLAUDE_CHUNK_DELAY", "0.02"))
+
+    session_id = str(uuid.uuid4())
+    initialized = False
+    inbox = queue.Queue()
+    pending = []
+    threading.Thread(target=read_stdin, args=(inbox,), daemon=True).start()
+
+    while True:
+        request = pending.pop(0) if pending else inbox.get()
+        if request is None:
+            break
+        if request.get("type") != "user":
+            continue
+        content = request.get("message", {}).get("content", "")
+        if isinstance(content, list):
+            content = " ".join(b.get("text", "") for b in content if isinstance(b, dict))
+
+        started = time.time()
+        if not initialized:
+            emit({"type": "system", "subtype": "init", "session_id": session_id, "args": sys.argv[1:]})
+            initialized = True
+
+        interrupted = False
+        words = f"Esta é uma resposta simulada para: {content}".split()
+        for i in range(0, len(words), 4):
+            time.sleep(chunk_delay)
+            while not inbox.empty():
+                incoming = inbox.get()
+                if incoming and incoming.get("type") == "control_request":
+                    emit({
+                        "type": "control_response",
+                        "response": {"subtype": "success", "request_id": incoming.get("request_id")},
+                    })
+                    interrupted = True
+                else:
+                    pending.append(incoming)
+            if interrupted:
+                break
+            emit({
+                "type": "assistant",
+                "session_id": session_id,
+                "message": {
+                    "role": "assistant",
+                    "content": [{"type": "text", "text": " ".join(words[i:i + 4]) + " "}],
+                },
+            })
+
+        emit({
+            "type": "result",
+            "subtype": "error_during_execution" if interrupted else "success",
+            "session_id": session_id,
+            "duration_ms": int((time.time() - started) * 1000),
+            "is_error": interrupted,
+            "num_turns": 1,
+            "total_cost_usd": 0.0,
+            "usage": {"input_tokens": len(content.split()), "output_tokens": len(words)},
+        })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,699 @@
+"""Log de histórico em disco: sessões em memória que sobrevivem a reinícios."""
+
+import asyncio
+import json
+import logging
+import mmap
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote, unquote
+
+from config_profile import config_fingerprint
+from session_store import REPLICA_ID, History, InMemorySessionStore, SessionRecord, SessionSnapshot, _load_config
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+SEGMENT_SUFFIX = ".log"
+
+# created_at e configuração atual da sessão, para indexá-la sem ler o log
+META_FILE = "meta.json"
+
+
+def _dirname(session_id: str) -> str:
+    # Reversível com unquote; "." escapado para nunca gerar "." ou ".."
+    return quote(session_id, safe="").replace(".", "%2E")
+
+
+def _dump(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+def _apply(state: Optional[Dict[str, Any]], record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Aplica um registro do log ao estado reconstruído da sessão."""
+    op = record.get("op")
+    if op == "snapshot":
+        return record["state"]
+    if op == "create":
+        return {
+            "config": record["config"],
+            "created_at": record["created_at"],
+            "updated_at": record["t"],
+            "history": [],
+            "total_tokens": 0,
+            "total_cost": 0.0,
+            "compactions": 0,
+            "compacted_messages": 0,
+            "last_compacted_at": None,
+        }
+    if state is None:
+        return None
+    if op == "config":
+        state["config"] = record["config"]
+        state["updated_at"] = record["t"]
+    elif op == "append":
+        state["history"].extend(record["messages"])
+        state["updated_at"] = record["t"]
+    elif op == "clear":
+        state["history"] = []
+        state["updated_at"] = record["t"]
+    elif op == "compact":
+        compacted = record["compacted"]
+        state["history"] = record["replacement"] + state["history"][compacted:]
+        state["compactions"] += 1
+        state["compacted_messages"] += compacted
+        state["last_compacted_at"] = record["t"]
+    elif op == "usage":
+        state["total_tokens"] += record["tokens"]
+        state["total_cost"] += record["cost"]
+    elif op == "snapshot_save":
+        state.setdefault("snapshots", {})[record["snapshot_id"]] = {
+            "config": state["config"],
+            "history": list(state["history"]),
+            "created_at": record["t"],
+        }
+    elif op == "snapshot_restore":
+        snapshot = state.get("snapshots", {}).get(record["snapshot_id"])
+        if snapshot is not None:
+            state["config"] = snapshot["config"]
+            state["history"] = list(snapshot["history"])
+            state["updated_at"] = record["t"]
+    elif op == "snapshot_drop":
+        state.get("snapshots", {}).pop(record["snapshot_id"], None)
+    return state
+
+
+class HistoryLog:
+    """Log append-only por sessão, em segmentos `{dir}/{sessão}/{n:08d}.log`.
+
+    Cada linha é um registro JSON (`create`, `config`, `append`, `clear`,
+    `compact`, `usage`, `snapshot_save`, `snapshot_restore`, `snapshot_drop`,
+    `fork`, que aponta para as primeiras `at` mensagens do histórico atual de
+    outra sessão em vez de copiá-las, ou `snapshot`, o estado inteiro gravado
+    pela compactação do log). `write` só enfileira: a cada
+    `flush_interval` o lote vai para o disco numa thread dedicada, que
+    também serializa leituras e compactações. Política de fsync: `always`
+    (a cada lote), `interval` (no máximo a cada `FSYNC_INTERVAL` segundos) ou
+    `never` (fica com o sistema operacional). Um segmento é fechado ao
+    passar de `segment_bytes`; sessões com mais de `max_segments` segmentos
+    são reescritas como um único `snapshot` na compactação periódica.
+    `{dir}/{sessão}/meta.json` guarda `created_at`, a configuração atual e a
+    origem do `fork` ainda não materializado, reescrito a cada `write_meta`.
+    """
+
+    FSYNC_INTERVAL = 1.0
+    COMPACT_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        directory: str,
+        fsync: str = "interval",
+        flush_interval: float = 0.05,
+        segment_bytes: int = 1 << 20,
+        max_segments: int = 4,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"HISTORY_LOG_FSYNC deve ser um de {FSYNC_POLICIES}")
+        self.directory = directory
+        self.fsync = fsync
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+
+        self._pending: List[Tuple[str, str, bytes]] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-log")
+        self._task: Optional[asyncio.Task] = None
+        # Estado da thread de escrita: segmento atual (número, bytes) por sessão
+        self._tails: Dict[str, Tuple[int, int]] = {}
+        self._dirty: Set[str] = set()
+        self._crowded: Set[str] = set()
+        self._last_fsync = time.monotonic()
+        self.written_bytes = 0
+        self.batches = 0
+        self.compactions = 0
+
+    @classmethod
+    def from_env(cls, directory: Optional[str] = None) -> "HistoryLog":
+        """Cria o log a partir das variáveis de ambiente."""
+        return cls(
+            directory or os.environ["HISTORY_LOG_DIR"],
+            fsync=os.getenv("HISTORY_LOG_FSYNC", "interval"),
+            flush_interval=int(os.getenv("HISTORY_LOG_FLUSH_MS", "50")) / 1000,
+            segment_bytes=int(os.getenv("HISTORY_LOG_SEGMENT_BYTES", str(1 << 20))),
+            max_segments=int(os.getenv("HISTORY_LOG_MAX_SEGMENTS", "4")),
+        )
+
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        """Sessões presentes no disco: `mtime` do segmento mais recente, `created_at` e `config`.
+
+        Síncrono, chamado na abertura do store. Diretórios gravados antes do
+        `meta.json` existir são lidos inteiros uma vez e ganham o arquivo.
+        """
+        found = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                mtimes = [
+                    segment.stat().st_mtime
+                    for segment in os.scandir(entry.path)
+                    if segment.name.endswith(SEGMENT_SUFFIX)
+                ]
+                if not mtimes:
+                    continue
+                session_id = unquote(entry.name)
+                meta = self._read_meta(session_id)
+                if meta is None:
+                    state = self._replay(session_id)
+                    if state is None:
+                        continue
+                    meta = {"created_at": state["created_at"], "config": state["config"], "fork": state.get("fork")}
+                    self._write_meta(session_id, _dump(meta))
+                found[session_id] = {"mtime": max(mtimes), **meta}
+        return found
+
+    def write_meta(
+        self,
+        session_id: str,
+        created_at: float,
+        config: Dict[str, Any],
+        fork: Optional[Dict[str, Any]] = None,
+    ):
+        """Enfileira a reescrita do `meta.json` da sessão."""
+        self._enqueue(session_id, "meta", _dump({"created_at": created_at, "config": config, "fork": fork}))
+
+    def write(self, session_id: str, op: str, t: Optional[float] = None, **fields: Any):
+        """Enfileira um registro; a escrita acontece no próximo lote."""
+        record = {"op": op, "t": t or time.time(), **fields}
+        self._enqueue(session_id, op, _dump(record))
+
+    def remove(self, session_id: str):
+        """Enfileira a remoção dos segmentos da sessão."""
+        self._enqueue(session_id, "delete", b"")
+
+    def _enqueue(self, session_id: str, op: str, line: bytes):
+        self._pending.append((session_id, op, line))
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def flush(self):
+        """Grava o lote pendente."""
+        batch, self._pending = self._pending, []
+        if batch:
+            await self._call(self._write_batch, batch)
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Estado da sessão reconstruído a partir dos segmentos (None se não há)."""
+        await self.flush()
+        return await self._call(self._replay, session_id)
+
+    async def compact(self):
+        """Reescreve as sessões com segmentos demais."""
+        await self._call(self._compact_crowded)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self.fsync != "never":
+            await self._call(self._sync_dirty)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "written_bytes": self.written_bytes,
+            "batches": self.batches,
+            "compactions": self.compactions,
+            "fsync": self.fsync,
+        }
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _loop(self):
+        last_compaction = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_compaction > self.COMPACT_INTERVAL:
+                    last_compaction = time.monotonic()
+                    await self.compact()
+            except Exception:
+                logger.exception("Falha ao gravar o log de histórico")
+
+    # Daqui para baixo: só na thread de escrita
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, _dirname(session_id))
+
+    def _segments(self, session_id: str) -> List[int]:
+        try:
+            names = os.listdir(self._path(session_id))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names if name.endswith(SEGMENT_SUFFIX))
+
+    def _segment_path(self, session_id: str, number: int) -> str:
+        return os.path.join(self._path(session_id), f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def _write_batch(self, batch: List[Tuple[str, str, bytes]]):
+        buffers: Dict[str, List[bytes]] = {}
+        metas: Dict[str, bytes] = {}
+        for session_id, op, line in batch:
+            if op == "delete":
+                buffers.pop(session_id, None)
+                metas.pop(session_id, None)
+                self._tails.pop(session_id, None)
+                self._crowded.discard(session_id)
+                shutil.rmtree(self._path(session_id), ignore_errors=True)
+            elif op == "meta":
+                metas[session_id] = line
+            else:
+                buffers.setdefault(session_id, []).append(line)
+
+        written = []
+        for session_id, lines in buffers.items():
+            written.append(self._append(session_id, b"".join(lines)))
+        for session_id, data in metas.items():
+            self._write_meta(session_id, data)
+        self.batches += 1
+
+        if self.fsync == "always":
+            for path in written:
+                self._sync(path)
+        elif self.fsync == "interval":
+            self._dirty.update(written)
+            if time.monotonic() - self._last_fsync >= self.FSYNC_INTERVAL:
+                self._sync_dirty()
+
+    def _append(self, session_id: str, data: bytes) -> str:
+        tail = self._tails.get(session_id)
+        if tail is None:
+            os.makedirs(self._path(session_id), exist_ok=True)
+            segments = self._segments(session_id)
+            number = segments[-1] if segments else 1
+            path = self._segment_path(session_id, number)
+            tail = (number, os.path.getsize(path) if segments else 0)
+        number, size = tail
+        if size and size + len(data) > self.segment_bytes:
+            number, size = number + 1, 0
+            self._crowded.add(session_id)
+        path = self._segment_path(session_id, number)
+        with open(path, "ab") as f:
+            f.write(data)
+        self._tails[session_id] = (number, size + len(data))
+        self.written_bytes += len(data)
+        return path
+
+    def _read_meta(self, session_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self._path(session_id), META_FILE), "rb") as f:
+                return json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, session_id: str, data: bytes):
+        # Derivado do log: sem fsync, reconstruído se faltar
+        os.makedirs(self._path(session_id), exist_ok=True)
+        path = os.path.join(self._path(session_id), META_FILE)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def _sync(self, path: str):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _sync_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        for path in dirty:
+            self._sync(path)
+        self._last_fsync = time.monotonic()
+
+    def _replay(self, session_id: str, segments: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+        state = None
+        for number in segments if segments is not None else self._segments(session_id):
+            with open(self._segment_path(session_id, number), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for line in iter(data.readline, b""):
+                        if not line.endswith(b"\n"):
+                            # Linha incompleta de uma escrita interrompida
+                            logger.warning("Registro truncado no log da sessão %s", session_id)
+                            break
+                        record = json.loads(line)
+                        if record.get("op") == "fork":
+                            state = self._apply_fork(session_id, state, record)
+                        else:
+                            state = _apply(state, record)
+        return state
+
+    def _apply_fork(
+        self,
+        session_id: str,
+        state: Optional[Dict[str, Any]],
+        record: Dict[str, Any],
+    ) -> Optional[Dict[str, Any]]:
+        # O store materializa a cópia antes de a origem perder o prefixo
+        if state is None:
+            return None
+        source = self._replay(record["source"])
+        if source is None:
+            logger.warning("Origem %s do fork %s não está no log", record["source"], session_id)
+        state["history"] = source["history"][:record["at"]] if source is not None else []
+        state["updated_at"] = record["t"]
+        state["fork"] = {"source": record["source"], "at": record["at"]}
+        return state
+
+    def _compact_crowded(self):
+        crowded, self._crowded = self._crowded, set()
+        for session_id in crowded:
+            segments = self._segments(session_id)
+            if len(segments) <= self.max_segments:
+                continue
+            state = self._replay(session_id, segments)
+            if state is None:
+                continue
+            # O snapshot já traz o histórico do fork por extenso
+            state.pop("fork", None)
+            # O snapshot vai para um segmento novo; os antigos só saem depois do rename
+            number = segments[-1] + 1
+            path = self._segment_path(session_id, number)
+            data = _dump({"op": "snapshot", "t": time.time(), "state": state})
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+                if self.fsync != "never":
+                    os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            for old in segments:
+                os.unlink(self._segment_path(session_id, old))
+            self._tails[session_id] = (number, len(data))
+            self.compactions += 1
+
+
+def _state_of(session: SessionRecord) -> Dict[str, Any]:
+    """Estado da sessão no formato do registro `snapshot` (o inverso de `_restore`)."""
+    state = {
+        "config": asdict(session.config),
+        "created_at": session.created_at,
+        "updated_at": session.updated_at,
+        "history": session.history.messages(),
+        "total_tokens": session.total_tokens,
+        "total_cost": session.total_cost,
+        "compactions": session.compactions,
+        "compacted_messages": session.compacted_messages,
+        "last_compacted_at": session.last_compacted_at,
+    }
+    if session.snapshots:
+        state["snapshots"] = {
+            snapshot_id: {
+                "config": asdict(snapshot.config),
+                "history": snapshot.history.messages(),
+                "created_at": snapshot.created_at,
+            }
+            for snapshot_id, snapshot in session.snapshots.items()
+        }
+    return state
+
+
+class PersistentSessionStore(InMemorySessionStore):
+    """Store em memória com cada escrita replicada no `HistoryLog`.
+
+    Na inicialização só o `meta.json` de cada sessão em disco é lido; o estado
+    de uma sessão fria é restaurado no primeiro acesso (`get_config`,
+    `get_meta`, `get_history` ou escrita). Até lá ela já entra nos índices de
+    `created_at` e fingerprint, na listagem paginada e no feed de alterações
+    (com o mtime do último segmento como `updated_at`), além de `list_ids`,
+    `count`, `list_activity` e `exists`.
+
+    `fork` grava na cópia só um registro apontando para a origem. Antes de a
+    origem perder esse prefixo (`clear_history`, `compact_history`,
+    `restore`, recriação ou remoção), as cópias que dependem dela são
+    materializadas com um `snapshot` do próprio estado.
+    """
+
+    def __init__(self, log: HistoryLog):
+        super().__init__()
+        self.log = log
+        self._cold: Dict[str, Dict[str, Any]] = {}
+        self._restoring: Dict[str, asyncio.Future] = {}
+        # Cópias cujo log ainda lê o da origem: origem -> cópias e cópia -> {source, at}
+        self._forks: Dict[str, Set[str]] = {}
+        self._parents: Dict[str, Dict[str, Any]] = {}
+        self.restored = 0
+        self.materialized = 0
+        found = log.sessions()
+        for session_id, meta in sorted(found.items(), key=lambda item: (item[1]["created_at"], item[0])):
+            if meta.get("fork"):
+                self._link(session_id, meta["fork"])
+            fingerprint = config_fingerprint(_load_config(meta["config"]))
+            self.version += 1
+            self._cold[session_id] = {
+                "created_at": meta["created_at"],
+                "updated_at": meta["mtime"],
+                "fingerprint": fingerprint,
+                "version": self.version,
+            }
+            self._index_entry(session_id, meta["created_at"], fingerprint)
+            self._changes[session_id] = self.version
+
+    def _summary_of(self, session_id):
+        cold = self._cold.get(session_id)
+        if cold is not None:
+            return {"session_id": session_id, **cold}
+        return super()._summary_of(session_id)
+
+    def _drop_cold(self, session_id: str) -> bool:
+        """Tira a sessão fria dos índices (restaurada, recriada ou removida)."""
+        cold = self._cold.pop(session_id, None)
+        if cold is None:
+            return False
+        self._unindex_entry(session_id, cold["created_at"], cold["fingerprint"])
+        self._changes.pop(session_id, None)
+        return True
+
+    def _link(self, target_id: str, fork: Dict[str, Any]):
+        self._parents[target_id] = fork
+        self._forks.setdefault(fork["source"], set()).add(target_id)
+
+    def _unlink(self, target_id: str):
+        fork = self._parents.pop(target_id, None)
+        if fork is None:
+            return
+        targets = self._forks.get(fork["source"])
+        if targets is not None:
+            targets.discard(target_id)
+            if not targets:
+                del self._forks[fork["source"]]
+
+    def _write_meta(self, session_id: str):
+        session = self.sessions[session_id]
+        self.log.write_meta(session_id, session.created_at, asdict(session.config), self._parents.get(session_id))
+
+    async def _materialize_forks(self, source_id: str):
+        """Grava por extenso o histórico das cópias que ainda leem o log de `source_id`.
+
+        Chamado antes de qualquer escrita que mude o prefixo da origem. As
+        cópias frias são restauradas antes, lendo a origem ainda intacta; um
+        fork criado durante essas esperas já nasce em memória.
+        """
+        for target_id in list(self._forks.get(source_id, ())):
+            await self._warm(target_id)
+        for target_id in self._forks.pop(source_id, ()):
+            self._parents.pop(target_id, None)
+            session = self.sessions.get(target_id)
+            if session is None:
+                continue
+            self.log.write(target_id, "snapshot", session.updated_at, state=_state_of(session))
+            self._write_meta(target_id)
+            self.materialized += 1
+
+    async def _warm(self, session_id: str):
+        if session_id not in self._cold:
+            return
+        pending = self._restoring.get(session_id)
+        if pending is None:
+            pending = self._restoring[session_id] = asyncio.ensure_future(self._restore(session_id))
+            pending.add_done_callback(lambda _: self._restoring.pop(session_id, None))
+        await asyncio.shield(pending)
+
+    async def _restore(self, session_id: str):
+        state = await self.log.load(session_id)
+        if not self._drop_cold(session_id):
+            # Recriada ou removida durante a leitura
+            return
+        if state is None:
+            self._tombstone(session_id)
+            return
+        session = SessionRecord(_load_config(state["config"]), state["created_at"], state["updated_at"])
+        session.history.append(state["history"])
+        session.total_tokens = state["total_tokens"]
+        session.total_cost = state["total_cost"]
+        session.compactions = state["compactions"]
+        session.compacted_messages = state["compacted_messages"]
+        session.last_compacted_at = state["last_compacted_at"]
+        for snapshot_id, snapshot in state.get("snapshots", {}).items():
+            history = History()
+            history.append(snapshot["history"])
+            if session.snapshots is None:
+                session.snapshots = {}
+            session.snapshots[snapshot_id] = SessionSnapshot(
+                _load_config(snapshot["config"]), history, snapshot["created_at"]
+            )
+        self.sessions[session_id] = session
+        self._index(session_id, session)
+        self._touch(session_id, session)
+        self.restored += 1
+
+    async def create(self, session_id, config, created_at=None):
+        await self._materialize_forks(session_id)
+        self._drop_cold(session_id)
+        self._unlink(session_id)
+        await super().create(session_id, config, created_at)
+        session = self.sessions[session_id]
+        self.log.write(
+            session_id, "create", session.updated_at,
+            config=asdict(config), created_at=session.created_at,
+        )
+        self._write_meta(session_id)
+
+    async def exists(self, session_id):
+        return session_id in self.sessions or session_id in self._cold
+
+    async def get_config(self, session_id):
+        await self._warm(session_id)
+        return await super().get_config(session_id)
+
+    async def set_config(self, session_id, config):
+        await self._warm(session_id)
+        if not await super().set_config(session_id, config):
+            return False
+        self.log.write(session_id, "config", self.sessions[session_id].updated_at, config=asdict(config))
+        self._write_meta(session_id)
+        return True
+
+    async def get_history(self, session_id):
+        await self._warm(session_id)
+        return await super().get_history(session_id)
+
+    async def append_history(self, session_id, *messages):
+        await self._warm(session_id)
+        count = await super().append_history(session_id, *messages)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.log.write(session_id, "append", session.updated_at, messages=list(messages))
+        return count
+
+    async def clear_history(self, session_id):
+        await self._materialize_forks(session_id)
+        await self._warm(session_id)
+        await super().clear_history(session_id)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.log.write(session_id, "clear", session.updated_at)
+
+    async def compact_history(self, session_id, snapshot, replacement):
+        await self._materialize_forks(session_id)
+        await self._warm(session_id)
+        if not await super().compact_history(session_id, snapshot, replacement):
+            return False
+        self.log.write(
+            session_id, "compact", self.sessions[session_id].last_compacted_at,
+            compacted=len(snapshot), replacement=replacement,
+        )
+        return True
+
+    async def fork(self, source_id, target_id, at=None, created_at=None):
+        await self._warm(source_id)
+        if not await super().fork(source_id, target_id, at, created_at):
+            return False
+        # Só a referência: o prefixo é lido do log da origem até ser materializado
+        session = self.sessions[target_id]
+        if session.history.count:
+            fork = {"source": source_id, "at": session.history.count}
+            self.log.write(target_id, "fork", session.updated_at, **fork)
+            self._link(target_id, fork)
+            self._write_meta(target_id)
+        return True
+
+    async def snapshot(self, session_id, snapshot_id):
+        await self._warm(session_id)
+        summary = await super().snapshot(session_id, snapshot_id)
+        if summary is not None:
+            self.log.write(session_id, "snapshot_save", summary["created_at"], snapshot_id=snapshot_id)
+        return summary
+
+    async def list_snapshots(self, session_id):
+        await self._warm(session_id)
+        return await super().list_snapshots(session_id)
+
+    async def restore(self, session_id, snapshot_id):
+        await self._materialize_forks(session_id)
+        await self._warm(session_id)
+        if not await super().restore(session_id, snapshot_id):
+            return False
+        self.log.write(session_id, "snapshot_restore", self.sessions[session_id].updated_at, snapshot_id=snapshot_id)
+        self._write_meta(session_id)
+        return True
+
+    async def delete_snapshot(self, session_id, snapshot_id):
+        await self._warm(session_id)
+        if not await super().delete_snapshot(session_id, snapshot_id):
+            return False
+        self.log.write(session_id, "snapshot_drop", snapshot_id=snapshot_id)
+        return True
+
+    async def add_usage(self, session_id, tokens, cost):
+        await self._warm(session_id)
+        await super().add_usage(session_id, tokens, cost)
+        if session_id in self.sessions:
+            self.log.write(session_id, "usage", tokens=tokens, cost=cost)
+
+    async def get_meta(self, session_id):
+        await self._warm(session_id)
+        return await super().get_meta(session_id)
+
+    async def claim(self, session_id, replica=REPLICA_ID):
+        await self._warm(session_id)
+        await super().claim(session_id, replica)
+
+    async def delete(self, session_id):
+        await self._materialize_forks(session_id)
+        self._unlink(session_id)
+        cold = self._drop_cold(session_id)
+        deleted = await super().delete(session_id)
+        if cold and not deleted:
+            self._tombstone(session_id)
+        if deleted or cold:
+            self.log.remove(session_id)
+        return deleted or cold
+
+    async def list_ids(self):
+        return list(self.sessions) + list(self._cold)
+
+    async def count(self):
+        return len(self.sessions) + len(self._cold)
+
+    async def list_activity(self):
+        activity = await super().list_activity()
+        activity.extend((session_id, cold["created_at"], cold["updated_at"]) for session_id, cold in self._cold.items())
+        return activity
+
+    async def close(self):
+        await self.log.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""Launcher de produção: worker pré-forkado com reinício sem derrubar a porta.
+
+O processo pai abre o socket, importa só o framework (FastAPI, pydantic,
+uvicorn) e faz fork do worker, que importa o `server` (handler, store, pool)
+depois do fork, com o próprio PID no `REPLICA_ID`. Um worker só é considerado
+no ar quando termina o startup (o mesmo critério de `GET /ready`):
+
+    python3 launcher.py
+
+Um worker por instância: turnos, buffers de replay, lotes, limites por IP e
+orçamentos vivem no processo, e workers irmãos na mesma porta receberiam
+reconexões, interrupções e consultas de lote de turnos que não conhecem.
+Para escalar, use réplicas com `REDIS_URL` e afinidade de sessão no proxy.
+
+Sinais no processo pai: SIGTERM/SIGINT encerram tudo e SIGHUP troca o worker
+(o novo precisa ficar pronto antes do antigo sair).
+"""
+
+import importlib
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("launcher")
+
+# Carregados no pai e compartilhados por copy-on-write com os workers
+PRELOAD = ("fastapi", "fastapi.routing", "fastapi.openapi.models", "pydantic", "starlette.responses", "uvicorn")
+
+# Um worker que morre antes disso é recriado com atraso
+MIN_UPTIME = 1.0
+
+
+class Worker:
+    """Processo filho e o pipe pelo qual ele avisa que está pronto."""
+
+    def __init__(self, pid: int, ready_fd: int):
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.started_at = time.monotonic()
+        self.ready = False
+
+
+class Launcher:
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8002,
+        workers: int = 1,
+        ready_timeout: float = 60.0,
+        graceful_timeout: float = 30.0,
+        log_level: str = "info",
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.ready_timeout = ready_timeout
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.sock: Optional[socket.socket] = None
+        self._children: Dict[int, Worker] = {}
+        self._signals: List[int] = []
+        self._stopping = False
+
+    @classmethod
+    def from_env(cls) -> "Launcher":
+        """Cria o launcher a partir das variáveis de ambiente."""
+        workers = int(os.getenv("API_WORKERS", "1"))
+        if workers > 1:
+            # Turnos, replay, lotes e limites são por processo, mesmo com REDIS_URL
+            logger.warning("API_WORKERS=%d não é suportado; usando 1 worker (escale com réplicas)", workers)
+            workers = 1
+        host, _, port = os.getenv("API_BIND", "0.0.0.0:8002").rpartition(":")
+        return cls(
+            host=host or "0.0.0.0",
+            port=int(port),
+            workers=workers,
+            ready_timeout=float(os.getenv("API_READY_TIMEOUT", "60")),
+            graceful_timeout=float(os.getenv("API_GRACEFUL_TIMEOUT", "30")),
+            log_level=os.getenv("LOG_LEVEL", "info").lower(),
+        )
+
+    def run(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+
+        started = time.monotonic()
+        for module in PRELOAD:
+            importlib.import_module(module)
+        logger.info("Framework carregado em %.0f ms", (time.monotonic() - started) * 1000)
+
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self._on_signal)
+
+        started = time.monotonic()
+        workers = [self._spawn() for _ in range(self.workers)]
+        ready = sum(self._wait_ready(worker) for worker in workers)
+        logger.info(
+            "%d/%d workers prontos em %.0f ms em %s:%d",
+            ready, self.workers, (time.monotonic() - started) * 1000, self.host, self.port,
+        )
+
+        while not self._stopping:
+            self._handle_signals()
+            self._reap()
+            if not self._stopping:
+                time.sleep(0.2)
+        self._stop_all()
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _handle_signals(self):
+        while self._signals:
+            signum = self._signals.pop(0)
+            if signum in (signal.SIGTERM, signal.SIGINT):
+                logger.info("Encerrando")
+                self._stopping = True
+                return
+            if signum == signal.SIGHUP:
+                self._rolling_restart()
+
+    def _spawn(self) -> Worker:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                self._serve(ready_w)
+            except BaseException:
+                logger.exception("Worker %d falhou", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_w)
+        worker = self._children[pid] = Worker(pid, ready_r)
+        return worker
+
+    def _serve(self, ready_fd: int):
+        """Corpo do worker: importa a aplicação e atende no socket herdado."""
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        import uvicorn
+
+        class ReadyServer(uvicorn.Server):
+            async def startup(self, sockets=None):
+                await super().startup(sockets)
+                if not self.should_exit:
+                    os.write(ready_fd, b"1")
+                    os.close(ready_fd)
+
+        from server import app
+
+        config = uvicorn.Config(app, lifespan="on", log_level=self.log_level, timeout_graceful_shutdown=self.graceful_timeout)
+        ReadyServer(config).run(sockets=[self.sock])
+
+    def _wait_ready(self, worker: Worker) -> bool:
+        """Aguarda o aviso de startup concluído; mata o worker se não vier."""
+        remaining = self.ready_timeout
+        while remaining > 0 and not worker.ready:
+            started = time.monotonic()
+            try:
+                readable, _, _ = select.select([worker.ready_fd], [], [], remaining)
+            except InterruptedError:
+                readable = []
+            remaining -= time.monotonic() - started
+            if readable:
+                worker.ready = os.read(worker.ready_fd, 1) == b"1"
+                break
+        os.close(worker.ready_fd)
+        if worker.ready:
+            logger.info("Worker %d pronto em %.0f ms", worker.pid, (time.monotonic() - worker.started_at) * 1000)
+        else:
+            logger.error("Worker %d não ficou pronto", worker.pid)
+            self._terminate(worker, force=True)
+        return worker.ready
+
+    def _rolling_restart(self):
+        """Troca cada worker por um novo, só derrubando o antigo com o novo pronto."""
+        for old in list(self._children.values()):
+            new = self._spawn()
+            if not self._wait_ready(new):
+                logger.error("Reinício interrompido: worker novo não ficou pronto")
+                return
+            self._terminate(old)
+        logger.info("Reinício concluído")
+
+    def _terminate(self, worker: Worker, force: bool = False):
+        self._children.pop(worker.pid, None)
+        try:
+            os.kill(worker.pid, signal.SIGKILL if force else signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        try:
+            while time.monotonic() < deadline:
+                pid, _ = os.waitpid(worker.pid, os.WNOHANG)
+                if pid:
+                    return
+                time.sleep(0.05)
+            os.kill(worker.pid, signal.SIGKILL)
+            os.waitpid(worker.pid, 0)
+        except ChildProcessError:
+            pass
+
+    def _reap(self):
+        """Recria workers que morreram sem ter sido encerrados pelo launcher."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self._children.pop(pid, None)
+            if worker is None or self._stopping:
+                continue
+            logger.warning("Worker %d saiu (status %d); recriando", pid, status)
+            if time.monotonic() - worker.started_at < MIN_UPTIME:
+                time.sleep(MIN_UPTIME)
+            self._wait_ready(self._spawn())
+
+    def _stop_all(self):
+        for worker in list(self._children.values()):
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self._children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self._children.pop(pid, None)
+            else:
+                time.sleep(0.05)
+        for worker in self._children.values():
+            os.kill(worker.pid, signal.SIGKILL)
+
+
+def main():
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(name)s %(message)s")
+    Launcher.from_env().run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""Diagnóstico do event loop: watchdog de atraso e profiler por amostragem.
+
+Tudo o que o servidor faz roda num único loop asyncio; uma chamada
+bloqueante (JSON grande serializado de forma síncrona, listagem lenta)
+atrasa todos os streams ao mesmo tempo. O watchdog mede o atraso
+continuamente e, quando o loop fica parado além do limite, uma thread
+captura a pilha do código que o está segurando. O profiler amostra as
+pilhas do processo vivo e devolve o formato "folded" dos flamegraphs.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from metrics import LOOP_LAG, LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+# Frames mais internos guardados de cada bloqueio
+STACK_LIMIT = 40
+
+# Funções em que a thread do loop está só esperando I/O
+IDLE_FRAMES = {"select", "poll", "epoll", "_run_once"}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded(frame) -> List[str]:
+    """Pilha da raiz até o frame, um rótulo por função."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _task_label(task: Optional[asyncio.Task]) -> Optional[str]:
+    if task is None:
+        return None
+    name = task.get_name()
+    coro = task.get_coro()
+    qualname = getattr(coro, "__qualname__", type(coro).__name__)
+    return name if qualname in name else f"{name} ({qualname})"
+
+
+class LoopWatchdog:
+    """Mede o atraso do loop e registra a pilha de quem o bloqueia.
+
+    Uma coroutine acorda a cada `interval` segundos e registra em
+    `claude_event_loop_lag_seconds` quanto o timer atrasou. Uma thread
+    verifica o batimento: com o loop parado há mais de `threshold`
+    segundos, guarda a pilha da thread do loop e a task em execução (um
+    registro por bloqueio, os últimos `history` ficam em `stalls`).
+    `threshold` 0 desativa o watchdog.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, history: int = 20):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._beat = 0
+        self._beat_at = time.monotonic()
+        # Batimento em que o bloqueio atual já foi registrado
+        self._captured_beat = -1
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls) -> "LoopWatchdog":
+        """Cria o watchdog a partir das variáveis de ambiente."""
+        return cls(
+            threshold=float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100")) / 1000,
+            interval=float(os.getenv("LOOP_LAG_INTERVAL_MS", "50")) / 1000,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self):
+        """Inicia o batimento no loop atual e a thread de verificação."""
+        if not self.enabled or self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat_at = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "stalls": list(self.stalls),
+        }
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+            if self._captured_beat == self._beat and self.stalls:
+                # Fim do bloqueio registrado: guarda a duração total
+                self.stalls[-1]["duration_ms"] = round(lag * 1000, 1)
+            self._beat += 1
+            self._beat_at = time.monotonic()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - self._beat_at
+            if blocked < self.threshold or beat == self._captured_beat:
+                continue
+            self._captured_beat = beat
+            self._capture(blocked)
+
+    def _capture(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.format_list(traceback.extract_stack(frame, limit=STACK_LIMIT))
+        # current_task só lê o dicionário de tasks do loop; seguro fora da thread dele
+        task = asyncio.current_task(self._loop)
+        stall = {
+            "at": time.time(),
+            "blocked_ms": round(blocked * 1000, 1),
+            "duration_ms": None,
+            "task": _task_label(task),
+            "stack": [line.rstrip() for line in stack],
+        }
+        self.stalls.append(stall)
+        LOOP_STALLS.inc()
+        logger.warning(
+            "Event loop bloqueado há %.0f ms (task %s):\n%s",
+            blocked * 1000, stall["task"], "".join(stack[-5:]),
+        )
+
+
+class SamplingProfiler:
+    """Amostra as pilhas de todas as threads do processo por um tempo limitado.
+
+    A thread do loop é agrupada pela task em execução (`task:<nome>`) ou
+    marcada como `loop:idle` quando só espera I/O; as demais threads ficam
+    sob `thread:<nome>`. Um profile por vez.
+    """
+
+    def __init__(self, max_seconds: float = 30.0):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SamplingProfiler":
+        return cls(max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "30")))
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float, interval: float = 0.005) -> Dict[str, Any]:
+        """Amostra por `seconds` (limitado a `max_seconds`) numa thread, sem parar o loop.
+
+        Levanta RuntimeError se outro profile estiver em andamento.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Já existe um profile em andamento")
+        try:
+            loop = asyncio.get_running_loop()
+            seconds = min(seconds, self.max_seconds)
+            return await asyncio.to_thread(self._sample, loop, threading.get_ident(), seconds, interval)
+        finally:
+            self._lock.release()
+
+    def _sample(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        loop_thread: int,
+        seconds: float,
+        interval: float,
+    ) -> Dict[str, Any]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        tasks: Counter = Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            task = asyncio.current_task(loop)
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                labels = _folded(frame)
+                if ident == loop_thread:
+                    if task is not None:
+                        root = f"task:{task.get_name()}"
+                        tasks[_task_label(task)] += 1
+                    elif frame.f_code.co_name in IDLE_FRAMES:
+                        root = "loop:idle"
+                    else:
+                        root = "loop:callbacks"
+                else:
+                    root = f"thread:{names.get(ident, ident)}"
+                stacks[";".join([root] + labels)] += 1
+            samples += 1
+            time.sleep(interval)
+        return {
+            "seconds": round(time.perf_counter() - started, 3),
+            "interval": interval,
+            "samples": samples,
+            "stacks": stacks,
+            "tasks": dict(tasks.most_common()),
+        }
+
+
+def folded_text(stacks: Counter) -> str:
+    """Formato "folded" (`raiz;...;folha contagem`) do flamegraph.pl e do speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_stacks(stacks: Counter, limit: int = 50) -> List[Tuple[str, int]]:
+    return stacks.most_common(limit)
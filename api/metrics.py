@@ -0,0 +1,243 @@
+"""Métricas no formato de texto do Prometheus, sem dependências externas."""
+
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Buckets (segundos) para latências de turno e de inicialização
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Intervalos entre frames do stream são bem menores
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base: nome, ajuda e nomes de labels."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Sequence[str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} espera labels {self.label_names}")
+        return tuple(str(v) for v in labels)
+
+    def samples(self) -> Iterator[str]:
+        return iter(())
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, *labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, *labels: str):
+        self.inc(-amount, *labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Por labels: [contagem por bucket (+Inf no fim), soma]
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1][0] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total[0])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """Conjunto de métricas exposto em `/metrics`."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# Latências do caminho quente
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "claude_time_to_first_token_seconds",
+    "Do envio da mensagem ao primeiro texto da resposta (inclui a fila)",
+)
+INTER_CHUNK_GAP = REGISTRY.histogram(
+    "claude_inter_chunk_gap_seconds",
+    "Intervalo entre frames consecutivos de um turno",
+    buckets=GAP_BUCKETS,
+)
+TURN_DURATION = REGISTRY.histogram(
+    "claude_turn_duration_seconds",
+    "Duração da geração de um turno, por desfecho",
+    labels=("outcome",),
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "claude_queue_wait_seconds",
+    "Tempo de espera na fila de admissão de turnos",
+)
+REAPER_SWEEP = REGISTRY.histogram(
+    "claude_reaper_sweep_seconds",
+    "Duração de uma varredura do reaper de sessões",
+)
+WORKER_SPAWN = REGISTRY.histogram(
+    "claude_worker_spawn_seconds",
+    "Tempo de inicialização de um processo do CLI",
+)
+UPSTREAM_PAUSE = REGISTRY.histogram(
+    "claude_stream_upstream_pause_seconds",
+    "Tempo em que um turno ficou pausado esperando um cliente lento",
+)
+LOOP_LAG = REGISTRY.histogram(
+    "claude_event_loop_lag_seconds",
+    "Atraso do event loop medido pelo watchdog (quanto um timer dispara depois do previsto)",
+    buckets=GAP_BUCKETS,
+)
+
+# Volume
+TURNS = REGISTRY.counter("claude_turns_total", "Turnos finalizados, por desfecho", labels=("outcome",))
+STREAM_BYTES = REGISTRY.counter("claude_stream_bytes_total", "Bytes SSE enviados aos clientes")
+LIVE_STREAMS = REGISTRY.gauge("claude_live_streams", "Conexões SSE abertas")
+TOKENS = REGISTRY.counter(
+    "claude_tokens_total",
+    "Tokens consumidos, por fingerprint de configuração e direção",
+    labels=("config", "direction"),
+)
+SESSIONS_EVICTED = REGISTRY.counter(
+    "claude_sessions_evicted_total",
+    "Sessões removidas, por motivo (idle, lifetime, lru, deleted)",
+    labels=("reason",),
+)
+COST = REGISTRY.counter("claude_cost_usd_total", "Custo em USD por fingerprint de configuração", labels=("config",))
+LOOP_STALLS = REGISTRY.counter("claude_event_loop_stalls_total", "Bloqueios do event loop acima do limite do watchdog")
+COMPRESSION_BYTES = REGISTRY.counter(
+    "claude_stream_compression_bytes_total",
+    "Bytes dos streams SSE antes (input) e depois (output) da compressão, por codificação",
+    labels=("encoding", "stage"),
+)
+COMPRESSION_SECONDS = REGISTRY.counter(
+    "claude_stream_compression_seconds_total",
+    "Tempo de CPU gasto comprimindo streams SSE, por codificação",
+    labels=("encoding",),
+)
+BUDGET = REGISTRY.counter(
+    "claude_budget_actions_total",
+    "Turnos recusados ou cortados por orçamento, por escopo (session, ip, key)",
+    labels=("scope", "action"),
+)
+TURNS_REJECTED = REGISTRY.counter("claude_turns_rejected_total", "Turnos recusados com 429 por fila cheia")
+CACHE_EVENTS = REGISTRY.counter(
+    "claude_response_cache_events_total",
+    "Consultas ao cache de respostas (hits, similar_hits, misses) e tokens economizados (saved_tokens)",
+    labels=("event",),
+)
+BACKPRESSURE = REGISTRY.counter(
+    "claude_stream_backpressure_total",
+    "Ações com clientes lentos (paused, coalesced, dropped, stalled, reset)",
+    labels=("action",),
+)
+
+# Estado instantâneo, atualizado a cada coleta
+ACTIVE_SESSIONS = REGISTRY.gauge("claude_active_sessions", "Sessões no store")
+TURNS_RUNNING = REGISTRY.gauge("claude_turns_running", "Turnos em execução")
+TURNS_QUEUED = REGISTRY.gauge("claude_turns_queued", "Turnos aguardando na fila")
+POOL_WORKERS = REGISTRY.gauge("claude_pool_workers", "Processos do CLI no pool, por estado", labels=("state",))
+REPLAY_BYTES = REGISTRY.gauge("claude_replay_buffer_bytes", "Bytes retidos no buffer de replay SSE")
+STREAM_BACKLOG = REGISTRY.gauge("claude_stream_backlog_bytes", "Bytes publicados e ainda não enviados, somando os streams")
+STREAM_MAX_BACKLOG = REGISTRY.gauge("claude_stream_max_backlog_bytes", "Maior atraso de um stream em bytes")
+SLOW_STREAMS = REGISTRY.gauge("claude_slow_streams", "Streams acima do high-water mark")
+BLOB_STORE = REGISTRY.gauge("claude_blob_store", "Blobs de resultados de ferramentas (bytes, stored, deduplicated, evicted)", labels=("stat",))
@@ -0,0 +1,377 @@
+"""Buffer de replay dos frames SSE para retomar streams com `Last-Event-ID`."""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+from metrics import BACKPRESSURE, UPSTREAM_PAUSE
+from sse import SSEEncoder
+
+# Políticas para assinantes que ficam `high_water` bytes atrás do turno
+POLICIES = ("pause", "coalesce", "drop")
+
+# (id, frame, bytes publicados no turno até este frame inclusive)
+Frame = Tuple[int, bytes, int]
+
+TEXT_EVENT = b"\nevent: assistant_text\ndata: "
+
+
+class StreamReader:
+    """Posição e estado de um assinante do turno."""
+
+    __slots__ = ("policy", "high_water", "offset", "last_write", "waiting", "stalled")
+
+    def __init__(self, policy: str, high_water: int, offset: int):
+        self.policy = policy
+        self.high_water = high_water
+        self.offset = offset
+        self.last_write = time.monotonic()
+        self.waiting = False
+        self.stalled = False
+
+
+class TurnStream:
+    """Frames já codificados de um turno, com espera pelos próximos.
+
+    Os IDs continuam a sequência da sessão, então `first_id` é o ID
+    imediatamente anterior ao primeiro frame do turno.
+
+    Cada assinante tem um atraso (`backlog`: bytes publicados que ele ainda não
+    enviou). Acima de `high_water` vale a política do assinante: `pause`
+    (`writable()` segura o produtor até ele alcançar), `coalesce` (os textos
+    pendentes são enviados como um único frame) ou `drop` (o stream termina com
+    um evento `error`; o cliente pode retomar com `Last-Event-ID`). Um
+    assinante com atraso e sem enviar nada por `stall_timeout` segundos é
+    considerado travado: deixa de segurar o produtor e seu stream termina com
+    erro assim que a escrita voltar.
+    """
+
+    def __init__(self, session_id: str, first_id: int, owner: "ReplayBuffer"):
+        self.session_id = session_id
+        self.first_id = first_id
+        self.last_id = first_id
+        self.frames: Deque[Frame] = deque()
+        self.size = 0
+        self.published = 0
+        self.finished = False
+        self.subscribers = 0
+        self._owner = owner
+        self._readers: Set[StreamReader] = set()
+        self._encoder: Optional[SSEEncoder] = None
+        self._changed = asyncio.get_running_loop().create_future()
+        self._drained: Optional[asyncio.Future] = None
+
+    def publish(self, event_id: int, frame: bytes):
+        """Adiciona um frame e acorda os assinantes."""
+        self.published += len(frame)
+        self.frames.append((event_id, frame, self.published))
+        self.last_id = event_id
+        self.size += len(frame)
+        self._owner._added(self, len(frame))
+        if self._readers:
+            now = time.monotonic()
+            for reader in self._readers:
+                self._check_stall(reader, now)
+        self._notify()
+
+    def backlog(self, reader: StreamReader) -> int:
+        return self.published - reader.offset
+
+    async def writable(self):
+        """Aguarda enquanto algum assinante `pause` está acima do limite."""
+        paused_at = None
+        while True:
+            now = time.monotonic()
+            timeout = None
+            for reader in self._readers:
+                if reader.policy != "pause" or self.backlog(reader) <= reader.high_water:
+                    continue
+                if self._check_stall(reader, now):
+                    continue
+                remaining = self._owner.stall_timeout - (now - reader.last_write)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            if timeout is None:
+                if paused_at is not None:
+                    UPSTREAM_PAUSE.observe(now - paused_at)
+                return
+            if paused_at is None:
+                paused_at = now
+                BACKPRESSURE.inc(1, "paused")
+            if self._drained is None:
+                self._drained = asyncio.get_running_loop().create_future()
+            await asyncio.wait({self._drained}, timeout=max(timeout, 0.01))
+
+    def finish(self):
+        """Marca o fim do turno."""
+        self.finished = True
+        self._owner._finished(self)
+        self._notify()
+
+    def drop_oldest(self) -> int:
+        """Descarta o frame mais antigo; retorna os bytes liberados."""
+        if not self.frames:
+            return 0
+        _, frame, _ = self.frames.popleft()
+        self.size -= len(frame)
+        return len(frame)
+
+    async def subscribe(
+        self,
+        after_id: Optional[int] = None,
+        policy: Optional[str] = None,
+        high_water: Optional[int] = None,
+    ) -> AsyncIterator[bytes]:
+        """Emite os frames após `after_id` e segue acompanhando o turno ao vivo.
+
+        Sempre que eventos ainda não enviados saem do buffer (no início, com um
+        `after_id` antigo, ou no meio do stream, pelo limite do turno ou global
+        com o assinante atrasado), o próximo frame é um evento `reset` (não
+        numerado) com a quantidade perdida em `missed`.
+        """
+        cursor = self.first_id if after_id is None else after_id
+        offset = self.published - sum(len(frame) for event_id, frame, _ in self.frames if event_id > cursor)
+        reader = StreamReader(
+            policy or self._owner.policy,
+            high_water or self._owner.high_water,
+            offset,
+        )
+        self._readers.add(reader)
+        self.subscribers += 1
+        try:
+            while True:
+                waiter = self._changed
+                oldest = self.frames[0][0] if self.frames else self.last_id + 1
+                if oldest > cursor + 1:
+                    missed, cursor = oldest - cursor - 1, oldest - 1
+                    # Os bytes perdidos deixam de contar como atraso
+                    first = self.frames[0] if self.frames else None
+                    reader.offset = first[2] - len(first[1]) if first else self.published
+                    BACKPRESSURE.inc(1, "reset")
+                    yield self._event({"type": "reset", "missed": missed})
+                    # Mais frames podem ter saído durante o envio: verifica de novo
+                    continue
+                pending = [item for item in self.frames if item[0] > cursor]
+                if pending and self.backlog(reader) > reader.high_water:
+                    if reader.policy == "drop":
+                        BACKPRESSURE.inc(1, "dropped")
+                        yield self._error("Stream encerrado: cliente lento; retome com Last-Event-ID")
+                        return
+                    if reader.policy == "coalesce":
+                        merged = self._merge(pending)
+                        if len(merged) < len(pending):
+                            BACKPRESSURE.inc(1, "coalesced")
+                        pending = merged
+                for event_id, frame, offset in pending:
+                    cursor = event_id
+                    yield frame
+                    reader.offset = offset
+                    reader.last_write = time.monotonic()
+                    if reader.stalled:
+                        yield self._error("Stream encerrado: escrita travada; retome com Last-Event-ID")
+                        return
+                    self._notify_drained()
+                if self.finished and cursor >= self.last_id:
+                    return
+                reader.waiting = True
+                await asyncio.shield(waiter)
+                reader.waiting = False
+                reader.last_write = time.monotonic()
+        finally:
+            self._readers.discard(reader)
+            self.subscribers -= 1
+            self._notify_drained()
+
+    def delivered(self) -> int:
+        """Bytes do turno já enviados a todos os assinantes."""
+        return min((reader.offset for reader in self._readers), default=self.published)
+
+    def reader_backlogs(self) -> List[int]:
+        return [self.backlog(reader) for reader in self._readers]
+
+    def _check_stall(self, reader: StreamReader, now: float) -> bool:
+        """Marca o assinante como travado se tem atraso e não escreve há tempo demais."""
+        if reader.stalled:
+            return True
+        if reader.waiting or self.backlog(reader) == 0:
+            return False
+        if now - reader.last_write > self._owner.stall_timeout:
+            reader.stalled = True
+            BACKPRESSURE.inc(1, "stalled")
+        return reader.stalled
+
+    def _merge(self, pending: List[Frame]) -> List[Frame]:
+        """Junta textos consecutivos pendentes num frame com o ID do último."""
+        merged: List[Frame] = []
+        texts: List[Tuple[Frame, str]] = []
+
+        def flush():
+            if len(texts) == 1:
+                merged.append(texts[0][0])
+            elif texts:
+                event_id, _, offset = texts[-1][0]
+                encoder = self._encoder or SSEEncoder(self.session_id)
+                self._encoder = encoder
+                payload = encoder.payload({"type": "assistant_text", "content": "".join(text for _, text in texts)})
+                merged.append((event_id, encoder.frame(event_id, "assistant_text", payload), offset))
+            texts.clear()
+
+        for item in pending:
+            text = _plain_text(item[1])
+            if text is not None:
+                texts.append((item, text))
+            else:
+                flush()
+                merged.append(item)
+        flush()
+        return merged
+
+    def _error(self, message: str) -> bytes:
+        return self._event({"type": "error", "error": message})
+
+    def _event(self, event: Dict[str, Any]) -> bytes:
+        """Frame não numerado gerado pelo buffer, fora da sequência do turno."""
+        encoder = self._encoder or SSEEncoder(self.session_id)
+        self._encoder = encoder
+        return encoder.encode(event, numbered=False)
+
+    def _notify(self):
+        waiter, self._changed = self._changed, asyncio.get_running_loop().create_future()
+        waiter.set_result(None)
+
+    def _notify_drained(self):
+        if self._drained is not None:
+            drained, self._drained = self._drained, None
+            drained.set_result(None)
+
+
+def _plain_text(frame: bytes) -> Optional[str]:
+    """Conteúdo de um frame `assistant_text` só com `type`, `content` e `session_id`."""
+    if TEXT_EVENT not in frame:
+        return None
+    event = json.loads(frame.split(TEXT_EVENT, 1)[1])
+    if event.keys() <= {"type", "content", "session_id"}:
+        return event.get("content") or ""
+    return None
+
+
+class ReplayBuffer:
+    """Último turno de cada sessão, com limite de memória por turno e global.
+
+    Acima do limite global, saem primeiro os frames que todos os assinantes
+    já receberam: turnos finalizados (do menos recente para o mais recente),
+    depois os mais antigos dos turnos em andamento. Só então, se ainda
+    faltar espaço, frames pendentes, e os assinantes afetados recebem um
+    evento `reset`.
+
+    `policy`, `high_water` e `stall_timeout` são os padrões de backpressure
+    dos assinantes (ver `TurnStream`); `high_water` fica abaixo de
+    `max_turn_bytes` para que `pause` não perca frames pelo limite do turno
+    (pelo limite global, só no último caso acima).
+    """
+
+    def __init__(
+        self,
+        max_turn_bytes: int = 1024 * 1024,
+        max_total_bytes: int = 64 * 1024 * 1024,
+        policy: str = "pause",
+        high_water: int = 256 * 1024,
+        stall_timeout: float = 30.0,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"STREAM_BACKPRESSURE deve ser um de {POLICIES}")
+        self.max_turn_bytes = max_turn_bytes
+        self.max_total_bytes = max_total_bytes
+        self.policy = policy
+        self.high_water = min(high_water, max_turn_bytes // 2)
+        self.stall_timeout = stall_timeout
+        self.total_bytes = 0
+        self.evicted_frames = 0
+        self._turns: "OrderedDict[str, TurnStream]" = OrderedDict()
+        self._last_ids: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "ReplayBuffer":
+        """Cria o buffer a partir das variáveis de ambiente."""
+        return cls(
+            max_turn_bytes=int(os.getenv("SSE_REPLAY_TURN_BYTES", str(1024 * 1024))),
+            max_total_bytes=int(os.getenv("SSE_REPLAY_TOTAL_BYTES", str(64 * 1024 * 1024))),
+            policy=os.getenv("STREAM_BACKPRESSURE", "pause"),
+            high_water=int(os.getenv("STREAM_HIGH_WATER_BYTES", str(256 * 1024))),
+            stall_timeout=float(os.getenv("STREAM_STALL_TIMEOUT", "30")),
+        )
+
+    def start_turn(self, session_id: str) -> TurnStream:
+        """Abre o buffer de um novo turno, substituindo o anterior da sessão."""
+        previous = self._turns.pop(session_id, None)
+        if previous is not None:
+            self.total_bytes -= previous.size
+        turn = TurnStream(session_id, self._last_ids.get(session_id, 0), self)
+        self._turns[session_id] = turn
+        return turn
+
+    def get(self, session_id: str) -> Optional[TurnStream]:
+        """Turno atual (ou o último) da sessão."""
+        return self._turns.get(session_id)
+
+    def discard(self, session_id: str):
+        """Esquece a sessão."""
+        turn = self._turns.pop(session_id, None)
+        if turn is not None:
+            self.total_bytes -= turn.size
+        self._last_ids.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        backlogs = [backlog for t in self._turns.values() for backlog in t.reader_backlogs()]
+        return {
+            "sessions": len(self._turns),
+            "active": sum(1 for t in self._turns.values() if not t.finished),
+            "bytes": self.total_bytes,
+            "evicted_frames": self.evicted_frames,
+            "backlog_bytes": sum(backlogs),
+            "max_backlog_bytes": max(backlogs, default=0),
+            "slow_readers": sum(1 for backlog in backlogs if backlog > self.high_water),
+        }
+
+    def _added(self, turn: TurnStream, size: int):
+        if self._turns.get(turn.session_id) is not turn:
+            # Turno descartado ou substituído que ainda publica: só atende os
+            # assinantes que já tem, fora do total e sem recriar `_last_ids`
+            while turn.size > self.max_turn_bytes and len(turn.frames) > 1:
+                turn.drop_oldest()
+            return
+        self._last_ids[turn.session_id] = turn.last_id
+        self.total_bytes += size
+        self._turns.move_to_end(turn.session_id)
+        while turn.size > self.max_turn_bytes and len(turn.frames) > 1:
+            self._release(turn.drop_oldest())
+        if self.total_bytes > self.max_total_bytes:
+            self._shrink()
+
+    def _finished(self, turn: TurnStream):
+        if self._turns.get(turn.session_id) is turn:
+            self._turns.move_to_end(turn.session_id)
+
+    def _release(self, size: int):
+        self.total_bytes -= size
+        self.evicted_frames += 1
+
+    def _shrink(self):
+        turns = list(self._turns.values())
+        for delivered_only in (True, False):
+            for turn in turns:
+                if turn.finished:
+                    self._trim(turn, 0, delivered_only)
+            for turn in turns:
+                if not turn.finished:
+                    self._trim(turn, 1, delivered_only)
+
+    def _trim(self, turn: TurnStream, keep: int, delivered_only: bool):
+        """Descarta frames antigos do turno enquanto o total passar do limite."""
+        sent = turn.delivered() if delivered_only else None
+        while self.total_bytes > self.max_total_bytes and len(turn.frames) > keep:
+            if sent is not None and turn.frames[0][2] > sent:
+                return
+            self._release(turn.drop_oldest())
@@ -0,0 +1,217 @@
+"""Cache de respostas para prompts repetidos sob a mesma configuração."""
+
+import hashlib
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING
+
+from metrics import CACHE_EVENTS
+
+if TYPE_CHECKING:
+    from claude_handler import SessionConfig
+
+Vector = Dict[int, float]
+
+
+def normalize_prompt(text: str) -> str:
+    """Minúsculas, sem acentos, pontuação final ou espaços repetidos."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!.;: ")
+
+
+def ngram_embedding(text: str, dims: int = 1024, n: int = 3) -> Vector:
+    """Vetor esparso normalizado de n-gramas de caracteres (feature hashing)."""
+    padded = f" {text} "
+    vector: Vector = {}
+    for i in range(len(padded) - n + 1):
+        gram = padded[i:i + n]
+        idx = int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=4).digest(), "little") % dims
+        vector[idx] = vector.get(idx, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {k: v / norm for k, v in vector.items()}
+
+
+def cosine(a: Vector, b: Vector) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+@dataclass
+class CachedResponse:
+    """Resposta armazenada."""
+    fingerprint: str
+    prompt: str
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+    vector: Optional[Vector] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.prompt) + len(self.text) + 8 * len(self.vector or ())
+
+
+class ResponseCache:
+    """Cache LRU+TTL com orçamento de bytes.
+
+    A camada exata usa o prompt normalizado + fingerprint da configuração.
+    Com `similarity > 0`, prompts parecidos (cosseno dos embeddings acima do
+    limiar) também são atendidos; `embed` pode ser trocado por um modelo local.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 3600.0,
+        similarity: float = 0.0,
+        embed: Callable[[str], Vector] = ngram_embedding,
+        max_scan: int = 512,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity = similarity
+        self.embed = embed
+        self.max_scan = max_scan
+        self.size = 0
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._by_config: Dict[str, "OrderedDict[str, None]"] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """Cria o cache se `RESPONSE_CACHE_ENABLED` estiver ativo."""
+        if os.getenv("RESPONSE_CACHE_ENABLED", "0").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(
+            max_bytes=int(os.getenv("RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024))),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            similarity=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0")),
+        )
+
+    @staticmethod
+    def cacheable(config: "SessionConfig") -> bool:
+        """Sessões com ferramentas dependem do ambiente e nunca usam o cache."""
+        return not config.allowed_tools
+
+    def lookup(self, fingerprint: str, prompt: str) -> Optional[CachedResponse]:
+        """Busca exata e, se habilitada, por similaridade."""
+        normalized = normalize_prompt(prompt)
+        key = self._key(fingerprint, normalized)
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._remove(key)
+            entry = None
+        if entry is None and self.similarity > 0:
+            entry = self._nearest(fingerprint, normalized)
+            if entry is not None:
+                self.similar_hits += 1
+                CACHE_EVENTS.inc(1, "similar_hits")
+                key = self._key(fingerprint, entry.prompt)
+        if entry is None:
+            self.misses += 1
+            CACHE_EVENTS.inc(1, "misses")
+            return None
+        self._entries.move_to_end(key)
+        self._by_config[fingerprint].move_to_end(key)
+        entry.hits += 1
+        self.hits += 1
+        self.saved_tokens += entry.input_tokens + entry.output_tokens
+        CACHE_EVENTS.inc(1, "hits")
+        CACHE_EVENTS.inc(entry.input_tokens + entry.output_tokens, "saved_tokens")
+        return entry
+
+    def store(self, fingerprint: str, prompt: str, text: str, input_tokens: int = 0, output_tokens: int = 0):
+        """Guarda uma resposta completa."""
+        normalized = normalize_prompt(prompt)
+        entry = CachedResponse(fingerprint, normalized, text, input_tokens, output_tokens)
+        if self.similarity > 0:
+            entry.vector = self.embed(normalized)
+        if entry.size > self.max_bytes:
+            return
+        key = self._key(fingerprint, normalized)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._by_config.setdefault(fingerprint, OrderedDict())[key] = None
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(self, fingerprint: str):
+        """Remove todas as respostas de uma configuração."""
+        for key in list(self._by_config.get(fingerprint, ())):
+            self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "saved_tokens": self.saved_tokens,
+        }
+
+    def _key(self, fingerprint: str, normalized: str) -> str:
+        return f"{fingerprint}:{normalized}"
+
+    def _expired(self, entry: CachedResponse) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl
+
+    def _nearest(self, fingerprint: str, normalized: str) -> Optional[CachedResponse]:
+        keys = self._by_config.get(fingerprint)
+        if not keys:
+            return None
+        query = self.embed(normalized)
+        best, best_score = None, self.similarity
+        # Mais recentes primeiro, limitado a `max_scan` candidatos
+        for i, key in enumerate(reversed(list(keys))):
+            if i >= self.max_scan:
+                break
+            entry = self._entries[key]
+            if self._expired(entry) or entry.vector is None:
+                continue
+            score = cosine(query, entry.vector)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        keys = self._by_config.get(entry.fingerprint)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._by_config[entry.fingerprint]
+
+
+def replay_events(entry: CachedResponse, chunk_size: int = 256) -> List[Dict[str, Any]]:
+    """Eventos de stream equivalentes a uma resposta em cache."""
+    events: List[Dict[str, Any]] = [
+        {"type": "assistant_text", "content": entry.text[i:i + chunk_size]}
+        for i in range(0, len(entry.text), chunk_size)
+    ]
+    events.append({
+        "type": "result",
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cost_usd": 0.0,
+        "cached": True,
+    })
+    return events
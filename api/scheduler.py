@@ -0,0 +1,185 @@
+"""Controle de admissão e fila de turnos por sessão."""
+
+import asyncio
+import itertools
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Any
+
+from metrics import TURNS_REJECTED
+
+
+class QueueFullError(Exception):
+    """Servidor saturado: a fila global atingiu o limite."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SessionLimitError(Exception):
+    """O IP atingiu o limite de sessões simultâneas."""
+
+
+class Ticket:
+    """Turno aguardando ou executando."""
+
+    def __init__(self, seq: int, session_id: str, client_ip: Optional[str]):
+        self.seq = seq
+        self.session_id = session_id
+        self.client_ip = client_ip
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self._granted = asyncio.Event()
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.is_set()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Aguarda a liberação do turno; retorna False se o timeout expirar."""
+        try:
+            await asyncio.wait_for(self._granted.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class TurnScheduler:
+    """Serializa turnos de uma mesma sessão e limita a concorrência global.
+
+    Sessões com turnos pendentes entram em rodízio: ao terminar um turno, a
+    sessão volta para o fim da fila, de modo que uma sessão com muitos turnos
+    enfileirados não atrasa as demais.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        max_queued: int = 32,
+        max_sessions_per_ip: int = 10,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_sessions_per_ip = max_sessions_per_ip
+        self._seq = itertools.count()
+        self._running = 0
+        self._waiting: Dict[str, Deque[Ticket]] = {}
+        self._active: Set[str] = set()
+        self._ready: Deque[str] = deque()
+        self._ip_sessions: Dict[str, Set[str]] = {}
+        self._session_ip: Dict[str, str] = {}
+        self._avg_turn = 5.0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "TurnScheduler":
+        """Cria o scheduler a partir das variáveis de ambiente."""
+        return cls(
+            max_concurrent=int(os.getenv("MAX_CONCURRENT_TURNS", "8")),
+            max_queued=int(os.getenv("MAX_QUEUED_TURNS", "32")),
+            max_sessions_per_ip=int(os.getenv("MAX_SESSIONS_PER_IP", "10")),
+        )
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    def register_session(self, session_id: str, client_ip: Optional[str]):
+        """Associa a sessão ao IP, respeitando `MAX_SESSIONS_PER_IP`."""
+        if not client_ip or session_id in self._session_ip:
+            return
+        sessions = self._ip_sessions.setdefault(client_ip, set())
+        if len(sessions) >= self.max_sessions_per_ip:
+            raise SessionLimitError(
+                f"Limite de {self.max_sessions_per_ip} sessões por IP atingido"
+            )
+        sessions.add(session_id)
+        self._session_ip[session_id] = client_ip
+
+    def forget_session(self, session_id: str):
+        """Libera a vaga da sessão no limite por IP."""
+        client_ip = self._session_ip.pop(session_id, None)
+        if client_ip is None:
+            return
+        sessions = self._ip_sessions.get(client_ip)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._ip_sessions[client_ip]
+
+    def submit(self, session_id: str, client_ip: Optional[str] = None) -> Ticket:
+        """Enfileira um turno ou rejeita imediatamente se saturado."""
+        if self._running >= self.max_concurrent and self.queued >= self.max_queued:
+            self.rejected += 1
+            TURNS_REJECTED.inc()
+            raise QueueFullError("Servidor ocupado, tente novamente", self.retry_after())
+        self.register_session(session_id, client_ip)
+
+        ticket = Ticket(next(self._seq), session_id, client_ip)
+        self._waiting.setdefault(session_id, deque()).append(ticket)
+        if session_id not in self._active and session_id not in self._ready:
+            self._ready.append(session_id)
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """Posição aproximada do turno na fila (0 quando já em execução)."""
+        if ticket.granted:
+            return 0
+        return 1 + sum(
+            1 for q in self._waiting.values() for t in q if t.seq < ticket.seq
+        )
+
+    def release(self, ticket: Ticket):
+        """Finaliza (ou desiste de) um turno e libera a próxima sessão."""
+        session_id = ticket.session_id
+        if ticket.granted:
+            if ticket.started_at is None:
+                return
+            elapsed = time.monotonic() - ticket.started_at
+            self._avg_turn = 0.8 * self._avg_turn + 0.2 * elapsed
+            ticket.started_at = None
+            self._running -= 1
+            self._active.discard(session_id)
+            if self._waiting.get(session_id):
+                self._ready.append(session_id)
+        else:
+            queue = self._waiting.get(session_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._waiting[session_id]
+                    if session_id in self._ready:
+                        self._ready.remove(session_id)
+        self._dispatch()
+
+    def retry_after(self) -> int:
+        """Estimativa em segundos para o cliente tentar novamente."""
+        turns_ahead = self.queued + self._running
+        return max(1, math.ceil(self._avg_turn * turns_ahead / max(1, self.max_concurrent)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas de admissão."""
+        return {
+            "running": self._running,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "rejected": self.rejected,
+            "tracked_ips": len(self._ip_sessions),
+        }
+
+    def _dispatch(self):
+        while self._running < self.max_concurrent and self._ready:
+            session_id = self._ready.popleft()
+            queue = self._waiting[session_id]
+            ticket = queue.popleft()
+            if not queue:
+                del self._waiting[session_id]
+            self._running += 1
+            self._active.add(session_id)
+            ticket.started_at = time.monotonic()
+            ticket._granted.set()
@@ -1,16 +1,33 @@
 """Servidor FastAPI para integração com Claude Code SDK."""
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Header, Query, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel, Field
+from starlette.requests import HTTPConnection
 from fastapi import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Literal, Tuple
+from datetime import datetime
 import asyncio
+import base64
+import binascii
 import json
+import os
+import secrets
 import uuid
 
-from claude_handler import ClaudeHandler, SessionConfig
+from claude_handler import ClaudeHandler, SessionConfig, SnapshotLimitError
+from scheduler import TurnScheduler, QueueFullError, SessionLimitError
+from session_store import REPLICA_ID
+from replay_buffer import ReplayBuffer
+from turns import TurnRegistry
+from session_reaper import SessionReaper
+from batches import BatchJob, BatchRunner
+from budgets import BudgetExceededError, BudgetLedger
+from blob_store import parse_range
+from compression import SSECompression
+from loop_monitor import LoopWatchdog, SamplingProfiler, folded_text, top_stacks
+import metrics
 
 app = FastAPI(
     title="Claude Chat API",
@@ -35,10 +52,15 @@ app = FastAPI(
     
     ### Formato de Resposta SSE:
     
-    As respostas são enviadas como eventos SSE no formato:
+    As respostas são enviadas como eventos SSE (schema `StreamEvent`) no formato:
     ```
-    data: {"type": "content", "content": "texto", "session_id": "uuid"}
-    data: {"type": "done", "session_id": "uuid"}
+    id: 1
+    event: assistant_text
+    data: {"type":"assistant_text","content":"texto","session_id":"uuid"}
+
+    id: 2
+    event: done
+    data: {"type":"done","session_id":"uuid"}
     ```
     """,
     version="1.0.0",
@@ -72,6 +94,21 @@ app = FastAPI(
     ]
 )
 
+# Pronto para tráfego só entre o fim do startup e o início do shutdown
+app.state.ready = False
+
+_default_openapi = app.openapi
+
+def openapi() -> Dict[str, Any]:
+    """Schema OpenAPI montado no primeiro acesso a /openapi.json ou /docs, não no import."""
+    if app.openapi_schema is None:
+        schema = _default_openapi()
+        # StreamEvent só aparece em respostas text/event-stream, fora dos modelos das rotas
+        schema.setdefault("components", {}).setdefault("schemas", {})["StreamEvent"] = StreamEvent.model_json_schema()
+    return app.openapi_schema
+
+app.openapi = openapi
+
 # Configuração CORS
 app.add_middleware(
     CORSMiddleware,
@@ -89,6 +126,135 @@ app.add_middleware(
 # Handler global
 claude_handler = ClaudeHandler()
 
+# Admissão de turnos e limite de sessões por IP
+scheduler = TurnScheduler.from_env()
+
+# Últimos frames de cada sessão para reconexão com Last-Event-ID
+replays = ReplayBuffer.from_env()
+
+# Uso de tokens e custo por sessão, IP e chave de API em janelas deslizantes
+budgets = BudgetLedger.from_env()
+claude_handler.on_usage(budgets.record)
+
+# Tasks de geração, independentes das conexões HTTP
+turns = TurnRegistry.from_env(claude_handler, scheduler, replays, budgets)
+
+# Remove sessões ociosas, expiradas ou excedentes e libera seus recursos
+reaper = SessionReaper.from_env(claude_handler.store, is_busy=lambda session_id: bool(turns.active(session_id)))
+reaper.on_evict(claude_handler.release_session)
+reaper.on_evict(scheduler.forget_session)
+reaper.on_evict(replays.discard)
+reaper.on_evict(budgets.forget)
+
+# Lotes de prompts (/api/batch) sobre os mesmos workers e fila
+batches = BatchRunner.from_env(claude_handler, scheduler, budgets)
+
+# Compressão opcional dos streams SSE (SSE_COMPRESSION)
+compression = SSECompression.from_env()
+
+# Atraso do event loop e pilhas de quem o bloqueia; profiler para /api/admin/profile
+watchdog = LoopWatchdog.from_env()
+profiler = SamplingProfiler.from_env()
+
+# Token dos endpoints /api/admin (sem ele, os endpoints respondem 404)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Replica": REPLICA_ID
+}
+
+def client_ip(request: HTTPConnection) -> Optional[str]:
+    """IP do cliente, considerando o proxy reverso (Caddy)."""
+    forwarded = request.headers.get("x-real-ip") or request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+def api_key(request: HTTPConnection) -> Optional[str]:
+    """Identificador da chave de API (`X-API-Key` ou `Authorization: Bearer`) para os orçamentos."""
+    key = request.headers.get("x-api-key")
+    if not key:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        key = token.strip() if scheme.lower() == "bearer" else None
+    return BudgetLedger.key_id(key)
+
+def require_admin(request: Request):
+    """Exige `ADMIN_TOKEN` em `X-Admin-Token` ou `Authorization: Bearer`."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token")
+    if not token:
+        scheme, _, value = request.headers.get("authorization", "").partition(" ")
+        token = value.strip() if scheme.lower() == "bearer" else ""
+    if not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token de administração inválido")
+
+async def reject_if_running_elsewhere(session_id: str):
+    """409 se o turno da sessão está em andamento em outra réplica.
+
+    Turnos, buffers de replay e interrupção são do processo que iniciou o
+    turno; a marca de ocupada no store (Redis) diz que ele existe em outro lugar.
+    """
+    if session_id not in await claude_handler.store.busy([session_id]):
+        return
+    meta = await claude_handler.store.get_meta(session_id) or {}
+    raise HTTPException(
+        status_code=409,
+        detail=f"Turno em andamento na réplica {meta.get('replica') or 'desconhecida'}",
+        headers={"X-Replica": REPLICA_ID},
+    )
+
+def register_session_ip(session_id: str, request: Request):
+    """Conta a sessão no limite do IP ou responde 429."""
+    try:
+        scheduler.register_session(session_id, client_ip(request))
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+def sse_response(frames: AsyncIterator[bytes], request: Request, session_id: str) -> StreamingResponse:
+    """Resposta SSE, comprimida quando habilitado e aceito pelo cliente."""
+    headers = {**SSE_HEADERS, "X-Session-ID": session_id}
+    if compression.enabled:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = compression.negotiate(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            frames = compression.wrap(frames, encoding)
+            headers["Content-Encoding"] = encoding
+            # Proxies não devem recomprimir nem bufferizar o stream
+            headers["Cache-Control"] = "no-cache, no-transform"
+    return StreamingResponse(metered(frames), media_type="text/event-stream", headers=headers)
+
+async def metered(frames: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Conta conexões SSE abertas e bytes enviados."""
+    metrics.LIVE_STREAMS.inc()
+    try:
+        async for frame in frames:
+            metrics.STREAM_BYTES.inc(len(frame))
+            yield frame
+    finally:
+        metrics.LIVE_STREAMS.dec()
+
+@app.on_event("startup")
+async def startup():
+    """Aquece o pool de workers do CLI e inicia a limpeza de turnos e sessões."""
+    await claude_handler.startup()
+    watchdog.start()
+    turns.start()
+    reaper.start()
+    app.state.ready = True
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Cancela os turnos e encerra os workers do CLI."""
+    app.state.ready = False
+    await reaper.close()
+    await batches.close()
+    await turns.close()
+    await claude_handler.shutdown()
+    await watchdog.close()
+
 class ChatMessage(BaseModel):
     """Modelo para mensagem de chat."""
     message: str = Field(
@@ -101,6 +267,28 @@ class ChatMessage(BaseModel):
         description="ID da sessão. Se não fornecido, será gerado automaticamente",
         example="550e8400-e29b-41d4-a716-446655440000"
     )
+    coalesce_ms: Optional[int] = Field(
+        None,
+        ge=0,
+        description="Janela (ms) para agrupar trechos de texto em um único evento. 0 desativa; padrão STREAM_COALESCE_MS",
+        example=25
+    )
+    coalesce_bytes: Optional[int] = Field(
+        None,
+        gt=0,
+        description="Tamanho máximo de um grupo de texto antes do envio; padrão STREAM_COALESCE_BYTES",
+        example=2048
+    )
+    pin: bool = Field(
+        False,
+        description="Fixa a mensagem no histórico: a compactação nunca a resume",
+        example=False
+    )
+    backpressure: Optional[Literal["pause", "coalesce", "drop"]] = Field(
+        None,
+        description="Com o cliente atrasado além de STREAM_HIGH_WATER_BYTES: pausar a geração, agrupar textos pendentes ou encerrar o stream; padrão STREAM_BACKPRESSURE",
+        example="pause"
+    )
     
     class Config:
         json_schema_extra = {
@@ -130,6 +318,21 @@ class HealthResponse(BaseModel):
     status: str = Field(..., description="Status da API", example="ok")
     service: str = Field(..., description="Nome do serviço", example="Claude Chat API")
 
+class UsageWindowInfo(BaseModel):
+    """Uso de um escopo na janela deslizante."""
+    tokens: int = Field(..., description="Tokens (entrada + saída) na janela")
+    cost_usd: float = Field(..., description="Custo em USD na janela")
+    max_tokens: int = Field(..., description="Limite rígido de tokens (0 = sem limite)")
+    max_cost_usd: float = Field(..., description="Limite rígido de custo (0 = sem limite)")
+
+class UsageResponse(BaseModel):
+    """Uso do cliente nas janelas de orçamento."""
+    window_seconds: float = Field(..., description="Tamanho da janela deslizante", example=3600)
+    soft_ratio: float = Field(..., description="Fração do limite rígido a partir da qual as respostas são cortadas", example=0.8)
+    session: Optional[UsageWindowInfo] = Field(None, description="Uso da sessão informada")
+    ip: Optional[UsageWindowInfo] = Field(None, description="Uso do IP do cliente")
+    key: Optional[UsageWindowInfo] = Field(None, description="Uso da chave de API enviada")
+
 class SessionResponse(BaseModel):
     """Resposta para operações de sessão."""
     session_id: str = Field(..., description="ID da sessão", example="550e8400-e29b-41d4-a716-446655440000")
@@ -140,11 +343,35 @@ class StatusResponse(BaseModel):
     session_id: str = Field(..., description="ID da sessão afetada", example="550e8400-e29b-41d4-a716-446655440000")
 
 class StreamEvent(BaseModel):
-    """Evento SSE para streaming."""
-    type: str = Field(..., description="Tipo do evento", example="content")
-    content: Optional[str] = Field(None, description="Conteúdo da mensagem", example="Olá! Como posso ajudar?")
+    """Evento SSE para streaming (contrato do campo `data:`).
+
+    Campos ausentes (None) não são enviados.
+    """
+    type: str = Field(
+        ...,
+        description="Tipo do evento: queued, reset, assistant_text, tool_use, tool_result, result, error ou done",
+        example="assistant_text"
+    )
     session_id: str = Field(..., description="ID da sessão", example="550e8400-e29b-41d4-a716-446655440000")
+    content: Optional[Any] = Field(None, description="Texto (assistant_text) ou saída da ferramenta (tool_result)", example="Olá! Como posso ajudar?")
     error: Optional[str] = Field(None, description="Mensagem de erro se houver")
+    position: Optional[int] = Field(None, description="Posição na fila (eventos 'queued')", example=3)
+    missed: Optional[int] = Field(None, description="Eventos perdidos que já saíram do buffer de replay (reset)", example=12)
+    tool: Optional[str] = Field(None, description="Nome da ferramenta (tool_use)", example="Read")
+    id: Optional[str] = Field(None, description="ID do uso de ferramenta (tool_use)")
+    input: Optional[Dict[str, Any]] = Field(None, description="Parâmetros da ferramenta (tool_use)")
+    permitted: Optional[bool] = Field(None, description="false quando a ferramenta não está liberada por allowed_tools/permission_mode (tool_use)")
+    tool_id: Optional[str] = Field(None, description="ID do tool_use correspondente (tool_result)")
+    blob: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Saída grande guardada fora do stream (tool_result): id, size, media_type e url; `content` traz só o início",
+        example={"id": "9f86d081884c7d65...", "size": 1048576, "media_type": "text/plain; charset=utf-8", "url": "/api/blobs/9f86d081884c7d65..."}
+    )
+    input_tokens: Optional[int] = Field(None, description="Tokens de entrada (result)")
+    output_tokens: Optional[int] = Field(None, description="Tokens de saída (result)")
+    cost_usd: Optional[float] = Field(None, description="Custo do turno em USD (result)")
+    is_error: Optional[bool] = Field(None, description="Turno terminou com erro ou interrupção (result)")
+    cached: Optional[bool] = Field(None, description="Resposta servida do cache (result)")
 
 class SessionConfigRequest(BaseModel):
     """Configuração para criar ou atualizar uma sessão."""
@@ -165,12 +392,132 @@ class SessionConfigRequest(BaseModel):
             }
         }
 
+    def to_session_config(self) -> SessionConfig:
+        return SessionConfig(
+            system_prompt=self.system_prompt,
+            allowed_tools=self.allowed_tools,
+            max_turns=self.max_turns,
+            permission_mode=self.permission_mode,
+            cwd=self.cwd
+        )
+
+class BatchRequest(BaseModel):
+    """Lote de prompts executados com a mesma configuração."""
+    prompts: List[str] = Field(..., min_length=1, description="Prompts, cada um numa sessão própria")
+    config: Optional[SessionConfigRequest] = Field(None, description="Configuração comum a todos os prompts")
+    parallelism: Optional[int] = Field(None, ge=1, description="Prompts simultâneos (limitado por BATCH_PARALLELISM)", example=4)
+    stream: bool = Field(True, description="Envia os resultados em NDJSON conforme terminam; false apenas inicia o job")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "prompts": ["Resuma: ...", "Traduza para inglês: ..."],
+                "config": {"system_prompt": "Responda em uma frase"},
+                "parallelism": 4
+            }
+        }
+
+class BatchResult(BaseModel):
+    """Resultado de um prompt do lote (uma linha `result` do NDJSON)."""
+    index: int = Field(..., description="Posição do prompt em `prompts`")
+    status: str = Field(..., description="completed, error ou cancelled")
+    content: str = Field("", description="Texto da resposta (parcial se cancelado)")
+    error: Optional[str] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    cost_usd: Optional[float] = None
+    cached: Optional[bool] = None
+
+class BatchStatusResponse(BaseModel):
+    """Estado de um lote e os resultados já prontos, por índice."""
+    job_id: str
+    status: str = Field(..., description="running, completed ou cancelled")
+    total: int
+    completed: int
+    failed: int
+    cancelled: int
+    parallelism: int
+    created_at: str
+    finished_at: Optional[str] = None
+    results: List[BatchResult] = Field(default_factory=list)
+
+def batch_status(job: BatchJob, results: bool = True) -> BatchStatusResponse:
+    summary = job.summary()
+    summary["created_at"] = datetime.fromtimestamp(summary["created_at"]).isoformat()
+    if summary["finished_at"] is not None:
+        summary["finished_at"] = datetime.fromtimestamp(summary["finished_at"]).isoformat()
+    if results:
+        summary["results"] = sorted(job.results, key=lambda result: result["index"])
+    return BatchStatusResponse(**summary)
+
 class SessionInfoResponse(BaseModel):
     """Informações detalhadas de uma sessão."""
     session_id: str
     active: bool
     config: Dict[str, Any]
     history: Dict[str, Any]
+    compaction: Optional[Dict[str, Any]] = None
+
+class ForkResponse(BaseModel):
+    """Sessão criada a partir de outra."""
+    session_id: str = Field(..., description="ID da nova sessão")
+    source_session_id: str = Field(..., description="Sessão de origem")
+    message_count: int = Field(..., description="Mensagens herdadas da origem", example=5)
+    resumed: bool = Field(..., description="O worker da cópia retoma o contexto do CLI em vez de receber o histórico")
+
+class SnapshotInfo(BaseModel):
+    """Snapshot de configuração e histórico de uma sessão."""
+    snapshot_id: str
+    session_id: str
+    created_at: str
+    message_count: int = Field(..., description="Mensagens guardadas")
+
+class SnapshotListResponse(BaseModel):
+    """Snapshots de uma sessão, do mais antigo ao mais recente."""
+    session_id: str
+    snapshots: List[SnapshotInfo]
+
+def snapshot_info(session_id: str, summary: Dict[str, Any]) -> SnapshotInfo:
+    return SnapshotInfo(
+        session_id=session_id,
+        snapshot_id=summary["snapshot_id"],
+        created_at=datetime.fromtimestamp(summary["created_at"]).isoformat(),
+        message_count=summary["message_count"]
+    )
+
+# Blocos opcionais de cada item em /api/sessions
+SESSION_FIELDS = {"config", "history", "compaction"}
+
+class SessionSummary(BaseModel):
+    """Item da listagem de sessões; blocos extras só quando pedidos em `fields`."""
+    session_id: str
+    active: bool = Field(False, description="Há turno enfileirado ou em execução")
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    version: int = Field(..., description="Versão da última alteração")
+    fingerprint: Optional[str] = Field(None, description="Fingerprint da configuração")
+    deleted: Optional[bool] = Field(None, description="Sessão removida (só no feed `since`)")
+    config: Optional[Dict[str, Any]] = None
+    history: Optional[Dict[str, Any]] = None
+    compaction: Optional[Dict[str, Any]] = None
+
+class SessionListResponse(BaseModel):
+    """Página da listagem de sessões."""
+    sessions: List[SessionSummary]
+    next_cursor: Optional[str] = Field(None, description="Cursor da próxima página; ausente na última")
+    version: int = Field(..., description="Versão a usar como `since` na próxima consulta")
+    reset: bool = Field(False, description="`since` antigo demais: refaça a listagem")
+
+def encode_cursor(position: Tuple[float, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Posição `(created_at, session_id)` de um cursor ou 400."""
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(created_at), str(session_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
 @app.get(
     "/",
@@ -194,6 +541,147 @@ async def root() -> HealthResponse:
     """Health check endpoint para verificar o status da API."""
     return HealthResponse(status="ok", service="Claude Chat API")
 
+@app.get(
+    "/ready",
+    tags=["Sistema"],
+    summary="Readiness",
+    description="""Indica se esta réplica aceita tráfego.
+    
+    Responde 503 até o startup terminar (pool de workers aquecido, tarefas de
+    limpeza iniciadas) e a partir do início do shutdown. Use como readiness
+    probe do balanceador ou orquestrador; `/` continua sendo o liveness.
+    """,
+    response_model=HealthResponse,
+    responses={503: {"description": "Iniciando ou encerrando"}}
+)
+async def readiness():
+    """Readiness probe."""
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "service": "Claude Chat API"})
+    return HealthResponse(status="ready", service="Claude Chat API")
+
+@app.get(
+    "/api/usage",
+    tags=["Sistema"],
+    summary="Uso e Orçamento",
+    description="""Tokens e custo do cliente nas janelas de orçamento (`BUDGET_*`).
+    
+    Sempre traz o IP; a chave de API quando enviada em `X-API-Key` ou
+    `Authorization: Bearer`, e a sessão quando informada em `session_id`.
+    """,
+    response_model=UsageResponse,
+    response_model_exclude_none=True
+)
+async def get_usage(
+    request: Request,
+    session_id: Optional[str] = Query(None, description="ID da sessão")
+) -> UsageResponse:
+    """Uso nas janelas deslizantes desta réplica."""
+    ip = client_ip(request)
+    key = api_key(request)
+    return UsageResponse(
+        window_seconds=budgets.window,
+        soft_ratio=budgets.soft_ratio,
+        session=budgets.usage("session", session_id) if session_id else None,
+        ip=budgets.usage("ip", ip) if ip else None,
+        key=budgets.usage("key", key) if key else None
+    )
+
+@app.get(
+    "/metrics",
+    tags=["Sistema"],
+    summary="Métricas",
+    description="""Métricas no formato de texto do Prometheus.
+    
+    Histogramas de tempo até o primeiro token, intervalo entre frames, duração
+    do turno, espera na fila e inicialização de workers; contadores de bytes
+    enviados, tokens e custo por configuração; estado da fila, do pool e das sessões.
+    Os valores são desta réplica.
+    """,
+    response_class=Response,
+    responses={200: {"content": {"text/plain": {}}}}
+)
+async def get_metrics() -> Response:
+    """Expõe as métricas para o Prometheus."""
+    queue = scheduler.stats()
+    metrics.ACTIVE_SESSIONS.set(await claude_handler.store.count())
+    metrics.TURNS_RUNNING.set(queue["running"])
+    metrics.TURNS_QUEUED.set(queue["queued"])
+    replay = replays.stats()
+    metrics.REPLAY_BYTES.set(replay["bytes"])
+    metrics.STREAM_BACKLOG.set(replay["backlog_bytes"])
+    metrics.STREAM_MAX_BACKLOG.set(replay["max_backlog_bytes"])
+    metrics.SLOW_STREAMS.set(replay["slow_readers"])
+    if claude_handler.pool is not None:
+        pool = claude_handler.pool.stats()
+        metrics.POOL_WORKERS.set(pool["busy"], "busy")
+        metrics.POOL_WORKERS.set(pool["bound"] - pool["busy"], "idle")
+        metrics.POOL_WORKERS.set(pool["spare"], "spare")
+    if claude_handler.blobs is not None:
+        for stat, value in claude_handler.blobs.stats().items():
+            metrics.BLOB_STORE.set(value or 0, stat)
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get(
+    "/api/admin/loop",
+    tags=["Sistema"],
+    summary="Diagnóstico do Event Loop",
+    description="""Atraso do event loop, últimos bloqueios e custo de cada turno em andamento.
+    
+    Cada bloqueio acima de `LOOP_LAG_THRESHOLD_MS` traz a pilha da thread do
+    loop no momento da captura e a task que estava executando. Em `turns`,
+    `emit_ms` é o tempo gasto no loop serializando e publicando os eventos do
+    turno e `paused_ms` o tempo parado esperando clientes lentos.
+    
+    Exige `ADMIN_TOKEN` em `X-Admin-Token` ou `Authorization: Bearer`.
+    """,
+    responses={403: {"description": "Token inválido"}, 404: {"description": "ADMIN_TOKEN não configurado"}}
+)
+async def get_loop_diagnostics(request: Request) -> Dict[str, Any]:
+    """Estado do watchdog e dos turnos desta réplica."""
+    require_admin(request)
+    return {**watchdog.stats(), "tasks": len(asyncio.all_tasks()), "turns": turns.task_stats()}
+
+@app.get(
+    "/api/admin/profile",
+    tags=["Sistema"],
+    summary="Profile por Amostragem",
+    description="""Amostra as pilhas de todas as threads desta réplica por `seconds` segundos.
+    
+    O padrão é o formato "folded" (`raiz;...;função contagem`), aceito por
+    `flamegraph.pl`, speedscope e inferno. A raiz de cada pilha da thread do
+    loop é a task em execução (`task:turn:<session_id>`, por exemplo) ou
+    `loop:idle`; as demais threads aparecem como `thread:<nome>`. Com
+    `format=json`, traz as pilhas mais frequentes e as amostras por task.
+    
+    O loop continua atendendo durante o profile; um profile por vez (409).
+    Exige `ADMIN_TOKEN` em `X-Admin-Token` ou `Authorization: Bearer`.
+    """,
+    response_class=Response,
+    responses={
+        200: {"content": {"text/plain": {}, "application/json": {}}},
+        403: {"description": "Token inválido"},
+        404: {"description": "ADMIN_TOKEN não configurado"},
+        409: {"description": "Outro profile em andamento"}
+    }
+)
+async def get_profile(
+    request: Request,
+    seconds: float = Query(5.0, gt=0, description="Duração da amostragem (limitada por PROFILE_MAX_SECONDS)"),
+    interval_ms: float = Query(5.0, ge=1, le=1000, description="Intervalo entre amostras"),
+    format: Literal["folded", "json"] = Query("folded", description="folded ou json")
+) -> Response:
+    """Profile da réplica em formato de flamegraph."""
+    require_admin(request)
+    try:
+        result = await profiler.profile(seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if format == "json":
+        stacks = [{"stack": stack, "count": count} for stack, count in top_stacks(result["stacks"])]
+        return JSONResponse({**result, "stacks": stacks})
+    return Response(folded_text(result["stacks"]), media_type="text/plain")
+
 @app.post(
     "/api/chat",
     tags=["Chat"],
@@ -202,6 +690,14 @@ async def root() -> HealthResponse:
     
     As respostas são enviadas como Server-Sent Events (SSE) permitindo recebimento em tempo real.
     Cada chunk de resposta é enviado como um evento 'data' no formato JSON.
+    
+    Turnos da mesma sessão são executados em ordem. Enquanto aguarda na fila, o stream
+    emite eventos `queued` com a posição. Com o servidor saturado a resposta é 429.
+    
+    Com orçamentos configurados (`BUDGET_*`), a sessão, o IP e a chave de API
+    (`X-API-Key` ou `Authorization: Bearer`) acumulam tokens e custo numa janela
+    deslizante: acima do limite flexível a resposta é cortada ao atingir o rígido,
+    e com o rígido esgotado o turno é recusado com 429 e `Retry-After`.
     """,
     response_description="Stream SSE com resposta de Claude",
     responses={
@@ -209,53 +705,256 @@ async def root() -> HealthResponse:
             "description": "Stream SSE iniciado com sucesso",
             "content": {
                 "text/event-stream": {
-                    "example": "data: {\"type\": \"content\", \"content\": \"Olá!\", \"session_id\": \"uuid\"}\n\n"
+                    "schema": {"$ref": "#/components/schemas/StreamEvent"},
+                    "example": "id: 1\nevent: assistant_text\ndata: {\"type\":\"assistant_text\",\"content\":\"Olá!\",\"session_id\":\"uuid\"}\n\n"
                 }
             }
         },
+        429: {
+            "description": "Servidor saturado, limite de sessões por IP ou orçamento esgotado (ver Retry-After)"
+        },
         500: {
             "description": "Erro no processamento da mensagem"
         }
     }
 )
-async def send_message(chat_message: ChatMessage) -> StreamingResponse:
+async def send_message(chat_message: ChatMessage, request: Request) -> StreamingResponse:
     """Envia mensagem para Claude e retorna resposta em streaming."""
     
     # Gera session_id se não fornecido
     session_id = chat_message.session_id or str(uuid.uuid4())
     
-    async def generate():
-        """Gera stream SSE."""
-        try:
-            async for response in claude_handler.send_message(
-                session_id, 
-                chat_message.message
-            ):
-                # Formato SSE
-                data = json.dumps(response)
-                yield f"data: {data}\n\n"
-                
-        except Exception as e:
-            error_data = json.dumps({
-                "type": "error",
-                "error": str(e),
-                "session_id": session_id
-            })
-            yield f"data: {error_data}\n\n"
-        finally:
-            # Envia evento de fim
-            yield f"data: {json.dumps({'type': 'done', 'session_id': session_id})}\n\n"
+    try:
+        run = turns.submit(
+            session_id,
+            chat_message.message,
+            client_ip(request),
+            chat_message.coalesce_ms,
+            chat_message.coalesce_bytes,
+            chat_message.pin,
+            api_key(request)
+        )
+    except (QueueFullError, BudgetExceededError) as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Session-ID": session_id
+    return sse_response(turns.stream(run, chat_message.backpressure), request, session_id)
+
+@app.get(
+    "/api/stream/{session_id}",
+    tags=["Chat"],
+    summary="Retomar Stream",
+    description="""Reconecta ao turno atual (ou ao último) da sessão.
+    
+    Reenvia os eventos posteriores ao `Last-Event-ID` informado (header enviado
+    automaticamente pelo EventSource ao reconectar, ou parâmetro `last_event_id`)
+    e continua acompanhando a geração ao vivo até o evento `done`.
+    Sem `Last-Event-ID`, o turno é reenviado desde o início. Se eventos
+    posteriores ao `Last-Event-ID` já saíram do buffer, o stream começa com um
+    evento `reset` com a quantidade perdida em `missed`.
+    """,
+    response_description="Stream SSE retomado",
+    responses={
+        200: {
+            "description": "Stream SSE retomado",
+            "content": {"text/event-stream": {"schema": {"$ref": "#/components/schemas/StreamEvent"}}}
+        },
+        404: {
+            "description": "Nenhum turno registrado para a sessão"
+        },
+        409: {
+            "description": "O turno está em andamento em outra réplica (ver `X-Replica` e afinidade de sessão)"
+        }
+    }
+)
+async def resume_stream(
+    request: Request,
+    session_id: str = Path(..., description="ID da sessão"),
+    last_event_id: Optional[int] = None,
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    backpressure: Optional[Literal["pause", "coalesce", "drop"]] = Query(None, description="Política para cliente lento (ver `POST /api/chat`)")
+) -> StreamingResponse:
+    """Retoma o stream de uma sessão a partir do último evento recebido."""
+    turn = replays.get(session_id)
+    if turn is None:
+        await reject_if_running_elsewhere(session_id)
+        raise HTTPException(status_code=404, detail="No stream for session")
+    
+    after_id = last_event_id
+    if after_id is None and last_event_id_header and last_event_id_header.isdigit():
+        after_id = int(last_event_id_header)
+    
+    return sse_response(turn.subscribe(after_id, backpressure), request, session_id)
+
+@app.websocket("/api/ws")
+async def websocket_mux(
+    websocket: WebSocket,
+    format: Literal["json", "binary"] = Query("json", description="Framing dos eventos")
+):
+    """Várias sessões numa conexão: canais, créditos e controle (ver `ws_mux`)."""
+    from ws_mux import MuxConnection
+
+    await websocket.accept()
+    connection = MuxConnection.from_env(
+        websocket,
+        turns,
+        claude_handler,
+        replays,
+        client_ip=client_ip(websocket),
+        api_key=api_key(websocket),
+        binary=format == "binary"
+    )
+    await connection.run()
+
+async def follow_batch(job: BatchJob) -> AsyncIterator[bytes]:
+    """NDJSON do lote; cancela o job se o cliente desconectar antes do fim."""
+    try:
+        yield BatchRunner.encode({"type": "job", "job_id": job.id, "total": len(job.prompts)})
+        async for result in job.follow():
+            yield BatchRunner.encode({"type": "result", **result})
+        yield BatchRunner.encode({"type": "done", **batch_status(job, results=False).model_dump(exclude={"results"})})
+    finally:
+        if not job.done:
+            await batches.cancel(job.id)
+
+@app.post(
+    "/api/batch",
+    tags=["Chat"],
+    summary="Executar Lote",
+    description="""Executa vários prompts com a mesma configuração em um único job.
+    
+    Cada prompt roda numa sessão própria, com no máximo `parallelism` prompts
+    simultâneos, passando pela mesma fila de `/api/chat`. Com `stream: true` (padrão)
+    a resposta é NDJSON: uma linha `job`, uma linha `result` por prompt na ordem em
+    que terminam (com o `index` do prompt) e uma linha `done` com os totais; fechar a
+    conexão cancela o job. Com `stream: false` o job roda em background e os
+    resultados são consultados em `GET /api/batch/{job_id}`.
+    """,
+    response_description="Stream NDJSON ou estado do job",
+    responses={
+        200: {
+            "description": "Resultados em NDJSON (stream) ou job iniciado",
+            "content": {
+                "application/x-ndjson": {
+                    "example": '{"type":"job","job_id":"9f1c...","total":2}\n'
+                               '{"type":"result","index":1,"status":"completed","content":"..."}\n'
+                }
+            }
+        },
+        400: {
+            "description": "Prompts demais no lote"
+        },
+        429: {
+            "description": "Orçamento do IP ou da chave de API esgotado (ver Retry-After)"
         }
+    },
+    response_model=BatchStatusResponse
+)
+async def run_batch(batch: BatchRequest, request: Request):
+    """Inicia um lote de prompts."""
+    config = batch.config.to_session_config() if batch.config else SessionConfig()
+    try:
+        job = batches.submit(batch.prompts, config, batch.parallelism, client_ip(request), api_key(request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BudgetExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    if not batch.stream:
+        return batch_status(job)
+    return StreamingResponse(
+        follow_batch(job),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-ID": job.id, "X-Replica": REPLICA_ID}
     )
 
+@app.get(
+    "/api/batch/{job_id}",
+    tags=["Chat"],
+    summary="Consultar Lote",
+    description="Estado do job e os resultados já concluídos, em ordem de índice.",
+    response_model=BatchStatusResponse,
+    response_model_exclude_none=True,
+    responses={404: {"description": "Job não encontrado ou expirado"}}
+)
+async def get_batch(job_id: str = Path(..., description="ID do job")) -> BatchStatusResponse:
+    """Consulta um lote."""
+    job = batches.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_status(job)
+
+@app.delete(
+    "/api/batch/{job_id}",
+    tags=["Chat"],
+    summary="Cancelar Lote",
+    description="""Cancela o job. Prompts em execução são interrompidos e voltam com o
+    texto parcial; os que não começaram voltam como `cancelled`.""",
+    response_model=BatchStatusResponse,
+    response_model_exclude_none=True,
+    responses={404: {"description": "Job não encontrado ou expirado"}}
+)
+async def cancel_batch(job_id: str = Path(..., description="ID do job")) -> BatchStatusResponse:
+    """Cancela um lote e devolve os resultados parciais."""
+    job = await batches.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_status(job)
+
+@app.get(
+    "/api/blobs/{blob_id}",
+    tags=["Chat"],
+    summary="Baixar Resultado de Ferramenta",
+    description="""Conteúdo completo de um `tool_result` guardado fora do stream (campo `blob`).
+    
+    Aceita `Range: bytes=início-fim` (um intervalo) e responde 206; o id é o
+    sha256 do conteúdo, então a resposta é imutável e pode ser cacheada.
+    """,
+    response_class=Response,
+    responses={
+        200: {"description": "Blob completo"},
+        206: {"description": "Intervalo do blob"},
+        404: {"description": "Blob inexistente, removido ou store desabilitado"},
+        416: {"description": "Range fora do blob"}
+    }
+)
+async def get_blob(
+    request: Request,
+    blob_id: str = Path(..., description="ID (sha256) do blob")
+) -> Response:
+    """Serve um blob com suporte a Range."""
+    blobs = claude_handler.blobs
+    path = blobs.path(blob_id) if blobs is not None else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    size = os.path.getsize(path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{blob_id}"',
+        "Cache-Control": "public, max-age=31536000, immutable"
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    # Content-Type direto no header: o charset já vem no tipo registrado
+    headers["Content-Type"] = blobs.media_type(path)
+    return StreamingResponse(blobs.read(path, start, end), status_code=status, headers=headers)
+
 @app.post(
     "/api/interrupt",
     tags=["Sessões"],
@@ -276,13 +975,20 @@ async def send_message(chat_message: ChatMessage) -> StreamingResponse:
         },
         404: {
             "description": "Sessão não encontrada"
+        },
+        409: {
+            "description": "O turno está em andamento em outra réplica e não foi interrompido"
         }
     },
     response_model=StatusResponse
 )
 async def interrupt_session(action: SessionAction) -> StatusResponse:
     """Interrompe a execução de uma sessão ativa."""
-    success = await claude_handler.interrupt_session(action.session_id)
+    success = await turns.interrupt(action.session_id)
+    if not success:
+        # Sessão ociosa responde 200; turno de outra réplica não pode ser interrompido daqui
+        await reject_if_running_elsewhere(action.session_id)
+        success = await claude_handler.store.exists(action.session_id)
     
     if not success:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -333,13 +1039,17 @@ async def clear_session(action: SessionAction) -> StatusResponse:
                     "example": {"session_id": "550e8400-e29b-41d4-a716-446655440000"}
                 }
             }
+        },
+        429: {
+            "description": "Limite de sessões por IP atingido"
         }
     },
     response_model=SessionResponse
 )
-async def create_new_session() -> SessionResponse:
+async def create_new_session(request: Request) -> SessionResponse:
     """Cria uma nova sessão com ID único."""
     session_id = str(uuid.uuid4())
+    register_session_ip(session_id, request)
     await claude_handler.create_session(session_id)
     return SessionResponse(session_id=session_id)
 
@@ -369,7 +1079,8 @@ async def create_new_session() -> SessionResponse:
 )
 async def delete_session(session_id: str = Path(..., description="ID único da sessão a ser deletada")) -> StatusResponse:
     """Remove permanentemente uma sessão."""
-    await claude_handler.destroy_session(session_id)
+    await turns.interrupt(session_id)
+    await reaper.evict(session_id, "deleted")
     return StatusResponse(status="deleted", session_id=session_id)
 
 @app.post(
@@ -389,21 +1100,19 @@ async def delete_session(session_id: str = Path(..., description="ID único da s
                     "example": {"session_id": "uuid"}
                 }
             }
+        },
+        429: {
+            "description": "Limite de sessões por IP atingido"
         }
     },
     response_model=SessionResponse
 )
-async def create_session_with_config(config: SessionConfigRequest) -> SessionResponse:
+async def create_session_with_config(config: SessionConfigRequest, request: Request) -> SessionResponse:
     """Cria uma sessão com configurações específicas."""
     session_id = str(uuid.uuid4())
+    register_session_ip(session_id, request)
     
-    session_config = SessionConfig(
-        system_prompt=config.system_prompt,
-        allowed_tools=config.allowed_tools,
-        max_turns=config.max_turns,
-        permission_mode=config.permission_mode,
-        cwd=config.cwd
-    )
+    session_config = config.to_session_config()
     
     await claude_handler.create_session(session_id, session_config)
     return SessionResponse(session_id=session_id)
@@ -415,6 +1124,8 @@ async def create_session_with_config(config: SessionConfigRequest) -> SessionRes
     description="""Atualiza a configuração de uma sessão existente.
     
     A sessão será recriada com as novas configurações mas o histórico será mantido.
+    Configuração idêntica à atual não altera nada, e mudanças que não afetam o
+    fingerprint mantêm o worker aquecido da sessão.
     """,
     response_description="Confirmação de atualização",
     responses={
@@ -437,13 +1148,7 @@ async def update_session_config(
     config: SessionConfigRequest = ...
 ) -> StatusResponse:
     """Atualiza configuração de uma sessão."""
-    session_config = SessionConfig(
-        system_prompt=config.system_prompt,
-        allowed_tools=config.allowed_tools,
-        max_turns=config.max_turns,
-        permission_mode=config.permission_mode,
-        cwd=config.cwd
-    )
+    session_config = config.to_session_config()
     
     success = await claude_handler.update_session_config(session_id, session_config)
     if not success:
@@ -451,6 +1156,128 @@ async def update_session_config(
     
     return StatusResponse(status="updated", session_id=session_id)
 
+@app.post(
+    "/api/session/{session_id}/fork",
+    tags=["Sessões"],
+    summary="Bifurcar Sessão",
+    description="""Cria uma nova sessão com a configuração e as primeiras `at` mensagens
+    do histórico desta (todas sem `at`), para tentar outro caminho a partir de um ponto
+    da conversa.
+    
+    O fork é O(1): as duas sessões compartilham o prefixo do histórico em memória
+    (copy-on-write). No fim da conversa e com o worker da origem ocioso, a cópia
+    retoma o contexto já carregado no CLI (`resumed: true`) em vez de reenviar o histórico.
+    """,
+    response_description="Nova sessão",
+    responses={
+        400: {"description": "`at` maior que o histórico"},
+        404: {"description": "Sessão não encontrada"},
+        429: {"description": "Limite de sessões por IP atingido"}
+    },
+    response_model=ForkResponse
+)
+async def fork_session(
+    request: Request,
+    session_id: str = Path(..., description="ID da sessão de origem"),
+    at: Optional[int] = Query(None, ge=0, description="Mensagens mantidas (padrão: todas)")
+) -> ForkResponse:
+    """Bifurca uma sessão num ponto do histórico."""
+    if not await claude_handler.store.exists(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    fork_id = str(uuid.uuid4())
+    register_session_ip(fork_id, request)
+    try:
+        forked = await claude_handler.fork_session(session_id, fork_id, at)
+    except ValueError as e:
+        scheduler.forget_session(fork_id)
+        raise HTTPException(status_code=400, detail=str(e))
+    if forked is None:
+        scheduler.forget_session(fork_id)
+        raise HTTPException(status_code=404, detail="Session not found")
+    return ForkResponse(**forked)
+
+@app.post(
+    "/api/session/{session_id}/snapshots",
+    tags=["Sessões"],
+    summary="Criar Snapshot",
+    description="""Guarda a configuração e o histórico atuais da sessão para voltar a eles
+    depois com `restore`. Em memória o snapshot compartilha o histórico com a sessão
+    (copy-on-write). Snapshots são removidos junto com a sessão; o máximo por sessão
+    é `SESSION_MAX_SNAPSHOTS`.
+    """,
+    responses={
+        404: {"description": "Sessão não encontrada"},
+        409: {"description": "Limite de snapshots da sessão atingido"}
+    },
+    response_model=SnapshotInfo
+)
+async def create_snapshot(session_id: str = Path(..., description="ID da sessão")) -> SnapshotInfo:
+    """Cria um snapshot da sessão."""
+    try:
+        summary = await claude_handler.snapshot_session(session_id, str(uuid.uuid4()))
+    except SnapshotLimitError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return snapshot_info(session_id, summary)
+
+@app.get(
+    "/api/session/{session_id}/snapshots",
+    tags=["Sessões"],
+    summary="Listar Snapshots",
+    responses={404: {"description": "Sessão não encontrada"}},
+    response_model=SnapshotListResponse
+)
+async def list_snapshots(session_id: str = Path(..., description="ID da sessão")) -> SnapshotListResponse:
+    """Lista os snapshots da sessão."""
+    if not await claude_handler.store.exists(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    summaries = await claude_handler.store.list_snapshots(session_id)
+    return SnapshotListResponse(
+        session_id=session_id,
+        snapshots=[snapshot_info(session_id, summary) for summary in summaries]
+    )
+
+@app.post(
+    "/api/session/{session_id}/snapshots/{snapshot_id}/restore",
+    tags=["Sessões"],
+    summary="Restaurar Snapshot",
+    description="""Volta a sessão à configuração e ao histórico do snapshot. O snapshot
+    continua disponível; o contexto do worker da sessão é descartado.
+    """,
+    responses={
+        404: {"description": "Sessão ou snapshot não encontrado"},
+        409: {"description": "Sessão com turno em andamento"}
+    },
+    response_model=StatusResponse
+)
+async def restore_snapshot(
+    session_id: str = Path(..., description="ID da sessão"),
+    snapshot_id: str = Path(..., description="ID do snapshot")
+) -> StatusResponse:
+    """Restaura um snapshot da sessão."""
+    if turns.active(session_id):
+        raise HTTPException(status_code=409, detail="Sessão com turno em andamento")
+    if not await claude_handler.restore_session(session_id, snapshot_id):
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return StatusResponse(status="restored", session_id=session_id)
+
+@app.delete(
+    "/api/session/{session_id}/snapshots/{snapshot_id}",
+    tags=["Sessões"],
+    summary="Remover Snapshot",
+    responses={404: {"description": "Sessão ou snapshot não encontrado"}},
+    response_model=StatusResponse
+)
+async def delete_snapshot(
+    session_id: str = Path(..., description="ID da sessão"),
+    snapshot_id: str = Path(..., description="ID do snapshot")
+) -> StatusResponse:
+    """Remove um snapshot da sessão."""
+    if not await claude_handler.store.delete_snapshot(session_id, snapshot_id):
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return StatusResponse(status="deleted", session_id=session_id)
+
 @app.get(
     "/api/session/{session_id}",
     tags=["Sessões"],
@@ -500,34 +1327,110 @@ async def get_session_info(session_id: str = Path(..., description="ID da sessã
 @app.get(
     "/api/sessions",
     tags=["Sessões"],
-    summary="Listar Todas as Sessões",
-    description="""Retorna lista de todas as sessões ativas com suas informações.
+    summary="Listar Sessões",
+    description="""Lista sessões em páginas, na ordem de criação.
+    
+    Sem nenhum parâmetro, responde no formato antigo: um array com todas as
+    sessões e seus blocos `config`, `history` e `compaction` (o mesmo item de
+    `GET /api/session/{id}`). Esse formato lê todas as sessões e está mantido
+    só para clientes existentes; passe ao menos `limit` para usar a paginação.
+    
+    Com parâmetros e sem `fields`, cada item traz só o resumo mantido no índice (datas, versão e
+    fingerprint da configuração), sem ler histórico. `fields=config,history,compaction`
+    acrescenta esses blocos. Use `next_cursor` como `cursor` para a próxima página.
     
-    Útil para monitoramento e gerenciamento de múltiplas conversas.
+    Com `since`, a resposta é o feed de alterações: sessões criadas, alteradas ou
+    removidas (`deleted: true`) depois da versão informada, em ordem de versão.
+    Guarde `version` e envie-a como `since` na próxima consulta; `reset: true`
+    indica que o feed não cobre mais essa versão e a listagem deve ser refeita.
     """,
-    response_description="Lista de sessões",
+    response_description="Página de sessões (ou array, sem parâmetros)",
     responses={
         200: {
-            "description": "Lista de sessões ativas",
+            "description": "Página de sessões; sem parâmetros, array de `SessionInfoResponse`",
             "content": {
                 "application/json": {
-                    "example": [
-                        {
-                            "session_id": "uuid1",
-                            "active": True,
-                            "config": {"system_prompt": "..."},
-                            "history": {"message_count": 5}
-                        }
-                    ]
+                    "example": {
+                        "sessions": [
+                            {
+                                "session_id": "uuid1",
+                                "active": False,
+                                "created_at": "2024-01-01T12:00:00",
+                                "updated_at": "2024-01-01T12:05:00",
+                                "version": 42,
+                                "fingerprint": "82c881c9af40...",
+                                "history": {"message_count": 5}
+                            }
+                        ],
+                        "next_cursor": "WzE3MDQxMTA0MDAuMCwgInV1aWQxIl0",
+                        "version": 57,
+                        "reset": False
+                    }
                 }
             }
+        },
+        400: {
+            "description": "Cursor ou campo inválido"
         }
-    }
+    },
+    response_model=SessionListResponse,
+    response_model_exclude_none=True
 )
-async def list_sessions() -> List[SessionInfoResponse]:
-    """Lista todas as sessões ativas."""
-    sessions = await claude_handler.get_all_sessions()
-    return [SessionInfoResponse(**session) for session in sessions]
+async def list_sessions(
+    request: Request,
+    cursor: Optional[str] = Query(None, description="`next_cursor` da página anterior"),
+    limit: int = Query(100, ge=1, le=1000, description="Itens por página"),
+    active: Optional[bool] = Query(None, description="Só sessões com (true) ou sem (false) turno em andamento"),
+    created_after: Optional[datetime] = Query(None, description="Só sessões criadas depois deste instante"),
+    fingerprint: Optional[str] = Query(None, description="Fingerprint da configuração"),
+    fields: str = Query("", description="Blocos extras: config, history, compaction"),
+    since: Optional[int] = Query(None, ge=0, description="Feed de alterações após esta versão")
+) -> SessionListResponse:
+    """Lista sessões paginadas, filtradas ou alteradas desde uma versão."""
+    if not request.query_params:
+        # Formato anterior à paginação: array completo, sem omitir campos nulos
+        sessions = await claude_handler.get_all_sessions()
+        return JSONResponse([SessionInfoResponse(**session).model_dump() for session in sessions])
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    if wanted - SESSION_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(sorted(wanted - SESSION_FIELDS))}")
+    store = claude_handler.store
+    running = set(turns.sessions())
+
+    if since is not None:
+        summaries, version, reset = await store.changes(since, limit)
+        next_cursor = None
+    else:
+        # Lida antes da página: alterações durante a listagem aparecem no feed
+        version, reset = await store.current_version(), False
+        after = decode_cursor(cursor) if cursor else None
+        created = created_after.timestamp() if created_after else None
+        if active:
+            # Poucas sessões em andamento: filtra direto sem percorrer o índice
+            summaries = sorted(
+                (
+                    summary for summary in await store.get_summaries(running)
+                    if (not fingerprint or summary["fingerprint"] == fingerprint)
+                    and (created is None or summary["created_at"] > created)
+                    and (after is None or (summary["created_at"], summary["session_id"]) > after)
+                ),
+                key=lambda summary: (summary["created_at"], summary["session_id"])
+            )[:limit]
+        else:
+            keep = (lambda session_id: session_id not in running) if active is False else None
+            summaries = await store.list_page(after, limit, created, fingerprint, keep)
+        last = summaries[-1] if len(summaries) == limit else None
+        next_cursor = encode_cursor((last["created_at"], last["session_id"])) if last else None
+
+    items = await claude_handler.describe_sessions(summaries, wanted)
+    for item in items:
+        item["active"] = item["session_id"] in running
+    return SessionListResponse(
+        sessions=[SessionSummary(**item) for item in items],
+        next_cursor=next_cursor,
+        version=version,
+        reset=reset
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,146 @@
+"""Remoção de sessões ociosas, expiradas ou excedentes."""
+
+import asyncio
+import inspect
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import REAPER_SWEEP, SESSIONS_EVICTED
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+EvictCallback = Callable[[str], Any]
+
+
+class SessionReaper:
+    """Varre o store periodicamente e remove sessões.
+
+    Motivos: `idle` (sem atividade há `idle_ttl` segundos), `lifetime` (criada
+    há mais de `max_lifetime`) e `lru` (acima de `max_sessions`, as menos
+    recentes saem primeiro). Sessões com turno em andamento nunca são
+    removidas: as desta réplica (`is_busy`) e, num store compartilhado, as
+    marcadas como ocupadas por outra réplica (`SessionStore.busy`). Limites
+    iguais a 0 ficam desativados.
+
+    Os callbacks de `on_evict` recebem o `session_id` e liberam o que estiver
+    associado à sessão (worker, buffers, vaga por IP).
+    """
+
+    def __init__(
+        self,
+        store: SessionStore,
+        idle_ttl: float = 1800.0,
+        max_lifetime: float = 3600.0,
+        max_sessions: int = 10000,
+        interval: float = 30.0,
+        is_busy: Optional[Callable[[str], bool]] = None,
+    ):
+        self.store = store
+        self.idle_ttl = idle_ttl
+        self.max_lifetime = max_lifetime
+        self.max_sessions = max_sessions
+        self.interval = interval
+        self.is_busy = is_busy or (lambda session_id: False)
+        self._callbacks: List[EvictCallback] = []
+        self._task: Optional[asyncio.Task] = None
+        self.sweeps = 0
+        self.evicted: Dict[str, int] = {}
+        self.last_sweep_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, store: SessionStore, is_busy: Optional[Callable[[str], bool]] = None) -> "SessionReaper":
+        """Cria o reaper a partir das variáveis de ambiente."""
+        return cls(
+            store,
+            idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "1800")),
+            max_lifetime=float(os.getenv("MAX_SESSION_TIME", "3600")),
+            max_sessions=int(os.getenv("MAX_SESSIONS", "10000")),
+            interval=float(os.getenv("SESSION_REAP_INTERVAL", "30")),
+            is_busy=is_busy,
+        )
+
+    def on_evict(self, callback: EvictCallback):
+        """Registra um callback (síncrono ou async) chamado a cada remoção."""
+        self._callbacks.append(callback)
+
+    async def evict(self, session_id: str, reason: str) -> bool:
+        """Remove a sessão do store e dispara os callbacks."""
+        deleted = await self.store.delete(session_id)
+        for callback in self._callbacks:
+            try:
+                result = callback(session_id)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Falha ao liberar recursos da sessão %s", session_id)
+        if deleted:
+            self.evicted[reason] = self.evicted.get(reason, 0) + 1
+            SESSIONS_EVICTED.inc(1, reason)
+        return deleted
+
+    async def reap(self) -> int:
+        """Uma varredura; retorna quantas sessões foram removidas."""
+        started = time.perf_counter()
+        now = time.time()
+        activity = await self.store.list_activity()
+
+        doomed = []
+        remaining = []
+        for session_id, created_at, updated_at in activity:
+            if self.is_busy(session_id):
+                continue
+            if self.max_lifetime and now - created_at > self.max_lifetime:
+                doomed.append((session_id, "lifetime"))
+            elif self.idle_ttl and now - updated_at > self.idle_ttl:
+                doomed.append((session_id, "idle"))
+            else:
+                remaining.append((updated_at, session_id))
+
+        excess = len(activity) - len(doomed) - self.max_sessions
+        if self.max_sessions and excess > 0:
+            remaining.sort()
+            doomed.extend((session_id, "lru") for _, session_id in remaining[:excess])
+
+        # Turnos em andamento em outras réplicas do mesmo store
+        remote = await self.store.busy(session_id for session_id, _ in doomed)
+        doomed = [(session_id, reason) for session_id, reason in doomed if session_id not in remote]
+
+        for session_id, reason in doomed:
+            await self.evict(session_id, reason)
+
+        self.sweeps += 1
+        self.last_sweep_seconds = time.perf_counter() - started
+        REAPER_SWEEP.observe(self.last_sweep_seconds)
+        return len(doomed)
+
+    def start(self):
+        """Inicia a varredura periódica."""
+        async def loop():
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.reap()
+                except Exception:
+                    logger.exception("Falha na varredura de sessões")
+
+        if self._task is None:
+            self._task = asyncio.create_task(loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sweeps": self.sweeps,
+            "evicted": dict(self.evicted),
+            "last_sweep_seconds": self.last_sweep_seconds,
+            "idle_ttl": self.idle_ttl,
+            "max_lifetime": self.max_lifetime,
+            "max_sessions": self.max_sessions,
+        }
@@ -0,0 +1,1103 @@
+"""Armazenamento de sessões: em memória ou Redis (várias réplicas da API)."""
+
+import json
+import os
+import socket
+import time
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, TYPE_CHECKING
+
+from config_profile import config_fingerprint
+
+if TYPE_CHECKING:
+    from claude_handler import SessionConfig
+
+try:
+    from orjson import loads
+except ImportError:  # pragma: no cover - dependência opcional
+    from json import loads
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    # json em vez de orjson: o buffer do orjson tem no mínimo ~1 KB por mensagem
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+
+# Identifica esta réplica nos metadados de afinidade
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Remoções lembradas pelo feed de alterações
+TOMBSTONES = 10000
+
+# Posição na listagem: (created_at, session_id)
+Cursor = Tuple[float, str]
+
+
+def _load_config(data: Dict[str, Any]) -> "SessionConfig":
+    from claude_handler import SessionConfig
+    return _intern(SessionConfig(**data))
+
+
+def _intern(config: "SessionConfig") -> "SessionConfig":
+    from claude_handler import intern_config
+    return intern_config(config)
+
+
+class SessionStore(ABC):
+    """Interface de armazenamento de configuração, histórico e uso por sessão.
+
+    `get_meta` devolve `created_at`, `updated_at`, `message_count`,
+    `total_tokens`, `total_cost`, `replica` (réplica que atendeu o último
+    turno e mantém o worker aquecido), `history_tokens` (estimativa somada do
+    campo `tokens` das mensagens) e os contadores de compactação
+    `compactions`, `compacted_messages` e `last_compacted_at`.
+
+    Toda escrita incrementa uma versão global e grava-a na sessão; a listagem
+    usa índices por `created_at` e por fingerprint da configuração mantidos na
+    escrita. Resumos (`list_page`, `get_summaries`, `changes`) trazem
+    `session_id`, `created_at`, `updated_at`, `version` e `fingerprint`.
+
+    Snapshots guardam configuração e histórico de uma sessão para `restore`;
+    pertencem à sessão e são removidos junto com ela. Resumos de snapshot
+    trazem `snapshot_id`, `created_at` e `message_count`.
+    """
+
+    @abstractmethod
+    async def create(self, session_id: str, config: "SessionConfig", created_at: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def exists(self, session_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def get_config(self, session_id: str) -> Optional["SessionConfig"]:
+        ...
+
+    @abstractmethod
+    async def set_config(self, session_id: str, config: "SessionConfig") -> bool:
+        ...
+
+    @abstractmethod
+    async def get_history(self, session_id: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def append_history(self, session_id: str, *messages: Dict[str, Any]) -> int:
+        ...
+
+    @abstractmethod
+    async def clear_history(self, session_id: str):
+        ...
+
+    @abstractmethod
+    async def compact_history(
+        self,
+        session_id: str,
+        snapshot: List[Dict[str, Any]],
+        replacement: List[Dict[str, Any]],
+    ) -> bool:
+        """Troca o prefixo `snapshot` do histórico por `replacement`.
+
+        Não faz nada (retorna False) se o início do histórico mudou desde a
+        leitura do snapshot.
+        """
+
+    @abstractmethod
+    async def fork(
+        self,
+        source_id: str,
+        target_id: str,
+        at: Optional[int] = None,
+        created_at: Optional[float] = None,
+    ) -> bool:
+        """Cria `target_id` com a configuração e as primeiras `at` mensagens de `source_id`.
+
+        Sem `at`, copia o histórico inteiro. Retorna False se a origem não
+        existe e levanta ValueError se `at` passa do tamanho do histórico.
+        """
+
+    @abstractmethod
+    async def snapshot(self, session_id: str, snapshot_id: str) -> Optional[Dict[str, Any]]:
+        """Guarda configuração e histórico atuais; resumo do snapshot ou None sem a sessão."""
+
+    @abstractmethod
+    async def list_snapshots(self, session_id: str) -> List[Dict[str, Any]]:
+        """Resumos dos snapshots da sessão, do mais antigo ao mais recente."""
+
+    @abstractmethod
+    async def restore(self, session_id: str, snapshot_id: str) -> bool:
+        """Volta a sessão à configuração e ao histórico do snapshot."""
+
+    @abstractmethod
+    async def delete_snapshot(self, session_id: str, snapshot_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def add_usage(self, session_id: str, tokens: int, cost: float):
+        ...
+
+    @abstractmethod
+    async def get_meta(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def claim(self, session_id: str, replica: str = REPLICA_ID):
+        ...
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def list_ids(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    async def count(self) -> int:
+        """Número de sessões, sem listar os ids."""
+
+    @abstractmethod
+    async def list_activity(self) -> List[Tuple[str, float, float]]:
+        """`(session_id, created_at, updated_at)` de todas as sessões."""
+
+    @abstractmethod
+    async def list_page(
+        self,
+        after: Optional[Cursor],
+        limit: int,
+        created_after: Optional[float] = None,
+        fingerprint: Optional[str] = None,
+        keep: Optional[Callable[[str], bool]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Até `limit` resumos em ordem de `(created_at, session_id)` após `after`."""
+
+    @abstractmethod
+    async def get_summaries(self, session_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        """Resumos das sessões existentes entre `session_ids`."""
+
+    @abstractmethod
+    async def current_version(self) -> int:
+        """Versão global da última escrita."""
+
+    @abstractmethod
+    async def changes(self, since: int, limit: int) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Sessões alteradas ou removidas após a versão `since`.
+
+        Retorna `(itens, versão, reset)`: itens em ordem de versão (removidas
+        vêm como `{"session_id", "version", "deleted": True}`), a versão a
+        passar na próxima chamada e `reset=True` quando `since` é anterior às
+        remoções ainda lembradas e o cliente precisa listar tudo de novo.
+        """
+
+    async def mark_busy(self, session_ids: Iterable[str], ttl: float):
+        """Marca as sessões como ocupadas (turno em andamento) por `ttl` segundos.
+
+        Só stores compartilhados entre réplicas guardam a marca; num store
+        local, o `TurnRegistry` do próprio processo já sabe quais estão ocupadas.
+        """
+
+    async def clear_busy(self, session_id: str):
+        """Remove a marca de sessão ocupada."""
+
+    async def busy(self, session_ids: Iterable[str]) -> Set[str]:
+        """Sessões com marca de ocupada ainda válida (de qualquer réplica)."""
+        return set()
+
+    async def close(self):
+        """Libera conexões."""
+
+
+def _remove_sorted(index: List[Cursor], entry: Cursor):
+    pos = bisect_left(index, entry)
+    if pos < len(index) and index[pos] == entry:
+        del index[pos]
+
+
+def _newer_than(versions: "OrderedDict[str, int]", since: int) -> List[Tuple[str, int]]:
+    """Itens com versão > `since`, percorrendo do fim (mais recentes)."""
+    newer = []
+    for session_id in reversed(versions):
+        version = versions[session_id]
+        if version <= since:
+            break
+        newer.append((session_id, version))
+    return newer
+
+
+class History:
+    """Histórico compacto: mensagens guardadas como JSON em bytes.
+
+    As mensagens recentes ficam uma por item; a cada `BLOCK` mensagens antigas
+    o bloco é comprimido com zlib. Nada é decodificado até `messages()`.
+
+    Copy-on-write: `fork` congela o conteúdo atual num segmento imutável
+    (`_base`) compartilhado pelo original e pela cópia, que passam a gravar
+    só as mensagens novas. Forks custam O(1) e dividem o prefixo em memória.
+    """
+
+    __slots__ = ("_base", "_base_count", "_base_tokens", "_blocks", "_tail", "_sums", "count", "tokens")
+
+    BLOCK = 16
+
+    def __init__(self):
+        # As primeiras `_base_count` mensagens vêm do segmento congelado `_base`
+        self._base: Optional["History"] = None
+        self._base_count = 0
+        self._base_tokens = 0
+        self._blocks: List[bytes] = []
+        self._tail: List[bytes] = []
+        # Tokens acumulados das mensagens próprias, para o total de um prefixo
+        self._sums = array("I")
+        self.count = 0
+        self.tokens = 0
+
+    def append(self, messages: Sequence[Dict[str, Any]]):
+        self._tail.extend(_encode(m) for m in messages)
+        for m in messages:
+            self.tokens += m.get("tokens", 0)
+            self._sums.append(self.tokens - self._base_tokens)
+        self.count += len(messages)
+        while len(self._tail) >= 2 * self.BLOCK:
+            self._blocks.append(zlib.compress(b"\n".join(self._tail[:self.BLOCK])))
+            del self._tail[:self.BLOCK]
+
+    def messages(self) -> List[Dict[str, Any]]:
+        return [loads(m) for m in self._encoded(self.count)]
+
+    def replace(self, messages: Sequence[Dict[str, Any]]):
+        self._base, self._base_count, self._base_tokens = None, 0, 0
+        self._blocks, self._tail, self._sums, self.count, self.tokens = [], [], array("I"), 0, 0
+        self.append(messages)
+
+    def fork(self, at: Optional[int] = None) -> "History":
+        """Cópia com as primeiras `at` mensagens (todas sem `at`), em O(1)."""
+        at = self.count if at is None else at
+        if not 0 <= at <= self.count:
+            raise ValueError(f"at deve estar entre 0 e {self.count}")
+        child = History()
+        if at == 0:
+            return child
+        base = self._seal()
+        # Sobe até o segmento que já contém o prefixo inteiro
+        while base._base is not None and at <= base._base_count:
+            base = base._base
+        child._base, child._base_count = base, at
+        child._base_tokens = child.tokens = base._prefix_tokens(at)
+        child.count = at
+        return child
+
+    def _seal(self) -> "History":
+        """Congela o conteúdo atual num segmento imutável e passa a gravar num novo."""
+        if not self._blocks and not self._tail and self._base is not None:
+            # Nada gravado desde o último fork: o segmento de baixo já serve
+            return self._base
+        node = History()
+        node._base, node._base_count, node._base_tokens = self._base, self._base_count, self._base_tokens
+        node._blocks, node._tail, node._sums = self._blocks, self._tail, self._sums
+        node.count, node.tokens = self.count, self.tokens
+        self._base, self._base_count, self._base_tokens = node, self.count, self.tokens
+        self._blocks, self._tail, self._sums = [], [], array("I")
+        return node
+
+    def _prefix_tokens(self, at: int) -> int:
+        node = self
+        while at <= node._base_count and node._base is not None:
+            node = node._base
+        own = at - node._base_count
+        return node._base_tokens + (node._sums[own - 1] if own > 0 else 0)
+
+    def _encoded(self, limit: int) -> List[bytes]:
+        """As primeiras `limit` mensagens codificadas, do segmento mais antigo ao atual."""
+        chain = []
+        node: Optional[History] = self
+        while node is not None:
+            chain.append((node, limit - node._base_count))
+            limit = node._base_count
+            node = node._base
+        encoded: List[bytes] = []
+        for node, own in reversed(chain):
+            for block in node._blocks:
+                if own <= 0:
+                    break
+                lines = zlib.decompress(block).split(b"\n")
+                encoded.extend(lines[:own])
+                own -= len(lines)
+            if own > 0:
+                encoded.extend(node._tail[:own])
+        return encoded
+
+
+class SessionSnapshot:
+    """Configuração e histórico congelados de uma sessão (o histórico é um fork)."""
+
+    __slots__ = ("config", "history", "created_at")
+
+    def __init__(self, config: "SessionConfig", history: History, created_at: float):
+        self.config = config
+        self.history = history
+        self.created_at = created_at
+
+    def summary(self, snapshot_id: str) -> Dict[str, Any]:
+        return {"snapshot_id": snapshot_id, "created_at": self.created_at, "message_count": self.history.count}
+
+
+class SessionRecord:
+    """Uma sessão em memória."""
+
+    __slots__ = (
+        "config", "fingerprint", "history", "created_at", "updated_at", "version", "total_tokens",
+        "total_cost", "replica", "compactions", "compacted_messages", "last_compacted_at", "snapshots",
+    )
+
+    def __init__(self, config: "SessionConfig", created_at: float, updated_at: float):
+        self.config = config
+        self.fingerprint = config_fingerprint(config)
+        self.version = 0
+        self.history = History()
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.total_tokens = 0
+        self.total_cost = 0.0
+        self.replica = REPLICA_ID
+        self.compactions = 0
+        self.compacted_messages = 0
+        self.last_compacted_at: Optional[float] = None
+        # Criado no primeiro snapshot: a maioria das sessões não tem nenhum
+        self.snapshots: Optional[Dict[str, SessionSnapshot]] = None
+
+
+class InMemorySessionStore(SessionStore):
+    """Sessões no dicionário do processo (uma única réplica)."""
+
+    def __init__(self):
+        self.sessions: Dict[str, SessionRecord] = {}
+        self.version = 0
+        # Índices ordenados por (created_at, session_id), geral e por fingerprint
+        self._order: List[Cursor] = []
+        self._by_fingerprint: Dict[str, List[Cursor]] = {}
+        # session_id -> versão da última alteração, em ordem de versão
+        self._changes: "OrderedDict[str, int]" = OrderedDict()
+        self._deleted: "OrderedDict[str, int]" = OrderedDict()
+        self._changes_floor = 0
+
+    def _touch(self, session_id: str, session: SessionRecord):
+        self.version += 1
+        session.version = self.version
+        self._changes[session_id] = self.version
+        self._changes.move_to_end(session_id)
+
+    def _index(self, session_id: str, session: SessionRecord):
+        self._index_entry(session_id, session.created_at, session.fingerprint)
+
+    def _unindex(self, session_id: str, session: SessionRecord):
+        self._unindex_entry(session_id, session.created_at, session.fingerprint)
+
+    def _index_entry(self, session_id: str, created_at: float, fingerprint: str):
+        entry = (created_at, session_id)
+        insort(self._order, entry)
+        insort(self._by_fingerprint.setdefault(fingerprint, []), entry)
+
+    def _unindex_entry(self, session_id: str, created_at: float, fingerprint: str):
+        entry = (created_at, session_id)
+        _remove_sorted(self._order, entry)
+        bucket = self._by_fingerprint.get(fingerprint)
+        if bucket is not None:
+            _remove_sorted(bucket, entry)
+            if not bucket:
+                del self._by_fingerprint[fingerprint]
+
+    def _tombstone(self, session_id: str):
+        """Registra a remoção no feed de alterações."""
+        self._changes.pop(session_id, None)
+        self.version += 1
+        self._deleted[session_id] = self.version
+        if len(self._deleted) > TOMBSTONES:
+            _, self._changes_floor = self._deleted.popitem(last=False)
+
+    def _summary(self, session_id: str, session: SessionRecord) -> Dict[str, Any]:
+        return {
+            "session_id": session_id,
+            "created_at": session.created_at,
+            "updated_at": session.updated_at,
+            "version": session.version,
+            "fingerprint": session.fingerprint,
+        }
+
+    def _summary_of(self, session_id: str) -> Optional[Dict[str, Any]]:
+        session = self.sessions.get(session_id)
+        return self._summary(session_id, session) if session is not None else None
+
+    async def create(self, session_id, config, created_at=None):
+        now = time.time()
+        old = self.sessions.get(session_id)
+        if old is not None:
+            self._unindex(session_id, old)
+        session = self.sessions[session_id] = SessionRecord(_intern(config), created_at or now, now)
+        self._deleted.pop(session_id, None)
+        self._index(session_id, session)
+        self._touch(session_id, session)
+
+    async def exists(self, session_id):
+        return session_id in self.sessions
+
+    async def get_config(self, session_id):
+        session = self.sessions.get(session_id)
+        return session.config if session else None
+
+    async def set_config(self, session_id, config):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return False
+        self._reconfigure(session_id, session, config)
+        session.updated_at = time.time()
+        self._touch(session_id, session)
+        return True
+
+    def _reconfigure(self, session_id: str, session: SessionRecord, config: "SessionConfig"):
+        fingerprint = config_fingerprint(config)
+        if fingerprint != session.fingerprint:
+            self._unindex(session_id, session)
+            session.fingerprint = fingerprint
+            self._index(session_id, session)
+        session.config = _intern(config)
+
+    async def get_history(self, session_id):
+        session = self.sessions.get(session_id)
+        return session.history.messages() if session else []
+
+    async def append_history(self, session_id, *messages):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return 0
+        session.history.append(messages)
+        session.updated_at = time.time()
+        self._touch(session_id, session)
+        return session.history.count
+
+    async def clear_history(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.history = History()
+            session.updated_at = time.time()
+            self._touch(session_id, session)
+
+    async def compact_history(self, session_id, snapshot, replacement):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return False
+        history = session.history.messages()
+        if history[:len(snapshot)] != snapshot:
+            return False
+        session.history.replace(replacement + history[len(snapshot):])
+        session.compactions += 1
+        session.compacted_messages += len(snapshot)
+        session.last_compacted_at = time.time()
+        self._touch(session_id, session)
+        return True
+
+    async def fork(self, source_id, target_id, at=None, created_at=None):
+        source = self.sessions.get(source_id)
+        if source is None:
+            return False
+        history = source.history.fork(at)
+        await self.create(target_id, source.config, created_at)
+        self.sessions[target_id].history = history
+        return True
+
+    async def snapshot(self, session_id, snapshot_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if session.snapshots is None:
+            session.snapshots = {}
+        snapshot = session.snapshots[snapshot_id] = SessionSnapshot(session.config, session.history.fork(), time.time())
+        return snapshot.summary(snapshot_id)
+
+    async def list_snapshots(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None or not session.snapshots:
+            return []
+        return [snapshot.summary(snapshot_id) for snapshot_id, snapshot in session.snapshots.items()]
+
+    async def restore(self, session_id, snapshot_id):
+        session = self.sessions.get(session_id)
+        snapshot = (session.snapshots or {}).get(snapshot_id) if session is not None else None
+        if snapshot is None:
+            return False
+        self._reconfigure(session_id, session, snapshot.config)
+        session.history = snapshot.history.fork()
+        session.updated_at = time.time()
+        self._touch(session_id, session)
+        return True
+
+    async def delete_snapshot(self, session_id, snapshot_id):
+        session = self.sessions.get(session_id)
+        if session is None or not session.snapshots:
+            return False
+        return session.snapshots.pop(snapshot_id, None) is not None
+
+    async def add_usage(self, session_id, tokens, cost):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.total_tokens += tokens
+            session.total_cost += cost
+            self._touch(session_id, session)
+
+    async def get_meta(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        return {
+            "created_at": session.created_at,
+            "updated_at": session.updated_at,
+            "message_count": session.history.count,
+            "total_tokens": session.total_tokens,
+            "total_cost": session.total_cost,
+            "replica": session.replica,
+            "history_tokens": session.history.tokens,
+            "compactions": session.compactions,
+            "compacted_messages": session.compacted_messages,
+            "last_compacted_at": session.last_compacted_at,
+        }
+
+    async def claim(self, session_id, replica=REPLICA_ID):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.replica = replica
+
+    async def delete(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._unindex(session_id, session)
+        self._tombstone(session_id)
+        return True
+
+    async def list_ids(self):
+        return list(self.sessions)
+
+    async def count(self):
+        return len(self.sessions)
+
+    async def list_activity(self):
+        return [
+            (session_id, session.created_at, session.updated_at)
+            for session_id, session in self.sessions.items()
+        ]
+
+    async def list_page(self, after, limit, created_after=None, fingerprint=None, keep=None):
+        index = self._order if fingerprint is None else self._by_fingerprint.get(fingerprint, [])
+        start = bisect_right(index, after) if after else 0
+        if created_after is not None:
+            start = max(start, bisect_right(index, (created_after, "\U0010ffff")))
+        page = []
+        for pos in range(start, len(index)):
+            session_id = index[pos][1]
+            if keep is not None and not keep(session_id):
+                continue
+            page.append(self._summary_of(session_id))
+            if len(page) >= limit:
+                break
+        return page
+
+    async def get_summaries(self, session_ids):
+        summaries = (self._summary_of(session_id) for session_id in session_ids)
+        return [summary for summary in summaries if summary is not None]
+
+    async def current_version(self):
+        return self.version
+
+    async def changes(self, since, limit):
+        changed = _newer_than(self._changes, since) + _newer_than(self._deleted, since)
+        changed.sort(key=lambda item: item[1])
+        truncated = len(changed) > limit
+        items = []
+        for session_id, version in changed[:limit]:
+            summary = self._summary_of(session_id)
+            if summary is None:
+                items.append({"session_id": session_id, "version": version, "deleted": True})
+            else:
+                items.append(summary)
+        version = items[-1]["version"] if truncated else self.version
+        # Versão maior que a atual: o feed recomeçou (processo reiniciado)
+        return items, version, since < self._changes_floor or since > self.version
+
+
+class RedisSessionStore(SessionStore):
+    """Sessões no Redis, compartilhadas entre réplicas.
+
+    Layout: hash `{prefix}{id}` com config/metadados/contadores, lista
+    `{prefix}{id}:history` com as mensagens em JSON e o conjunto `{prefix}ids`.
+    Snapshots: hash `{prefix}{id}:snapshots` (id -> resumo e config) e uma
+    lista `{prefix}{id}:snapshot:{snapshot_id}` por snapshot. Forks e
+    snapshots copiam as listas dentro do Redis (`COPY`), sem trazer o
+    histórico para o processo.
+    Índices: sorted sets `{prefix}by_created` e `{prefix}fp:{fingerprint}`
+    (score `created_at`), `{prefix}changes` e `{prefix}deleted` (score versão)
+    e o contador `{prefix}version`. Sessões com turno em andamento em alguma
+    réplica ficam em `{prefix}busy` (score = validade da marca).
+    """
+
+    def __init__(self, client, prefix: str = "claude:session:"):
+        self.redis = client
+        self.prefix = prefix
+        self.ids_key = f"{prefix}ids"
+        self.created_key = f"{prefix}by_created"
+        self.version_key = f"{prefix}version"
+        self.changes_key = f"{prefix}changes"
+        self.deleted_key = f"{prefix}deleted"
+        self.floor_key = f"{prefix}changes_floor"
+        self.busy_key = f"{prefix}busy"
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisSessionStore":
+        # Importado só aqui: o cliente do Redis pesa no início do processo
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:  # pragma: no cover - dependência opcional
+            raise RuntimeError("Pacote 'redis' não instalado (pip install redis)")
+        return cls(aioredis.from_url(url, decode_responses=True))
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    def _history_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}:history"
+
+    def _fingerprint_key(self, fingerprint: str) -> str:
+        return f"{self.prefix}fp:{fingerprint}"
+
+    def _snapshots_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}:snapshots"
+
+    def _snapshot_key(self, session_id: str, snapshot_id: str) -> str:
+        return f"{self.prefix}{session_id}:snapshot:{snapshot_id}"
+
+    async def _snapshot_keys(self, session_id: str) -> List[str]:
+        """Chaves dos snapshots da sessão, para removê-los junto com ela."""
+        ids = await self.redis.hkeys(self._snapshots_key(session_id))
+        return [self._snapshots_key(session_id)] + [self._snapshot_key(session_id, i) for i in ids]
+
+    async def _next_version(self) -> int:
+        return await self.redis.incr(self.version_key)
+
+    def _touch(self, pipe, session_id: str, version: int):
+        pipe.hset(self._key(session_id), "version", version)
+        # GT: uma escrita atrasada não volta a versão no feed
+        pipe.zadd(self.changes_key, {session_id: version}, gt=True)
+
+    async def _update(self, session_id: str, fill: Callable[[Any], None], *watch: str) -> Optional[List[Any]]:
+        """Executa as escritas de `fill` numa transação só se a sessão ainda existir.
+
+        Sem a verificação, uma escrita concorrente com `delete` recriaria um
+        hash parcial (sem `created_at`) fora dos índices. Retorna os
+        resultados da transação, ou None se a sessão não existe.
+        """
+        from redis.exceptions import WatchError
+
+        key = self._key(session_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key, *watch)
+                    if not await pipe.hexists(key, "created_at"):
+                        await pipe.reset()
+                        return None
+                    pipe.multi()
+                    fill(pipe)
+                    return await pipe.execute()
+                except WatchError:
+                    # Outra escrita na sessão entre o WATCH e o EXEC; tenta de novo
+                    continue
+
+    async def create(self, session_id, config, created_at=None):
+        now = time.time()
+        created_at = created_at or now
+        fingerprint = config_fingerprint(config)
+        old_fingerprint = await self.redis.hget(self._key(session_id), "fingerprint")
+        snapshot_keys = await self._snapshot_keys(session_id)
+        version = await self._next_version()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(session_id), self._history_key(session_id), *snapshot_keys)
+            if old_fingerprint:
+                pipe.zrem(self._fingerprint_key(old_fingerprint), session_id)
+            pipe.hset(self._key(session_id), mapping={
+                "config": json.dumps(asdict(config)),
+                "fingerprint": fingerprint,
+                "created_at": created_at,
+                "updated_at": now,
+                "total_tokens": 0,
+                "total_cost": 0.0,
+                "replica": REPLICA_ID,
+                "history_tokens": 0,
+                "compactions": 0,
+                "compacted_messages": 0,
+            })
+            pipe.sadd(self.ids_key, session_id)
+            pipe.zadd(self.created_key, {session_id: created_at})
+            pipe.zadd(self._fingerprint_key(fingerprint), {session_id: created_at})
+            pipe.zrem(self.deleted_key, session_id)
+            self._touch(pipe, session_id, version)
+            await pipe.execute()
+
+    async def exists(self, session_id):
+        return bool(await self.redis.exists(self._key(session_id)))
+
+    async def get_config(self, session_id):
+        raw = await self.redis.hget(self._key(session_id), "config")
+        return _load_config(json.loads(raw)) if raw else None
+
+    async def set_config(self, session_id, config):
+        created_at, old_fingerprint = await self.redis.hmget(self._key(session_id), "created_at", "fingerprint")
+        if created_at is None:
+            return False
+        fingerprint = config_fingerprint(config)
+        version = await self._next_version()
+
+        def fill(pipe):
+            pipe.hset(self._key(session_id), mapping={
+                "config": json.dumps(asdict(config)),
+                "fingerprint": fingerprint,
+                "updated_at": time.time(),
+            })
+            if fingerprint != old_fingerprint:
+                if old_fingerprint:
+                    pipe.zrem(self._fingerprint_key(old_fingerprint), session_id)
+                pipe.zadd(self._fingerprint_key(fingerprint), {session_id: float(created_at)})
+            self._touch(pipe, session_id, version)
+
+        return await self._update(session_id, fill) is not None
+
+    async def get_history(self, session_id):
+        return [json.loads(m) for m in await self.redis.lrange(self._history_key(session_id), 0, -1)]
+
+    async def append_history(self, session_id, *messages):
+        if not messages:
+            return await self.redis.llen(self._history_key(session_id))
+        version = await self._next_version()
+
+        def fill(pipe):
+            pipe.rpush(self._history_key(session_id), *(json.dumps(m) for m in messages))
+            pipe.hincrby(self._key(session_id), "history_tokens", sum(m.get("tokens", 0) for m in messages))
+            pipe.hset(self._key(session_id), "updated_at", time.time())
+            self._touch(pipe, session_id, version)
+
+        results = await self._update(session_id, fill)
+        return results[0] if results is not None else 0
+
+    async def clear_history(self, session_id):
+        version = await self._next_version()
+
+        def fill(pipe):
+            pipe.delete(self._history_key(session_id))
+            pipe.hset(self._key(session_id), mapping={"updated_at": time.time(), "history_tokens": 0})
+            self._touch(pipe, session_id, version)
+
+        await self._update(session_id, fill)
+
+    async def compact_history(self, session_id, snapshot, replacement):
+        from redis.exceptions import WatchError
+
+        history_key = self._history_key(session_id)
+        expected = [json.dumps(m) for m in snapshot]
+        delta = (
+            sum(m.get("tokens", 0) for m in replacement)
+            - sum(m.get("tokens", 0) for m in snapshot)
+        )
+        version = await self._next_version()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self._key(session_id), history_key)
+                if not await pipe.hexists(self._key(session_id), "created_at"):
+                    return False
+                current = await pipe.lrange(history_key, 0, len(expected) - 1)
+                if current != expected:
+                    return False
+                pipe.multi()
+                pipe.ltrim(history_key, len(expected), -1)
+                if replacement:
+                    pipe.lpush(history_key, *(json.dumps(m) for m in reversed(replacement)))
+                pipe.hincrby(self._key(session_id), "history_tokens", delta)
+                pipe.hincrby(self._key(session_id), "compactions", 1)
+                pipe.hincrby(self._key(session_id), "compacted_messages", len(snapshot))
+                pipe.hset(self._key(session_id), "last_compacted_at", time.time())
+                self._touch(pipe, session_id, version)
+                await pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    async def fork(self, source_id, target_id, at=None, created_at=None):
+        source_history = self._history_key(source_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hmget(self._key(source_id), "config", "history_tokens")
+            pipe.llen(source_history)
+            (raw, history_tokens), length = await pipe.execute()
+        if raw is None:
+            return False
+        at = length if at is None else at
+        if not 0 <= at <= length:
+            raise ValueError(f"at deve estar entre 0 e {length}")
+        # Só o sufixo descartado é lido, para descontar seus tokens
+        dropped = await self.redis.lrange(source_history, at, -1) if at < length else []
+        tokens = int(history_tokens or 0) - sum(json.loads(m).get("tokens", 0) for m in dropped)
+        await self.create(target_id, _load_config(json.loads(raw)), created_at)
+        if at:
+            def fill(pipe):
+                pipe.copy(source_history, self._history_key(target_id), replace=True)
+                pipe.ltrim(self._history_key(target_id), 0, at - 1)
+                pipe.hset(self._key(target_id), "history_tokens", tokens)
+
+            # O destino pode ter sido removido logo após a criação
+            await self._update(target_id, fill)
+        return True
+
+    async def snapshot(self, session_id, snapshot_id):
+        raw, history_tokens = await self.redis.hmget(self._key(session_id), "config", "history_tokens")
+        if raw is None:
+            return None
+        history_key = self._history_key(session_id)
+        count = await self.redis.llen(history_key)
+        summary = {"snapshot_id": snapshot_id, "created_at": time.time(), "message_count": count}
+
+        def fill(pipe):
+            pipe.copy(history_key, self._snapshot_key(session_id, snapshot_id), replace=True)
+            pipe.hset(self._snapshots_key(session_id), snapshot_id, json.dumps({
+                **summary, "config": json.loads(raw), "history_tokens": int(history_tokens or 0),
+            }))
+
+        # O histórico também é vigiado: message_count corresponde à cópia
+        if await self._update(session_id, fill, history_key) is None:
+            return None
+        return summary
+
+    async def list_snapshots(self, session_id):
+        stored = await self.redis.hvals(self._snapshots_key(session_id))
+        snapshots = sorted((json.loads(raw) for raw in stored), key=lambda s: s["created_at"])
+        return [
+            {"snapshot_id": s["snapshot_id"], "created_at": s["created_at"], "message_count": s["message_count"]}
+            for s in snapshots
+        ]
+
+    async def restore(self, session_id, snapshot_id):
+        raw = await self.redis.hget(self._snapshots_key(session_id), snapshot_id)
+        if raw is None:
+            return False
+        data = json.loads(raw)
+        if not await self.set_config(session_id, _load_config(data["config"])):
+            return False
+        history_key = self._history_key(session_id)
+        version = await self._next_version()
+
+        def fill(pipe):
+            pipe.delete(history_key)
+            pipe.copy(self._snapshot_key(session_id, snapshot_id), history_key)
+            pipe.hset(self._key(session_id), mapping={
+                "history_tokens": data["history_tokens"],
+                "updated_at": time.time(),
+            })
+            self._touch(pipe, session_id, version)
+
+        return await self._update(session_id, fill) is not None
+
+    async def delete_snapshot(self, session_id, snapshot_id):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._snapshots_key(session_id), snapshot_id)
+            pipe.delete(self._snapshot_key(session_id, snapshot_id))
+            removed, _ = await pipe.execute()
+        return bool(removed)
+
+    async def add_usage(self, session_id, tokens, cost):
+        version = await self._next_version()
+
+        def fill(pipe):
+            pipe.hincrby(self._key(session_id), "total_tokens", int(tokens))
+            pipe.hincrbyfloat(self._key(session_id), "total_cost", float(cost))
+            self._touch(pipe, session_id, version)
+
+        await self._update(session_id, fill)
+
+    async def get_meta(self, session_id):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key(session_id))
+            pipe.llen(self._history_key(session_id))
+            data, count = await pipe.execute()
+        if not data:
+            return None
+        return {
+            "created_at": float(data["created_at"]),
+            "updated_at": float(data["updated_at"]),
+            "message_count": count,
+            "total_tokens": int(data.get("total_tokens", 0)),
+            "total_cost": float(data.get("total_cost", 0.0)),
+            "replica": data.get("replica"),
+            "history_tokens": int(data.get("history_tokens", 0)),
+            "compactions": int(data.get("compactions", 0)),
+            "compacted_messages": int(data.get("compacted_messages", 0)),
+            "last_compacted_at": float(data["last_compacted_at"]) if data.get("last_compacted_at") else None,
+        }
+
+    async def claim(self, session_id, replica=REPLICA_ID):
+        await self._update(session_id, lambda pipe: pipe.hset(self._key(session_id), "replica", replica))
+
+    async def delete(self, session_id):
+        fingerprint = await self.redis.hget(self._key(session_id), "fingerprint")
+        snapshot_keys = await self._snapshot_keys(session_id)
+        version = await self._next_version()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(session_id), self._history_key(session_id), *snapshot_keys)
+            pipe.srem(self.ids_key, session_id)
+            pipe.zrem(self.created_key, session_id)
+            if fingerprint:
+                pipe.zrem(self._fingerprint_key(fingerprint), session_id)
+            pipe.zrem(self.changes_key, session_id)
+            pipe.zadd(self.deleted_key, {session_id: version})
+            pipe.zcard(self.deleted_key)
+            results = await pipe.execute()
+        deleted, tombstones = results[0], results[-1]
+        if tombstones > TOMBSTONES:
+            await self._prune_tombstones(tombstones - TOMBSTONES)
+        return bool(deleted)
+
+    async def _prune_tombstones(self, count: int):
+        oldest = await self.redis.zrange(self.deleted_key, 0, count - 1, withscores=True)
+        if not oldest:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.deleted_key, *(session_id for session_id, _ in oldest))
+            pipe.set(self.floor_key, int(oldest[-1][1]))
+            await pipe.execute()
+
+    async def list_ids(self):
+        return sorted(await self.redis.smembers(self.ids_key))
+
+    async def count(self):
+        return await self.redis.scard(self.ids_key)
+
+    async def list_activity(self):
+        ids = await self.list_ids()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id in ids:
+                pipe.hmget(self._key(session_id), "created_at", "updated_at")
+            rows = await pipe.execute()
+        return [
+            (session_id, float(created), float(updated))
+            for session_id, (created, updated) in zip(ids, rows)
+            if created is not None and updated is not None
+        ]
+
+    async def list_page(self, after, limit, created_after=None, fingerprint=None, keep=None):
+        key = self.created_key if fingerprint is None else self._fingerprint_key(fingerprint)
+        low = "-inf"
+        if after:
+            low = repr(after[0])
+        if created_after is not None and (not after or created_after >= after[0]):
+            low = f"({created_after!r}"
+        ids: List[str] = []
+        offset = 0
+        batch = max(limit, 100)
+        while len(ids) < limit:
+            rows = await self.redis.zrangebyscore(key, low, "+inf", start=offset, num=batch, withscores=True)
+            for session_id, score in rows:
+                # Empates em created_at seguem a ordem do session_id, como no Redis
+                if after and (score, session_id) <= after:
+                    continue
+                if keep is not None and not keep(session_id):
+                    continue
+                ids.append(session_id)
+                if len(ids) >= limit:
+                    break
+            if len(rows) < batch:
+                break
+            offset += batch
+        return await self.get_summaries(ids)
+
+    async def get_summaries(self, session_ids):
+        session_ids = list(session_ids)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id in session_ids:
+                pipe.hmget(self._key(session_id), "created_at", "updated_at", "version", "fingerprint")
+            rows = await pipe.execute()
+        return [
+            {
+                "session_id": session_id,
+                "created_at": float(created),
+                "updated_at": float(updated),
+                "version": int(version or 0),
+                "fingerprint": fingerprint,
+            }
+            for session_id, (created, updated, version, fingerprint) in zip(session_ids, rows)
+            if created is not None
+        ]
+
+    async def current_version(self):
+        return int(await self.redis.get(self.version_key) or 0)
+
+    async def changes(self, since, limit):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrangebyscore(self.changes_key, f"({since}", "+inf", start=0, num=limit + 1, withscores=True)
+            pipe.zrangebyscore(self.deleted_key, f"({since}", "+inf", start=0, num=limit + 1, withscores=True)
+            pipe.get(self.version_key)
+            pipe.get(self.floor_key)
+            live, dead, current, floor = await pipe.execute()
+        changed = sorted(
+            [(session_id, int(v), False) for session_id, v in live]
+            + [(session_id, int(v), True) for session_id, v in dead],
+            key=lambda item: item[1],
+        )
+        truncated = len(changed) > limit
+        changed = changed[:limit]
+        summaries = {
+            summary["session_id"]: summary
+            for summary in await self.get_summaries(sid for sid, _, deleted in changed if not deleted)
+        }
+        items = []
+        for session_id, version, deleted in changed:
+            if deleted or session_id not in summaries:
+                items.append({"session_id": session_id, "version": version, "deleted": True})
+            else:
+                items.append(summaries[session_id])
+        version = changed[-1][1] if truncated else int(current or 0)
+        return items, version, since < int(floor or 0)
+
+    async def mark_busy(self, session_ids, ttl):
+        expires = time.time() + ttl
+        mapping = {session_id: expires for session_id in session_ids}
+        if mapping:
+            await self.redis.zadd(self.busy_key, mapping)
+
+    async def clear_busy(self, session_id):
+        await self.redis.zrem(self.busy_key, session_id)
+
+    async def busy(self, session_ids):
+        session_ids = list(session_ids)
+        if not session_ids:
+            return set()
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            # Marcas vencidas são de réplicas que caíram no meio do turno
+            pipe.zremrangebyscore(self.busy_key, "-inf", now)
+            pipe.zmscore(self.busy_key, session_ids)
+            _, scores = await pipe.execute()
+        return {session_id for session_id, score in zip(session_ids, scores) if score is not None}
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def store_from_env() -> SessionStore:
+    """Redis quando `REDIS_URL` está definido; caso contrário, memória local
+    (com log em disco se `HISTORY_LOG_DIR` estiver definido)."""
+    url = os.getenv("REDIS_URL")
+    if url:
+        return RedisSessionStore.from_url(url)
+    directory = os.getenv("HISTORY_LOG_DIR")
+    if directory:
+        from history_log import HistoryLog, PersistentSessionStore
+        return PersistentSessionStore(HistoryLog.from_env(directory))
+    return InMemorySessionStore()
@@ -0,0 +1,78 @@
+"""Codificação de eventos Server-Sent Events para o caminho de streaming."""
+
+import json
+from typing import Any, Dict, Mapping, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Serializa para JSON compacto em bytes (orjson quando disponível)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+Event = Union[Mapping[str, Any], BaseModel]
+
+
+class SSEEncoder:
+    """Codifica eventos de um stream em frames SSE com `id:` e `event:`.
+
+    Cada evento é serializado uma única vez. O `session_id` é pré-codificado e
+    anexado ao JSON sem reserializar o evento, e os cabeçalhos `event:` são
+    mantidos em cache por tipo.
+    """
+
+    def __init__(self, session_id: str, start_id: int = 0):
+        self.session_id = session_id
+        self.last_id = start_id
+        # ',"session_id":"..."}' pronto para fechar o objeto JSON
+        self._sid_suffix = b',"session_id":' + dumps(session_id) + b"}"
+        self._event_lines: Dict[str, bytes] = {}
+
+    def encode(self, event: Event, numbered: bool = True) -> bytes:
+        """Codifica um evento estruturado como frame SSE.
+
+        Frames não numerados (sem `id:`) não avançam a sequência e não são
+        considerados em reconexões.
+        """
+        if isinstance(event, BaseModel):
+            event = event.model_dump(exclude_none=True)
+        if numbered:
+            self.last_id += 1
+        event_id = self.last_id if numbered else None
+        return self.frame(event_id, event.get("type", "message"), self.payload(event))
+
+    def payload(self, event: Mapping[str, Any]) -> bytes:
+        """JSON do evento com `session_id`."""
+        if "session_id" in event or not event:
+            return dumps(event)
+        return dumps(event)[:-1] + self._sid_suffix
+
+    def frame(self, event_id: Optional[int], event_type: str, payload: bytes) -> bytes:
+        """Monta o frame a partir de um payload já serializado."""
+        event_line = self._event_lines.get(event_type)
+        if event_line is None:
+            event_line = self._event_lines[event_type] = f"\nevent: {event_type}\ndata: ".encode()
+        if event_id is None:
+            return b"%b%b\n\n" % (event_line[1:], payload)
+        return b"id: %d%b%b\n\n" % (event_id, event_line, payload)
+
+
+def parse_frame(frame: bytes) -> Tuple[Optional[int], bytes]:
+    """`(id, payload JSON)` de um frame gerado por `SSEEncoder.frame`.
+
+    Usado por transportes que reaproveitam os frames do buffer de replay sem
+    reserializar o evento (o JSON nunca contém quebras de linha literais).
+    """
+    start = frame.index(b"data: ") + 6
+    payload = frame[start:frame.index(b"\n", start)]
+    if frame.startswith(b"id: "):
+        return int(frame[4:frame.index(b"\n")]), payload
+    return None, payload
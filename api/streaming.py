@@ -0,0 +1,84 @@
+"""Estágios intermediários entre o handler e a resposta SSE."""
+
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+# Eventos de texto que podem ser agrupados; os demais forçam flush imediato
+COALESCIBLE = "assistant_text"
+
+DEFAULT_WINDOW_MS = int(os.getenv("STREAM_COALESCE_MS", "25"))
+DEFAULT_MAX_BYTES = int(os.getenv("STREAM_COALESCE_BYTES", "2048"))
+
+
+async def coalesce(
+    events: AsyncIterator[Dict[str, Any]],
+    window_ms: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Agrupa `assistant_text` consecutivos em janelas de tempo e tamanho.
+
+    O primeiro texto abre a janela; o grupo é emitido quando a janela expira,
+    quando atinge `max_bytes` ou quando chega qualquer outro tipo de evento
+    (ferramentas, resultado, erro), que é repassado sem atraso.
+    `window_ms=0` desativa o agrupamento.
+    """
+    window = (DEFAULT_WINDOW_MS if window_ms is None else window_ms) / 1000
+    limit = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+
+    if window <= 0:
+        async for event in events:
+            yield event
+        return
+
+    iterator = events.__aiter__()
+    parts: List[str] = []
+    size = 0
+    deadline = 0.0
+    pending: Optional[asyncio.Future] = None
+
+    def flush() -> Dict[str, Any]:
+        nonlocal parts, size
+        event = {"type": COALESCIBLE, "content": "".join(parts)}
+        parts, size = [], 0
+        return event
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - time.monotonic()) if parts else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Janela expirou com o próximo evento ainda pendente
+                yield flush()
+                continue
+
+            future, pending = pending, None
+            try:
+                event = future.result()
+            except StopAsyncIteration:
+                break
+
+            # Só agrupa textos simples (type + content), sem campos extras
+            if event.get("type") == COALESCIBLE and len(event) == 2:
+                if not parts:
+                    deadline = time.monotonic() + window
+                content = event.get("content") or ""
+                parts.append(content)
+                # Limite em bytes UTF-8, como o frame que vai para o cliente
+                size += len(content.encode())
+                if size >= limit:
+                    yield flush()
+                continue
+
+            if parts:
+                yield flush()
+            yield event
+
+        if parts:
+            yield flush()
+    finally:
+        if pending is not None:
+            pending.cancel()
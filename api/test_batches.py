@@ -0,0 +1,102 @@
+"""`BatchRunner` sobre o caminho simulado do handler (sem CLI)."""
+
+import asyncio
+import json
+
+import pytest
+
+from batches import BatchRunner
+from budgets import BudgetLedger, BudgetLimit
+from claude_handler import ClaudeHandler, SessionConfig
+from scheduler import QueueFullError, TurnScheduler
+from session_store import InMemorySessionStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setenv("CLAUDE_CLI", "/nonexistent")
+    handler = ClaudeHandler(store=InMemorySessionStore())
+    assert handler.pool is None
+    return handler
+
+
+async def test_prompt_past_soft_budget_is_truncated(handler):
+    budgets = BudgetLedger({"ip": BudgetLimit(tokens=100)}, soft_ratio=0.8)
+    budgets.bind("anterior", "10.0.0.1", None)
+    budgets.record("anterior", 95, 0.0)
+    runner = BatchRunner(handler, TurnScheduler(), budgets=budgets)
+
+    job = runner.submit(["oi"], SessionConfig(), client_ip="10.0.0.1")
+    await job.task
+
+    [result] = job.results
+    assert result["status"] == "error"
+    assert result["error"] == "Orçamento de tokens atingido; resposta truncada"
+    # Só o texto até o teto de 5 tokens
+    assert result["content"] == "Esta é uma resposta "
+    assert budgets.truncated == 1
+
+
+def answer(prompt):
+    return f"Esta é uma resposta simulada para: {prompt} "
+
+
+async def test_ndjson_results_in_completion_order_tagged_by_index(handler):
+    runner = BatchRunner(handler, TurnScheduler())
+    # O prompt mais longo gera mais palavras e termina por último
+    prompts = ["um dois três quatro", "oi"]
+    job = runner.submit(prompts, SessionConfig(), parallelism=2)
+
+    body = b"".join([BatchRunner.encode(result) async for result in job.follow()])
+    lines = [json.loads(line) for line in body.decode().splitlines()]
+    assert [line["index"] for line in lines] == [1, 0]
+    for line in lines:
+        assert line["status"] == "completed"
+        assert line["content"] == answer(prompts[line["index"]])
+    assert job.status == "completed"
+
+
+async def test_cancel_keeps_partial_results(handler):
+    runner = BatchRunner(handler, TurnScheduler(), parallelism=1)
+    job = runner.submit(["a", "b", "c"], SessionConfig())
+    async for result in job.follow():
+        break
+    # No meio do segundo prompt
+    await asyncio.sleep(0.12)
+    assert await runner.cancel(job.id) is job
+
+    assert job.status == "cancelled"
+    results = {result["index"]: result for result in job.results}
+    assert result["index"] == 0
+    assert (results[0]["status"], results[0]["content"]) == ("completed", answer("a"))
+    assert results[1]["status"] == "cancelled"
+    assert results[1]["content"] and answer("b").startswith(results[1]["content"])
+    assert results[2] == {"index": 2, "status": "cancelled", "content": ""}
+
+
+class FullOnce(TurnScheduler):
+    """Recusa as primeiras `rejections` entradas como uma fila cheia."""
+
+    def __init__(self, rejections):
+        super().__init__()
+        self.rejections = rejections
+
+    def submit(self, session_id, client_ip=None):
+        if self.rejections:
+            self.rejections -= 1
+            raise QueueFullError("Fila cheia", retry_after=0)
+        return super().submit(session_id, client_ip)
+
+
+async def test_prompt_waits_and_retries_when_queue_is_full(handler):
+    scheduler = FullOnce(rejections=3)
+    runner = BatchRunner(handler, scheduler)
+    job = runner.submit(["oi"], SessionConfig())
+    await job.task
+
+    [result] = job.results
+    assert result["status"] == "completed"
+    assert result["content"] == answer("oi")
+    assert scheduler.rejections == 0
@@ -0,0 +1,20 @@
+"""Tipo dos blobs registrado na escrita."""
+
+import pytest
+
+from blob_store import BlobStore
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_media_type_is_recorded_not_sniffed(tmp_path):
+    blobs = BlobStore(str(tmp_path), threshold=10)
+    text = await blobs.externalize({"type": "tool_result", "content": "[1, 2, 3] parece JSON mas é texto"})
+    listed = await blobs.externalize({"type": "tool_result", "content": [{"type": "text", "text": "x" * 20}]})
+
+    assert text["blob"]["media_type"] == "text/plain; charset=utf-8"
+    assert listed["blob"]["media_type"] == "application/json"
+    for event in (text, listed):
+        path = blobs.path(event["blob"]["id"])
+        assert blobs.media_type(path) == event["blob"]["media_type"]
+    assert blobs.path("cd" * 32) is None
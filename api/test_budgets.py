@@ -0,0 +1,92 @@
+"""Janelas deslizantes e admissão do `BudgetLedger`."""
+
+from types import SimpleNamespace
+
+import pytest
+
+import budgets
+from budgets import BudgetExceededError, BudgetLedger, BudgetLimit, UsageWindow
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Relógio manual do módulo: `clock.now` em segundos."""
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(budgets, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_window_expires_buckets_and_wraps():
+    # 6 baldes de 10s: janela de 60s
+    window = UsageWindow(10.0, 6)
+    window.add(0.0, 10, 0.1)
+    window.add(15.0, 20, 0.2)
+    window.add(25.0, 5, 0.05)
+    assert window.totals(59.9) == (35, pytest.approx(0.35))
+    # Cada balde sai quando o atual passa de índice + 5
+    assert window.totals(60.0) == (25, pytest.approx(0.25))
+    assert window.totals(70.0) == (5, pytest.approx(0.05))
+    assert window.totals(80.0) == (0, pytest.approx(0.0))
+
+    # O anel reaproveita o balde 0 na volta seguinte sem somar o antigo
+    window.add(60.0, 2, 0.0)
+    window.add(95.0, 3, 0.0)
+    assert window.totals(100.0) == (5, pytest.approx(0.0))
+    # Salto de várias voltas zera tudo de uma vez
+    window.add(1000.0, 7, 0.0)
+    assert window.totals(1000.0) == (7, pytest.approx(0.0))
+
+
+def test_window_retry_after_waits_for_enough_buckets():
+    window = UsageWindow(10.0, 6)
+    window.add(0.0, 50, 0.0)
+    window.add(15.0, 50, 0.0)
+    # Basta o balde 0 sair (em t=60) para ficar abaixo de 100
+    assert window.retry_after(20.0, 100, 0.0) == 40.0
+    # Abaixo de 30 só quando os dois saírem (t=70)
+    assert window.retry_after(20.0, 30, 0.0) == 50.0
+
+
+def test_hard_limit_rejects_with_retry_after(clock):
+    ledger = BudgetLedger({"session": BudgetLimit(tokens=100)}, window=60.0, buckets=6)
+    assert ledger.admit("s") is None
+    ledger.record("s", 60, 0.0)
+    clock.now = 15.0
+    ledger.record("s", 40, 0.0)
+
+    clock.now = 20.0
+    with pytest.raises(BudgetExceededError) as error:
+        ledger.admit("s")
+    assert error.value.scope == "session"
+    assert error.value.retry_after == 40
+    assert ledger.rejected == 1
+
+    # Os 60 tokens de t=0 saíram da janela: 40 está abaixo do flexível (80)
+    clock.now = 60.0
+    assert ledger.admit("s") is None
+
+
+def test_soft_limit_caps_tokens_to_the_hard_limit(clock):
+    ledger = BudgetLedger(
+        {"session": BudgetLimit(tokens=100), "ip": BudgetLimit(tokens=1000)},
+        soft_ratio=0.8,
+    )
+    ledger.admit("s", "10.0.0.1")
+    ledger.record("s", 79, 0.0)
+    assert ledger.admit("s", "10.0.0.1") is None
+    ledger.record("s", 6, 0.0)
+    assert ledger.admit("s", "10.0.0.1") == 15
+    ledger.truncate("s")
+    assert ledger.truncated == 1
+
+
+def test_soft_cost_limit_converts_remaining_cost_to_tokens(clock):
+    ledger = BudgetLedger({"key": BudgetLimit(tokens=2000, cost=1.0)}, soft_ratio=0.8)
+    ledger.admit("s", None, "chave")
+    # 1000 tokens por $0.90: o $0.10 restante compra 111 tokens
+    ledger.record("s", 1000, 0.9)
+    assert ledger.admit("s", None, "chave") == 111
+
+    # O menor dos tetos vence: por tokens restam 50
+    ledger.record("s", 950, 0.0)
+    assert ledger.admit("s", None, "chave") == 50
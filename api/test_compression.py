@@ -0,0 +1,87 @@
+"""Compressão dos streams SSE: sync-flush por frame e negociação."""
+
+import zlib
+
+import pytest
+
+import compression
+from compression import COMPRESSORS, DEFAULT_LEVELS, GzipCompressor, SSECompression
+
+pytestmark = pytest.mark.anyio
+
+FRAMES = [
+    f'id: {i}\ndata: {{"type":"assistant_text","content":"parte {i}","session_id":"s"}}\n\n'.encode()
+    for i in range(1, 6)
+]
+
+
+def decompressor(encoding):
+    """Função que descomprime um pedaço do stream e devolve o que já saiu."""
+    if encoding == "gzip":
+        return zlib.decompressobj(31).decompress
+    if encoding == "br":
+        return compression.brotli.Decompressor().process
+    return compression.zstandard.ZstdDecompressor().decompressobj().decompress
+
+
+@pytest.fixture(params=["gzip", "br", "zstd"])
+def encoding(request):
+    if request.param not in COMPRESSORS:
+        pytest.skip(f"{request.param} não instalado")
+    return request.param
+
+
+def test_each_frame_decodes_as_soon_as_it_is_compressed(encoding):
+    compressor = COMPRESSORS[encoding](DEFAULT_LEVELS[encoding])
+    decompress = decompressor(encoding)
+    sizes = []
+    for frame in FRAMES:
+        chunk = compressor.compress(frame)
+        assert decompress(chunk) == frame
+        sizes.append(len(chunk))
+    assert decompress(compressor.finish()) == b""
+    # O contexto compartilhado encolhe os frames seguintes
+    assert max(sizes[1:]) < sizes[0]
+
+
+async def test_wrap_round_trip(encoding):
+    async def frames():
+        for frame in FRAMES:
+            yield frame
+
+    chunks = [chunk async for chunk in SSECompression([encoding]).wrap(frames(), encoding)]
+    decompress = decompressor(encoding)
+    assert b"".join(decompress(chunk) for chunk in chunks) == b"".join(FRAMES)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("gzip;q=0, *", None),
+    ("deflate, *;q=0.5", "gzip"),
+    ("identity", None),
+    (None, None),
+])
+def test_negotiate_honours_q_zero_and_wildcard(header, expected):
+    assert SSECompression(["gzip"], cpu_budget=0).negotiate(header) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, br", "br"),
+    ("gzip, br;q=0.5", "gzip"),
+    ("br;q=0, *", "gzip"),
+    ("*;q=0.1, gzip;q=0", "br"),
+])
+def test_negotiate_prefers_highest_q_then_server_order(monkeypatch, header, expected):
+    # Só a negociação importa aqui; qualquer compressor serve de "br"
+    monkeypatch.setitem(COMPRESSORS, "br", GzipCompressor)
+    assert SSECompression(["br", "gzip"], cpu_budget=0).negotiate(header) == expected
+
+
+def test_negotiate_skips_compression_over_cpu_budget():
+    sse = SSECompression(["gzip"], cpu_budget=0.1, window=10.0)
+    sse._charge(5.0, "gzip", 100, 10)
+    assert sse.negotiate("gzip") is None
+    assert sse.skipped == 1
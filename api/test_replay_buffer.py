@@ -0,0 +1,130 @@
+"""Contabilidade do `ReplayBuffer` e retomada com `Last-Event-ID`."""
+
+import asyncio
+import json
+
+import pytest
+
+from replay_buffer import ReplayBuffer
+
+pytestmark = pytest.mark.anyio
+
+
+def frame(event_id):
+    # IDs com dois dígitos: todos os frames têm o mesmo tamanho
+    return b"id: %02d\nevent: x\ndata: {}\n\n" % event_id
+
+
+async def test_discard_during_turn_releases_bytes():
+    replays = ReplayBuffer(max_turn_bytes=1000, max_total_bytes=10000)
+    turn = replays.start_turn("a")
+    for event_id in range(1, 4):
+        turn.publish(event_id, frame(event_id))
+    replays.discard("a")
+    # O produtor continua publicando depois da remoção da sessão
+    for event_id in range(4, 10):
+        turn.publish(event_id, frame(event_id))
+    turn.finish()
+    assert replays.total_bytes == 0
+    assert replays.get("a") is None
+    assert replays.start_turn("a").first_id == 0
+
+
+async def test_replaced_turn_is_not_counted():
+    replays = ReplayBuffer(max_turn_bytes=1000, max_total_bytes=10000)
+    old = replays.start_turn("a")
+    old.publish(1, frame(1))
+    new = replays.start_turn("a")
+    old.publish(2, frame(2))
+    new.publish(3, frame(3))
+    assert replays.total_bytes == len(frame(3))
+
+
+async def test_resume_after_evicted_frames_sends_reset():
+    size = len(frame(1))
+    replays = ReplayBuffer(max_turn_bytes=size * 5, max_total_bytes=size * 100)
+    turn = replays.start_turn("a")
+    for event_id in range(1, 11):
+        turn.publish(event_id, frame(event_id))
+    turn.finish()
+    assert turn.frames[0][0] == 6
+
+    frames = [f async for f in turn.subscribe(2)]
+    assert frames[0].startswith(b"event: reset\n")
+    assert b'"missed":3' in frames[0]
+    assert frames[1:] == [frame(event_id) for event_id in range(6, 11)]
+
+    frames = [f async for f in turn.subscribe(5)]
+    assert frames == [frame(event_id) for event_id in range(6, 11)]
+
+
+def tool_frame(event_id):
+    # Não mesclável pelo coalesce
+    return b'id: %03d\nevent: tool_use\ndata: {"type":"tool_use","name":"x"}\n\n' % event_id
+
+
+async def test_slow_coalesce_reader_past_turn_cap_gets_reset():
+    replays = ReplayBuffer(max_turn_bytes=2000, max_total_bytes=100000, policy="coalesce", high_water=500)
+    turn = replays.start_turn("a")
+    received = []
+    ids = []
+
+    async def read():
+        async for frame in turn.subscribe():
+            received.append(frame)
+            if frame.startswith(b"id: "):
+                ids.append(int(frame[4:7]))
+            # Leitor lento: o produtor publica vários frames a cada envio
+            await asyncio.sleep(0)
+
+    reader = asyncio.create_task(read())
+    await asyncio.sleep(0)
+    for event_id in range(1, 201):
+        turn.publish(event_id, tool_frame(event_id))
+        if event_id % 20 == 0:
+            await asyncio.sleep(0)
+    turn.finish()
+    await reader
+
+    resets = [frame for frame in received if frame.startswith(b"event: reset\n")]
+    assert resets
+    missed = sum(json.loads(frame.split(b"data: ", 1)[1])["missed"] for frame in resets)
+    # Cada frame ou chegou ou foi contado num reset, sem saltos silenciosos
+    assert len(ids) + missed == 200
+    assert ids == sorted(ids) and ids[-1] == 200
+
+
+async def test_global_pressure_keeps_frames_pause_readers_have_not_received():
+    size = len(frame(1))
+    replays = ReplayBuffer(max_turn_bytes=size * 100, max_total_bytes=size * 10, policy="pause")
+    a = replays.start_turn("a")
+    for event_id in range(1, 5):
+        a.publish(event_id, frame(event_id))
+    reader = a.subscribe(0)
+    assert await reader.__anext__() == frame(1)
+
+    b = replays.start_turn("b")
+    for event_id in range(1, 5):
+        b.publish(event_id, frame(event_id))
+    b.finish()
+    c = replays.start_turn("c")
+    for event_id in range(1, 4):
+        c.publish(event_id, frame(event_id))
+    # Saem o turno finalizado e os frames sem assinante, não os pendentes de `a`
+    assert [f[0] for f in a.frames] == [1, 2, 3, 4]
+    assert len(b.frames) == 3
+    assert replays.total_bytes == size * 10
+
+    # Sem outra opção, descarta pendentes e o assinante é avisado
+    for event_id in range(5, 15):
+        a.publish(event_id, frame(event_id))
+    assert not b.frames and len(c.frames) == 1
+    assert replays.total_bytes <= size * 10
+    a.finish()
+    rest = [f async for f in reader]
+    # 2..4 já estavam na leitura em andamento; depois o aviso e o que restou
+    oldest = a.frames[0][0]
+    assert rest[:3] == [frame(2), frame(3), frame(4)]
+    assert rest[3].startswith(b"event: reset\n")
+    assert b'"missed":%d' % (oldest - 5) in rest[3]
+    assert rest[4:] == [frame(event_id) for event_id in range(oldest, 15)]
@@ -0,0 +1,81 @@
+"""Motivos e ordem de remoção do `SessionReaper` sobre o store em memória."""
+
+import time
+
+import pytest
+
+from claude_handler import SessionConfig
+from session_reaper import SessionReaper
+from session_store import InMemorySessionStore
+
+pytestmark = pytest.mark.anyio
+
+CONFIG = SessionConfig()
+
+
+@pytest.fixture
+async def store():
+    store = InMemorySessionStore()
+    yield store
+    await store.close()
+
+
+async def add(store, session_id, age=0.0, idle=0.0):
+    """Sessão criada há `age` segundos e sem atividade há `idle`."""
+    now = time.time()
+    await store.create(session_id, CONFIG, created_at=now - age)
+    store.sessions[session_id].updated_at = now - idle
+
+
+async def test_idle_and_lifetime(store):
+    await add(store, "nova")
+    await add(store, "ociosa", age=100, idle=100)
+    await add(store, "antiga", age=500, idle=10)
+    # Expirada e ociosa ao mesmo tempo conta como lifetime
+    await add(store, "ambas", age=500, idle=500)
+    evicted = []
+    reaper = SessionReaper(store, idle_ttl=60, max_lifetime=300, max_sessions=0)
+    reaper.on_evict(evicted.append)
+
+    assert await reaper.reap() == 3
+    assert sorted(evicted) == ["ambas", "antiga", "ociosa"]
+    assert await store.list_ids() == ["nova"]
+    assert reaper.evicted == {"idle": 1, "lifetime": 2}
+
+
+async def test_lru_removes_least_recent_beyond_max_sessions(store):
+    for i, idle in enumerate([30, 10, 50, 20, 40]):
+        await add(store, f"s{i}", idle=idle)
+    evicted = []
+    reaper = SessionReaper(store, idle_ttl=0, max_lifetime=0, max_sessions=3)
+    reaper.on_evict(evicted.append)
+
+    assert await reaper.reap() == 2
+    # As menos recentes primeiro: s2 (50s) e s4 (40s)
+    assert evicted == ["s2", "s4"]
+    assert sorted(await store.list_ids()) == ["s0", "s1", "s3"]
+    assert reaper.evicted == {"lru": 2}
+
+
+async def test_lru_counts_sessions_already_removed_for_other_reasons(store):
+    await add(store, "ociosa", idle=100)
+    for i in range(3):
+        await add(store, f"s{i}", idle=i)
+    reaper = SessionReaper(store, idle_ttl=60, max_lifetime=0, max_sessions=3)
+
+    assert await reaper.reap() == 1
+    assert reaper.evicted == {"idle": 1}
+
+
+async def test_busy_sessions_are_never_removed(store):
+    await add(store, "ocupada", age=500, idle=500)
+    await add(store, "livre", age=500, idle=500)
+    for i in range(3):
+        await add(store, f"lru{i}", idle=10 + i)
+    busy = {"ocupada", "lru2"}
+    reaper = SessionReaper(store, idle_ttl=60, max_lifetime=300, max_sessions=3, is_busy=busy.__contains__)
+
+    await reaper.reap()
+    # As ocupadas contam no total; lru2 é a menos recente, mas sai a seguinte
+    assert sorted(await store.list_ids()) == ["lru0", "lru2", "ocupada"]
+    assert reaper.evicted == {"lifetime": 1, "lru": 1}
@@ -0,0 +1,250 @@
+"""Contrato de `SessionStore` para as implementações em memória, em log e Redis (fakeredis)."""
+
+import asyncio
+
+import pytest
+
+from claude_handler import SessionConfig
+from config_profile import config_fingerprint
+from history_log import META_FILE, HistoryLog, PersistentSessionStore
+from session_store import InMemorySessionStore, RedisSessionStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+pytestmark = pytest.mark.anyio
+
+CONFIG = SessionConfig(system_prompt="a")
+OTHER = SessionConfig(system_prompt="b")
+
+
+@pytest.fixture(params=["memory", "log", "redis"])
+async def store(request, tmp_path):
+    if request.param == "memory":
+        store = InMemorySessionStore()
+    elif request.param == "log":
+        store = PersistentSessionStore(HistoryLog(str(tmp_path)))
+    else:
+        store = RedisSessionStore(fakeredis.aioredis.FakeRedis(decode_responses=True))
+    yield store
+    await store.close()
+
+
+def message(text, tokens=1):
+    return {"role": "user", "content": text, "tokens": tokens}
+
+
+async def test_create_and_get(store):
+    await store.create("a", CONFIG, created_at=100.0)
+    assert await store.exists("a")
+    assert not await store.exists("b")
+    assert await store.get_config("a") == CONFIG
+    meta = await store.get_meta("a")
+    assert meta["created_at"] == 100.0
+    assert meta["message_count"] == 0
+    assert meta["total_tokens"] == 0
+    assert await store.get_meta("b") is None
+    assert await store.get_config("b") is None
+
+
+async def test_set_config(store):
+    await store.create("a", CONFIG)
+    assert await store.set_config("a", OTHER)
+    assert await store.get_config("a") == OTHER
+    assert not await store.set_config("b", OTHER)
+    assert not await store.exists("b")
+
+
+async def test_append_and_clear_history(store):
+    await store.create("a", CONFIG)
+    assert await store.append_history("a", message("1", 2), message("2", 3)) == 2
+    assert await store.append_history("a", message("3")) == 3
+    assert [m["content"] for m in await store.get_history("a")] == ["1", "2", "3"]
+    meta = await store.get_meta("a")
+    assert meta["message_count"] == 3
+    assert meta["history_tokens"] == 6
+    await store.clear_history("a")
+    assert await store.get_history("a") == []
+    assert (await store.get_meta("a"))["history_tokens"] == 0
+
+
+async def test_usage_and_claim(store):
+    await store.create("a", CONFIG)
+    await store.add_usage("a", 10, 0.5)
+    await store.add_usage("a", 5, 0.25)
+    await store.claim("a", "replica-2")
+    meta = await store.get_meta("a")
+    assert meta["total_tokens"] == 15
+    assert meta["total_cost"] == pytest.approx(0.75)
+    assert meta["replica"] == "replica-2"
+
+
+async def test_delete(store):
+    await store.create("a", CONFIG)
+    await store.append_history("a", message("1"))
+    assert await store.count() == 1
+    assert await store.delete("a")
+    assert not await store.delete("a")
+    assert not await store.exists("a")
+    assert await store.get_history("a") == []
+    assert await store.list_ids() == []
+    assert await store.count() == 0
+
+
+async def test_list_page(store):
+    for i in range(5):
+        await store.create(f"s{i}", CONFIG if i % 2 else OTHER, created_at=100.0 + i)
+    first = await store.list_page(None, 2)
+    assert [s["session_id"] for s in first] == ["s0", "s1"]
+    after = (first[-1]["created_at"], first[-1]["session_id"])
+    rest = await store.list_page(after, 10)
+    assert [s["session_id"] for s in rest] == ["s2", "s3", "s4"]
+    assert [s["session_id"] for s in await store.list_page(None, 10, created_after=102.0)] == ["s3", "s4"]
+    by_config = await store.list_page(None, 10, fingerprint=config_fingerprint(CONFIG))
+    assert [s["session_id"] for s in by_config] == ["s1", "s3"]
+    kept = await store.list_page(None, 10, keep=lambda session_id: session_id != "s2")
+    assert [s["session_id"] for s in kept] == ["s0", "s1", "s3", "s4"]
+    await store.delete("s1")
+    assert [s["session_id"] for s in await store.list_page(None, 10)] == ["s0", "s2", "s3", "s4"]
+
+
+async def test_changes(store):
+    await store.create("a", CONFIG)
+    await store.create("b", CONFIG)
+    since = await store.current_version()
+    await store.append_history("a", message("1"))
+    await store.delete("b")
+    items, version, reset = await store.changes(since, 10)
+    assert not reset
+    assert version == await store.current_version()
+    assert [(item["session_id"], item.get("deleted", False)) for item in items] == [("a", False), ("b", True)]
+    assert await store.changes(version, 10) == ([], version, False)
+
+    items, next_version, _ = await store.changes(since, 1)
+    assert [item["session_id"] for item in items] == ["a"]
+    assert next_version == items[-1]["version"]
+
+
+async def test_writes_after_delete_are_noops(store):
+    await store.create("a", CONFIG)
+    await store.delete("a")
+    since = await store.current_version()
+
+    assert await store.append_history("a", message("1")) == 0
+    await store.add_usage("a", 10, 0.5)
+    await store.claim("a", "replica-2")
+    await store.clear_history("a")
+    assert not await store.set_config("a", OTHER)
+    assert await store.snapshot("a", "snap") is None
+
+    assert not await store.exists("a")
+    assert await store.get_meta("a") is None
+    assert await store.get_history("a") == []
+    assert await store.list_ids() == []
+    assert await store.list_page(None, 10) == []
+    items, _, _ = await store.changes(0, 10)
+    assert [(item["session_id"], item.get("deleted", False)) for item in items] == [("a", True)]
+    assert (await store.changes(since, 10))[0] == []
+
+
+async def test_delete_racing_writes(store):
+    await store.create("a", CONFIG)
+    await asyncio.gather(
+        store.delete("a"),
+        *(store.append_history("a", message(str(i))) for i in range(20)),
+        *(store.add_usage("a", 1, 0.1) for _ in range(20)),
+        *(store.claim("a", f"r{i}") for i in range(5)),
+    )
+    assert not await store.exists("a")
+    assert await store.get_meta("a") is None
+    assert await store.list_ids() == []
+    items, _, _ = await store.changes(0, 10)
+    assert [item["session_id"] for item in items] == ["a"]
+    assert items[0]["deleted"]
+
+
+async def test_busy_marks(store):
+    await store.mark_busy(["a", "b"], 30)
+    await store.mark_busy(["c"], -1)
+    busy = await store.busy(["a", "b", "c", "d"])
+    if isinstance(store, RedisSessionStore):
+        # Marcas compartilhadas entre réplicas; a vencida (c) não conta
+        assert busy == {"a", "b"}
+        await store.clear_busy("a")
+        assert await store.busy(["a", "b"]) == {"b"}
+    else:
+        # Store local: o TurnRegistry do processo é a fonte de verdade
+        assert busy == set()
+
+
+async def test_reaper_skips_sessions_busy_on_other_replica(store):
+    from session_reaper import SessionReaper
+
+    await store.create("a", CONFIG, created_at=1.0)
+    await store.create("b", CONFIG, created_at=1.0)
+    await store.mark_busy(["a"], 30)
+    reaper = SessionReaper(store, max_lifetime=60.0)
+    await reaper.reap()
+    expected = ["a"] if isinstance(store, RedisSessionStore) else []
+    assert await store.list_ids() == expected
+
+
+async def test_reopened_log_indexes_cold_sessions(tmp_path):
+    store = PersistentSessionStore(HistoryLog(str(tmp_path)))
+    for i in range(4):
+        await store.create(f"s{i}", CONFIG if i % 2 else OTHER, created_at=100.0 + i)
+    await store.append_history("s1", message("1"))
+    await store.close()
+    # Diretório anterior ao meta.json: reconstruído a partir do log
+    (tmp_path / "s2" / META_FILE).unlink()
+
+    store = PersistentSessionStore(HistoryLog(str(tmp_path)))
+    page = await store.list_page(None, 10)
+    assert [s["session_id"] for s in page] == ["s0", "s1", "s2", "s3"]
+    assert [s["created_at"] for s in page] == [100.0, 101.0, 102.0, 103.0]
+    by_config = await store.list_page(None, 10, fingerprint=config_fingerprint(CONFIG))
+    assert [s["session_id"] for s in by_config] == ["s1", "s3"]
+    items, version, reset = await store.changes(0, 10)
+    assert not reset
+    assert [item["session_id"] for item in items] == ["s0", "s1", "s2", "s3"]
+    assert (tmp_path / "s2" / META_FILE).exists()
+
+    # Restaurar ou remover uma sessão fria mantém os índices coerentes
+    assert await store.count() == 4
+    assert [m["content"] for m in await store.get_history("s1")] == ["1"]
+    assert await store.count() == 4
+    assert await store.delete("s3")
+    assert await store.count() == 3
+    assert [s["session_id"] for s in await store.list_page(None, 10)] == ["s0", "s1", "s2"]
+    items, _, _ = await store.changes(version, 10)
+    assert [(item["session_id"], item.get("deleted", False)) for item in items] == [("s1", False), ("s3", True)]
+    await store.close()
+
+
+async def test_fork_logs_reference_until_source_changes(tmp_path):
+    store = PersistentSessionStore(HistoryLog(str(tmp_path)))
+    await store.create("a", CONFIG)
+    await store.append_history("a", *(message(str(i)) for i in range(100)))
+    assert await store.fork("a", "b", at=50)
+    await store.append_history("a", message("a"))
+    await store.append_history("b", message("b"))
+    await store.close()
+    # A cópia guarda só a referência à origem, não as 50 mensagens
+    assert sum(f.stat().st_size for f in (tmp_path / "b").glob("*.log")) < 1024
+
+    store = PersistentSessionStore(HistoryLog(str(tmp_path)))
+    history = [m["content"] for m in await store.get_history("b")]
+    assert history == [str(i) for i in range(50)] + ["b"]
+    await store.close()
+
+    # Limpar e remover a origem materializa a cópia antes
+    store = PersistentSessionStore(HistoryLog(str(tmp_path)))
+    await store.clear_history("a")
+    await store.delete("a")
+    assert store.materialized == 1
+    await store.close()
+
+    store = PersistentSessionStore(HistoryLog(str(tmp_path)))
+    assert not await store.exists("a")
+    history = [m["content"] for m in await store.get_history("b")]
+    assert history == [str(i) for i in range(50)] + ["b"]
+    await store.close()
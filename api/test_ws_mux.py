@@ -0,0 +1,148 @@
+"""`/api/ws` sobre o caminho simulado do handler (sem CLI)."""
+
+import json
+import time
+
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+
+from claude_handler import ClaudeHandler
+from replay_buffer import ReplayBuffer
+from scheduler import TurnScheduler
+from session_store import InMemorySessionStore
+from turns import TurnRegistry
+from ws_mux import BINARY_HEADER, MuxConnection
+
+ANSWER = "Esta é uma resposta simulada para: oi "
+
+
+@pytest.fixture
+def mux(monkeypatch):
+    """App só com o endpoint do mux; `connections` guarda as conexões abertas."""
+    monkeypatch.setenv("CLAUDE_CLI", "/nonexistent")
+    handler = ClaudeHandler(store=InMemorySessionStore())
+    assert handler.pool is None
+    replays = ReplayBuffer()
+    turns = TurnRegistry(handler, TurnScheduler(), replays)
+    app = FastAPI()
+    app.state.connections = []
+
+    @app.websocket("/ws")
+    async def endpoint(websocket: WebSocket, format: str = "json"):
+        await websocket.accept()
+        connection = MuxConnection(websocket, turns, handler, replays, binary=format == "binary")
+        app.state.connections.append(connection)
+        await connection.run()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await turns.close()
+
+    with TestClient(app) as client:
+        yield client
+
+
+def open_channel(ws, **fields):
+    ws.send_json({"op": "open", "channel": 1, **fields})
+    opened = ws.receive_json()
+    assert opened["op"] == "opened"
+    return opened["session_id"]
+
+
+def receive_events(ws, binary=False):
+    """`(canal, id, evento)` até o `done` do turno."""
+    events = []
+    while True:
+        if binary:
+            data = ws.receive_bytes()
+            channel, event_id = BINARY_HEADER.unpack_from(data)
+            event = json.loads(data[BINARY_HEADER.size:])
+        else:
+            frame = ws.receive_json()
+            channel, event_id, event = frame["channel"], frame.get("id"), frame["event"]
+        events.append((channel, event_id, event))
+        if event["type"] == "done":
+            return events
+
+
+def assert_turn(events, session_id):
+    assert [channel for channel, _, _ in events] == [1] * len(events)
+    assert [event_id for _, event_id, _ in events] == list(range(1, len(events) + 1))
+    assert all(event["session_id"] == session_id for _, _, event in events)
+    assert "".join(event.get("content", "") for _, _, event in events) == ANSWER
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_open_and_send_framing(mux, binary):
+    with mux.websocket_connect("/ws?format=binary" if binary else "/ws") as ws:
+        session_id = open_channel(ws)
+        ws.send_json({"op": "send", "channel": 1, "message": "oi"})
+        assert_turn(receive_events(ws, binary), session_id)
+
+
+def test_channel_stops_without_credits_and_resumes_on_credit(mux):
+    with mux.websocket_connect("/ws") as ws:
+        session_id = open_channel(ws, credits=2)
+        ws.send_json({"op": "send", "channel": 1, "message": "oi"})
+        events = [ws.receive_json() for _ in range(2)]
+        # Tempo de sobra para o turno inteiro: sem créditos nada mais chega
+        time.sleep(0.5)
+        ws.send_json({"op": "ping", "channel": 1})
+        assert ws.receive_json() == {"op": "error", "error": "Operação desconhecida: ping", "channel": 1}
+
+        ws.send_json({"op": "credit", "channel": 1, "credits": 100})
+        events = [(e["channel"], e["id"], e["event"]) for e in events] + receive_events(ws)
+        assert_turn(events, session_id)
+
+
+@pytest.mark.parametrize("coalesce_ms", [-1, "10", 1.5])
+def test_send_rejects_invalid_coalesce_ms(mux, coalesce_ms):
+    with mux.websocket_connect("/ws") as ws:
+        open_channel(ws)
+        ws.send_json({"op": "send", "channel": 1, "message": "oi", "coalesce_ms": coalesce_ms})
+        assert ws.receive_json() == {
+            "op": "error",
+            "error": "coalesce_ms deve ser um inteiro não negativo",
+            "channel": 1,
+        }
+
+
+def test_close_cancels_pump(mux):
+    with mux.websocket_connect("/ws") as ws:
+        session_id = open_channel(ws)
+        ws.send_json({"op": "send", "channel": 1, "message": "oi"})
+        assert ws.receive_json()["id"] == 1
+        [connection] = mux.app.state.connections
+        pump = connection.channels[1].task
+
+        ws.send_json({"op": "close", "channel": 1})
+        # Frames enfileirados antes do close ainda podem chegar
+        while (reply := ws.receive_json()).get("op") != "closed":
+            assert reply["channel"] == 1
+        assert reply == {"op": "closed", "channel": 1, "session_id": session_id}
+        time.sleep(0.5)
+        ws.send_json({"op": "credit", "channel": 1, "credits": 1})
+        assert ws.receive_json() == {"op": "error", "error": "Canal não aberto", "channel": 1}
+        assert connection.channels == {}
+        assert pump.cancelled()
+
+
+def test_turn_of_another_replica_is_not_resumed_or_interrupted(mux, monkeypatch):
+    async def busy(session_ids):
+        return {"s1"} & set(session_ids)
+
+    async def get_meta(session_id):
+        return {"replica": "replica-2"}
+
+    with mux.websocket_connect("/ws") as ws:
+        open_channel(ws, channel=2, session_id="s1")
+        [connection] = mux.app.state.connections
+        monkeypatch.setattr(connection.handler.store, "busy", busy)
+        monkeypatch.setattr(connection.handler.store, "get_meta", get_meta)
+
+        error = {"op": "error", "error": "Turno em andamento na réplica replica-2"}
+        ws.send_json({"op": "open", "channel": 1, "session_id": "s1", "last_event_id": 3})
+        assert ws.receive_json() == {**error, "channel": 1}
+        ws.send_json({"op": "interrupt", "channel": 2})
+        assert ws.receive_json() == {**error, "channel": 2}
@@ -0,0 +1,359 @@
+"""Turnos executados em tasks próprias, independentes da conexão HTTP."""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from budgets import BudgetLedger
+from compaction import estimate_tokens
+from replay_buffer import ReplayBuffer, TurnStream
+from scheduler import Ticket, TurnScheduler
+from sse import SSEEncoder
+from streaming import coalesce
+from metrics import INTER_CHUNK_GAP, QUEUE_WAIT, TIME_TO_FIRST_TOKEN, TURN_DURATION, TURNS
+
+logger = logging.getLogger(__name__)
+
+# Validade da marca de sessão ocupada no store; o janitor a renova antes de vencer
+BUSY_LEASE = 30.0
+
+
+class TurnRun:
+    """Um turno enfileirado ou em execução e seus assinantes."""
+
+    def __init__(
+        self,
+        session_id: str,
+        message: str,
+        ticket: Ticket,
+        pin: bool = False,
+        token_limit: Optional[int] = None,
+    ):
+        self.session_id = session_id
+        self.message = message
+        self.pin = pin
+        # Teto de tokens de saída imposto pelo orçamento flexível
+        self.token_limit = token_limit
+        self.ticket = ticket
+        self.created_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.started: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.waiting = 0
+        self.orphaned_since: Optional[float] = None
+        self.interrupted = False
+        # Custo do turno no event loop, para /api/admin/loop
+        self.events = 0
+        self.emit_seconds = 0.0
+        self.max_emit = 0.0
+        self.paused_seconds = 0.0
+        self.last_event_at: Optional[float] = None
+
+    @property
+    def turn(self) -> Optional[TurnStream]:
+        if self.started.done() and not self.started.cancelled():
+            return self.started.result()
+        return None
+
+    @property
+    def subscribers(self) -> int:
+        turn = self.turn
+        return self.waiting + (turn.subscribers if turn is not None else 0)
+
+
+class TurnRegistry:
+    """Dono das tasks de geração.
+
+    Cada turno roda numa task que grava os frames no `ReplayBuffer`; as
+    respostas HTTP apenas assinam esse buffer (zero ou mais por turno).
+    O registro aplica o tempo máximo por turno, atende `/api/interrupt` e
+    cancela turnos sem nenhum assinante por mais de `abandon_after` segundos.
+    Com `budgets`, o turno só entra na fila se houver orçamento e é cortado
+    ao passar do teto de tokens do limite flexível.
+    """
+
+    def __init__(
+        self,
+        handler,
+        scheduler: TurnScheduler,
+        replays: ReplayBuffer,
+        max_turn_time: float = 3600.0,
+        abandon_after: float = 120.0,
+        interrupt_grace: float = 5.0,
+        budgets: Optional[BudgetLedger] = None,
+    ):
+        self.handler = handler
+        self.scheduler = scheduler
+        self.replays = replays
+        self.budgets = budgets
+        self.max_turn_time = max_turn_time
+        self.abandon_after = abandon_after
+        self.interrupt_grace = interrupt_grace
+        self._runs: Dict[str, List[TurnRun]] = {}
+        self._janitor: Optional[asyncio.Task] = None
+        self.completed = 0
+        self.cancelled = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_env(
+        cls,
+        handler,
+        scheduler: TurnScheduler,
+        replays: ReplayBuffer,
+        budgets: Optional[BudgetLedger] = None,
+    ) -> "TurnRegistry":
+        """Cria o registro a partir das variáveis de ambiente."""
+        return cls(
+            handler,
+            scheduler,
+            replays,
+            max_turn_time=float(os.getenv("MAX_SESSION_TIME", "3600")),
+            abandon_after=float(os.getenv("TURN_ABANDON_TIMEOUT", "120")),
+            budgets=budgets,
+        )
+
+    def submit(
+        self,
+        session_id: str,
+        message: str,
+        client_ip: Optional[str] = None,
+        coalesce_ms: Optional[int] = None,
+        coalesce_bytes: Optional[int] = None,
+        pin: bool = False,
+        api_key: Optional[str] = None,
+    ) -> TurnRun:
+        """Enfileira o turno e inicia sua task.
+
+        Pode levantar `QueueFullError`, `SessionLimitError` ou `BudgetExceededError`.
+        """
+        token_limit = None
+        if self.budgets is not None:
+            token_limit = self.budgets.admit(session_id, client_ip, api_key)
+        ticket = self.scheduler.submit(session_id, client_ip)
+        run = TurnRun(session_id, message, ticket, pin, token_limit)
+        self._runs.setdefault(session_id, []).append(run)
+        run.task = asyncio.create_task(self._run(run, coalesce_ms, coalesce_bytes), name=f"turn:{session_id}")
+        return run
+
+    def active(self, session_id: str) -> List[TurnRun]:
+        """Turnos enfileirados ou em execução da sessão."""
+        return list(self._runs.get(session_id, []))
+
+    def sessions(self) -> List[str]:
+        """Sessões com turno enfileirado ou em execução."""
+        return list(self._runs)
+
+    async def stream(self, run: TurnRun, backpressure: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Frames SSE do turno: posição na fila e depois os eventos ao vivo."""
+        queued = SSEEncoder(run.session_id)
+        run.waiting += 1
+        try:
+            while not run.started.done():
+                yield queued.encode({
+                    "type": "queued",
+                    "position": self.scheduler.position(run.ticket),
+                }, numbered=False)
+                await asyncio.wait({run.started}, timeout=1.0)
+        finally:
+            run.waiting -= 1
+
+        turn = run.turn
+        if turn is None:
+            # Cancelado antes de começar
+            yield queued.encode({"type": "done"}, numbered=False)
+            return
+        async for frame in turn.subscribe(policy=backpressure):
+            yield frame
+
+    async def interrupt(self, session_id: str) -> bool:
+        """Interrompe o turno em execução e descarta os enfileirados da sessão."""
+        runs = self.active(session_id)
+        if not runs:
+            return False
+        for run in runs:
+            run.interrupted = True
+            if run.turn is None:
+                run.task.cancel()
+            elif not await self.handler.interrupt_session(session_id):
+                run.task.cancel()
+            else:
+                # O worker encerra o turno sozinho; cancela se não responder
+                asyncio.get_running_loop().call_later(
+                    self.interrupt_grace, self._cancel_if_running, run
+                )
+        return True
+
+    def start(self, interval: float = 5.0):
+        """Inicia a limpeza periódica de turnos abandonados."""
+        async def loop():
+            while True:
+                await asyncio.sleep(interval)
+                self.reap_abandoned()
+                if self._runs:
+                    await self._mark_busy(self.sessions())
+
+        if self._janitor is None:
+            self._janitor = asyncio.create_task(loop())
+
+    def reap_abandoned(self):
+        """Cancela turnos sem assinantes há mais de `abandon_after` segundos."""
+        now = time.monotonic()
+        for runs in list(self._runs.values()):
+            for run in runs:
+                if run.subscribers:
+                    run.orphaned_since = None
+                elif run.orphaned_since is None:
+                    run.orphaned_since = now
+                elif now - run.orphaned_since > self.abandon_after:
+                    run.task.cancel()
+
+    async def close(self):
+        """Cancela todos os turnos."""
+        if self._janitor is not None:
+            self._janitor.cancel()
+            self._janitor = None
+        tasks = [run.task for runs in self._runs.values() for run in runs]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        runs = [run for runs in self._runs.values() for run in runs]
+        return {
+            "running": sum(1 for run in runs if run.turn is not None),
+            "queued": sum(1 for run in runs if run.turn is None),
+            "subscribers": sum(run.subscribers for run in runs),
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "timed_out": self.timed_out,
+        }
+
+    def task_stats(self) -> List[Dict[str, Any]]:
+        """Um item por turno: estado, assinantes e tempo gasto no event loop."""
+        now = time.monotonic()
+        items = []
+        for runs in self._runs.values():
+            for run in runs:
+                items.append({
+                    "task": run.task.get_name() if run.task is not None else None,
+                    "session_id": run.session_id,
+                    "state": "running" if run.turn is not None else "queued",
+                    "age_seconds": round(now - run.created_at, 3),
+                    "subscribers": run.subscribers,
+                    "events": run.events,
+                    "emit_ms": round(run.emit_seconds * 1000, 3),
+                    "max_emit_ms": round(run.max_emit * 1000, 3),
+                    "paused_ms": round(run.paused_seconds * 1000, 3),
+                    "idle_seconds": round(now - run.last_event_at, 3) if run.last_event_at is not None else None,
+                })
+        return items
+
+    async def _mark_busy(self, session_ids: List[str]):
+        """Avisa as outras réplicas (via store) que as sessões têm turno em andamento."""
+        try:
+            await self.handler.store.mark_busy(session_ids, BUSY_LEASE)
+        except Exception:
+            logger.warning("Falha ao marcar sessões ocupadas no store", exc_info=True)
+
+    async def _clear_busy(self, session_id: str):
+        try:
+            await self.handler.store.clear_busy(session_id)
+        except Exception:
+            logger.warning("Falha ao desmarcar sessão ocupada %s", session_id, exc_info=True)
+
+    def _cancel_if_running(self, run: TurnRun):
+        if not run.task.done():
+            run.task.cancel()
+
+    async def _run(self, run: TurnRun, coalesce_ms: Optional[int], coalesce_bytes: Optional[int]):
+        turn = None
+        try:
+            await self._mark_busy([run.session_id])
+            await run.ticket.wait()
+            run.started_at = time.monotonic()
+            QUEUE_WAIT.observe(run.started_at - run.created_at)
+            turn = self.replays.start_turn(run.session_id)
+            run.started.set_result(turn)
+            encoder = SSEEncoder(run.session_id, start_id=turn.first_id)
+            last_emit = None
+            first_text = True
+
+            def emit(event):
+                nonlocal last_emit, first_text
+                now = time.monotonic()
+                if last_emit is not None:
+                    INTER_CHUNK_GAP.observe(now - last_emit)
+                last_emit = now
+                if first_text and event.get("type") == "assistant_text":
+                    first_text = False
+                    TIME_TO_FIRST_TOKEN.observe(now - run.created_at)
+                frame = encoder.encode(event)
+                turn.publish(encoder.last_id, frame)
+                spent = time.monotonic() - now
+                run.events += 1
+                run.emit_seconds += spent
+                run.max_emit = max(run.max_emit, spent)
+                run.last_event_at = now
+
+            async def produce():
+                events = self.handler.send_message(run.session_id, run.message, run.pin)
+                output_tokens = 0
+                truncated = False
+                async for event in coalesce(events, coalesce_ms, coalesce_bytes):
+                    if run.token_limit is not None and event["type"] in ("assistant_text", "tool_use", "tool_result"):
+                        if truncated:
+                            # Resto do turno já interrompido; só o `result` segue
+                            continue
+                        if event["type"] == "assistant_text":
+                            output_tokens += estimate_tokens(event["content"])
+                        if output_tokens > run.token_limit:
+                            truncated = True
+                            self.budgets.truncate(run.session_id)
+                            emit({"type": "error", "error": "Orçamento de tokens atingido; resposta truncada"})
+                            await self.handler.interrupt_session(run.session_id)
+                            continue
+                    emit(event)
+                    # Segura o handler enquanto um cliente `pause` está atrasado
+                    paused = time.monotonic()
+                    await turn.writable()
+                    run.paused_seconds += time.monotonic() - paused
+
+            try:
+                await asyncio.wait_for(produce(), self.max_turn_time)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                outcome = "timeout"
+                emit({"type": "error", "error": "Tempo máximo do turno excedido"})
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                outcome = "interrupted" if run.interrupted else "cancelled"
+                emit({"type": "error", "error": "Turno interrompido" if run.interrupted else "Turno cancelado"})
+            except Exception as e:
+                outcome = "error"
+                emit({"type": "error", "error": str(e)})
+            else:
+                self.completed += 1
+                outcome = "completed"
+            TURN_DURATION.observe(time.monotonic() - run.started_at, outcome)
+            TURNS.inc(1, outcome)
+            # Envia evento de fim
+            emit({"type": "done"})
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            TURNS.inc(1, "cancelled")
+        finally:
+            self.scheduler.release(run.ticket)
+            if turn is not None:
+                turn.finish()
+            elif not run.started.done():
+                run.started.cancel()
+            runs = self._runs.get(run.session_id)
+            if runs is not None and run in runs:
+                runs.remove(run)
+                if not runs:
+                    del self._runs[run.session_id]
+            if run.session_id not in self._runs:
+                await self._clear_busy(run.session_id)
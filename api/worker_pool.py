@@ -0,0 +1,433 @@
+"""Pool de processos do Claude Code CLI pré-aquecidos e reutilizáveis."""
+
+import asyncio
+import json
+import os
+import shlex
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncGenerator, Coroutine, Dict, Any, List, Optional, Set, Tuple, TYPE_CHECKING
+
+from config_profile import config_fingerprint
+from metrics import WORKER_SPAWN
+
+if TYPE_CHECKING:
+    from claude_handler import SessionConfig
+
+# Limite de uma linha do stdout (resultados de ferramentas podem ser grandes)
+STREAM_LIMIT = 16 * 1024 * 1024
+
+# Fingerprint da configuração (`config_profile`)
+WorkerKey = str
+
+
+class WorkerError(Exception):
+    """Falha de comunicação com um processo worker."""
+
+
+class PoolExhaustedError(Exception):
+    """Todos os workers do pool estão ocupados."""
+
+
+def worker_key(config: "SessionConfig") -> WorkerKey:
+    """Chave que identifica workers intercambiáveis para uma configuração.
+
+    É o fingerprint: ele cobre exatamente os campos que entram na linha de
+    comando do CLI e já vem memoizado por configuração.
+    """
+    return config_fingerprint(config)
+
+
+def build_command(base: List[str], config: "SessionConfig", resume: Optional[str] = None) -> List[str]:
+    """Monta a linha de comando do CLI em modo stream-json bidirecional.
+
+    Com `resume`, o processo parte de uma cópia (`--fork-session`) da conversa
+    salva pelo CLI com esse id, sem reenviar o histórico.
+    """
+    cmd = list(base) + [
+        "-p",
+        "--input-format", "stream-json",
+        "--output-format", "stream-json",
+        "--verbose",
+    ]
+    if config.allowed_tools:
+        cmd += ["--allowedTools", ",".join(config.allowed_tools)]
+    if config.permission_mode:
+        cmd += ["--permission-mode", config.permission_mode]
+    if config.system_prompt:
+        cmd += ["--system-prompt", config.system_prompt]
+    if config.max_turns:
+        cmd += ["--max-turns", str(config.max_turns)]
+    if resume:
+        cmd += ["--resume", resume, "--fork-session"]
+    return cmd
+
+
+class ClaudeWorker:
+    """Processo do CLI de longa duração que atende vários turnos."""
+
+    def __init__(self, key: WorkerKey, command: List[str], cwd: Optional[str] = None):
+        self.key = key
+        self.command = command
+        self.cwd = cwd
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.session_id: Optional[str] = None
+        # Id da conversa no CLI (eventos `system`/`result`), usado pelos forks
+        self.cli_session_id: Optional[str] = None
+        # Iniciado com `--resume`: já tem o contexto sem nenhum turno
+        self.resumed = False
+        self.busy = False
+        self.broken = False
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.spawn_time = 0.0
+        self.turns = 0
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self.process is not None
+            and self.process.returncode is None
+            and not self.broken
+        )
+
+    async def start(self):
+        """Inicia o processo (sem aguardar o primeiro turno)."""
+        started = time.perf_counter()
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd=self.cwd,
+            limit=STREAM_LIMIT,
+        )
+        self.spawn_time = time.perf_counter() - started
+
+    async def run_turn(self, message: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """Envia uma mensagem e emite os eventos do CLI até o `result`."""
+        if not self.alive:
+            raise WorkerError("Worker não está ativo")
+
+        self.busy = True
+        completed = False
+        try:
+            payload = {
+                "type": "user",
+                "message": {"role": "user", "content": message},
+            }
+            self.process.stdin.write((json.dumps(payload) + "\n").encode())
+            await self.process.stdin.drain()
+
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    raise WorkerError("Processo do CLI encerrou inesperadamente")
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if event.get("session_id"):
+                    self.cli_session_id = event["session_id"]
+                yield event
+                if event.get("type") == "result":
+                    completed = True
+                    break
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise WorkerError(str(e))
+        finally:
+            # Turno abandonado no meio deixa saída pendente no stdout
+            if not completed:
+                self.broken = True
+            self.busy = False
+            self.turns += 1
+            self.last_used = time.monotonic()
+
+    async def interrupt(self) -> bool:
+        """Pede ao CLI para interromper o turno atual, mantendo o contexto.
+
+        O CLI encerra o turno com um evento `result`, então `run_turn`
+        termina normalmente e o worker continua reutilizável.
+        """
+        if not self.busy or not self.alive:
+            return False
+        request = {
+            "type": "control_request",
+            "request_id": f"req_{uuid.uuid4().hex}",
+            "request": {"subtype": "interrupt"},
+        }
+        try:
+            self.process.stdin.write((json.dumps(request) + "\n").encode())
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+        return True
+
+    async def close(self, timeout: float = 2.0):
+        """Encerra o processo."""
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+class WorkerPool:
+    """Mantém workers vinculados a sessões e reservas pré-aquecidas por configuração.
+
+    Workers vinculados guardam o contexto da conversa dentro do processo e são
+    reutilizados entre turnos da mesma sessão. Reservas ainda não vinculadas
+    ficam prontas para a próxima sessão com a mesma configuração.
+    """
+
+    def __init__(
+        self,
+        command: Optional[List[str]] = None,
+        max_size: int = 8,
+        idle_ttl: float = 300.0,
+        prewarm: int = 1,
+    ):
+        self.command = command or shlex.split(os.getenv("CLAUDE_CLI", "claude"))
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.prewarm_count = prewarm
+        self._bound: "OrderedDict[str, ClaudeWorker]" = OrderedDict()
+        self._spare: Dict[WorkerKey, List[ClaudeWorker]] = {}
+        # Sessões forkadas -> conversa do CLI a retomar no primeiro acquire
+        self._resume: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        self._reaper: Optional[asyncio.Task] = None
+        # Encerramentos e reposições em segundo plano (o loop só guarda referência fraca)
+        self._background: Set[asyncio.Task] = set()
+        self.spawned = 0
+        self.reused = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls) -> "WorkerPool":
+        """Cria o pool a partir das variáveis de ambiente."""
+        return cls(
+            max_size=int(os.getenv("CLAUDE_POOL_SIZE", "8")),
+            idle_ttl=float(os.getenv("CLAUDE_POOL_IDLE_TTL", "300")),
+            prewarm=int(os.getenv("CLAUDE_POOL_PREWARM", "1")),
+        )
+
+    @property
+    def size(self) -> int:
+        return len(self._bound) + sum(len(w) for w in self._spare.values())
+
+    async def acquire(self, session_id: str, config: "SessionConfig") -> ClaudeWorker:
+        """Retorna o worker da sessão, usando uma reserva aquecida se possível."""
+        key = worker_key(config)
+        async with self._lock:
+            worker = self._bound.get(session_id)
+            if worker is not None:
+                if worker.alive and worker.key == key and not worker.busy:
+                    self._bound.move_to_end(session_id)
+                    self.reused += 1
+                    return worker
+                if worker.busy:
+                    raise PoolExhaustedError("Sessão já possui um turno em andamento")
+                del self._bound[session_id]
+                self._in_background(worker.close())
+
+            resume = self._resume.get(session_id)
+            # Reservas não têm o contexto de um fork
+            worker = self._take_spare(key) if resume is None else None
+            took_spare = worker is not None
+            if took_spare:
+                self.reused += 1
+            else:
+                self._make_room()
+                worker = await self._spawn(key, config, resume)
+
+            worker.session_id = session_id
+            self._bound[session_id] = worker
+            self._resume.pop(session_id, None)
+
+        # Repõe a reserva consumida fora do lock
+        if took_spare:
+            self.prewarm_later(config)
+        return worker
+
+    def get(self, session_id: str) -> Optional[ClaudeWorker]:
+        """Worker vinculado à sessão, se houver."""
+        return self._bound.get(session_id)
+
+    def fork(self, source_id: str, target_id: str) -> bool:
+        """Faz o primeiro worker de `target_id` retomar a conversa do worker de `source_id`.
+
+        Só vale com o worker da origem ocioso e depois de ao menos um turno
+        (quando o CLI já informou o id da conversa).
+        """
+        worker = self._bound.get(source_id)
+        if worker is None or worker.busy or not worker.alive or not worker.cli_session_id:
+            return False
+        self._resume[target_id] = worker.cli_session_id
+        return True
+
+    async def release(self, worker: ClaudeWorker):
+        """Devolve o worker após o turno; descarta-o se ficou inconsistente."""
+        worker.last_used = time.monotonic()
+        if worker.alive:
+            return
+        async with self._lock:
+            if self._bound.get(worker.session_id) is worker:
+                del self._bound[worker.session_id]
+        await worker.close()
+
+    async def prewarm(self, config: "SessionConfig", count: int = 1):
+        """Garante `count` reservas aquecidas para a configuração."""
+        key = worker_key(config)
+        async with self._lock:
+            spares = self._spare.setdefault(key, [])
+            spares[:] = [w for w in spares if w.alive]
+            missing = count - len(spares)
+            for _ in range(missing):
+                if self.size >= self.max_size and not self._evict_one(spare_only=True):
+                    break
+                spares.append(await self._spawn(key, config))
+
+    def prewarm_later(self, config: "SessionConfig"):
+        """Agenda `prewarm` da configuração sem esperar pelo spawn."""
+        if self.prewarm_count:
+            self._in_background(self.prewarm(config, self.prewarm_count))
+
+    async def discard(self, session_id: str):
+        """Encerra o worker vinculado à sessão (fim ou limpeza de contexto)."""
+        async with self._lock:
+            worker = self._bound.pop(session_id, None)
+            self._resume.pop(session_id, None)
+        if worker is not None:
+            await worker.close()
+
+    async def evict_idle(self):
+        """Remove workers ociosos além do TTL."""
+        now = time.monotonic()
+        expired: List[ClaudeWorker] = []
+        async with self._lock:
+            for session_id, worker in list(self._bound.items()):
+                if not worker.busy and (now - worker.last_used > self.idle_ttl or not worker.alive):
+                    del self._bound[session_id]
+                    expired.append(worker)
+            for key, spares in list(self._spare.items()):
+                keep = [w for w in spares if w.alive and now - w.last_used <= self.idle_ttl]
+                expired += [w for w in spares if w not in keep]
+                if keep:
+                    self._spare[key] = keep
+                else:
+                    del self._spare[key]
+        self.evicted += len(expired)
+        for worker in expired:
+            await worker.close()
+
+    def start(self, interval: float = 30.0):
+        """Inicia a limpeza periódica por TTL."""
+        async def loop():
+            while True:
+                await asyncio.sleep(interval)
+                await self.evict_idle()
+
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(loop())
+
+    async def close(self):
+        """Encerra todos os workers."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        # Reposições em andamento terminam antes, para não sobrar reserva
+        await asyncio.gather(*self._background, return_exceptions=True)
+        async with self._lock:
+            workers = list(self._bound.values())
+            for spares in self._spare.values():
+                workers += spares
+            self._bound.clear()
+            self._spare.clear()
+        await asyncio.gather(*(w.close() for w in workers), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do pool."""
+        return {
+            "size": self.size,
+            "max_size": self.max_size,
+            "bound": len(self._bound),
+            "busy": sum(1 for w in self._bound.values() if w.busy),
+            "spare": sum(len(w) for w in self._spare.values()),
+            "spawned": self.spawned,
+            "reused": self.reused,
+            "evicted": self.evicted,
+            "configs": len(self.by_config()),
+        }
+
+    def by_config(self) -> Dict[WorkerKey, Dict[str, int]]:
+        """Workers vinculados e reservas aquecidas por fingerprint de configuração."""
+        index: Dict[WorkerKey, Dict[str, int]] = {}
+        for worker in self._bound.values():
+            index.setdefault(worker.key, {"bound": 0, "spare": 0})["bound"] += 1
+        for key, spares in self._spare.items():
+            if spares:
+                index.setdefault(key, {"bound": 0, "spare": 0})["spare"] += len(spares)
+        return index
+
+    def warm(self, config: "SessionConfig") -> int:
+        """Reservas aquecidas disponíveis para a configuração."""
+        return sum(1 for worker in self._spare.get(worker_key(config), ()) if worker.alive)
+
+    async def _spawn(self, key: WorkerKey, config: "SessionConfig", resume: Optional[str] = None) -> ClaudeWorker:
+        worker = ClaudeWorker(key, build_command(self.command, config, resume), cwd=config.cwd)
+        worker.resumed = resume is not None
+        await worker.start()
+        self.spawned += 1
+        WORKER_SPAWN.observe(worker.spawn_time)
+        return worker
+
+    def _take_spare(self, key: WorkerKey) -> Optional[ClaudeWorker]:
+        spares = self._spare.get(key, [])
+        while spares:
+            worker = spares.pop(0)
+            if worker.alive:
+                return worker
+        return None
+
+    def _make_room(self):
+        if self.size < self.max_size:
+            return
+        if not self._evict_one():
+            raise PoolExhaustedError(f"Pool esgotado ({self.max_size} workers ocupados)")
+
+    def _evict_one(self, spare_only: bool = False) -> bool:
+        """Despeja a reserva mais antiga ou, senão, o worker vinculado menos usado."""
+        oldest: Optional[Tuple[WorkerKey, ClaudeWorker]] = None
+        for key, spares in self._spare.items():
+            for worker in spares:
+                if oldest is None or worker.last_used < oldest[1].last_used:
+                    oldest = (key, worker)
+        if oldest is not None:
+            self._spare[oldest[0]].remove(oldest[1])
+            victim = oldest[1]
+        elif spare_only:
+            return False
+        else:
+            victim = None
+            for session_id, worker in self._bound.items():
+                if not worker.busy:
+                    victim = self._bound.pop(session_id)
+                    break
+            if victim is None:
+                return False
+        self.evicted += 1
+        self._in_background(victim.close())
+        return True
+
+    def _in_background(self, coro: Coroutine[Any, Any, Any]):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
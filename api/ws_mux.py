@@ -0,0 +1,289 @@
+"""Transporte WebSocket que multiplexa várias sessões numa única conexão.
+
+Cada sessão ocupa um canal. Os eventos são os mesmos frames do stream SSE
+(mesmo schema `StreamEvent`), lidos do buffer de replay e reenviados sem
+reserializar o JSON:
+
+- texto (padrão): `{"channel":1,"id":3,"event":{...}}` (`id` ausente em `queued`)
+- binário (`?format=binary`): 12 bytes de cabeçalho (canal uint32 e id uint64,
+  big-endian, id 0 quando ausente) seguidos do JSON do evento
+
+O cliente controla o fluxo com créditos por canal: cada evento consome um e,
+sem créditos, o canal deixa de ler o turno, que passa a ser tratado como um
+cliente lento pela política de backpressure do canal.
+"""
+
+import asyncio
+import json
+import os
+import struct
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+
+from budgets import BudgetExceededError
+from scheduler import QueueFullError, SessionLimitError
+from sse import dumps, parse_frame
+
+# Canal e id do evento no início de cada frame binário
+BINARY_HEADER = struct.Struct(">IQ")
+
+BACKPRESSURE_POLICIES = ("pause", "coalesce", "drop")
+
+
+class MuxError(Exception):
+    """Mensagem de controle inválida; vira um `{"op": "error"}` para o cliente."""
+
+    def __init__(self, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Channel:
+    """Uma sessão assinada pela conexão e seus créditos de envio."""
+
+    __slots__ = ("id", "session_id", "policy", "credits", "sources", "task", "_credit")
+
+    def __init__(self, channel_id: int, session_id: str, credits: int, policy: Optional[str]):
+        self.id = channel_id
+        self.session_id = session_id
+        self.policy = policy
+        self.credits = credits
+        # Streams de turnos a repassar, em ordem
+        self.sources: "asyncio.Queue[AsyncIterator[bytes]]" = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self._credit = asyncio.Event()
+        if credits > 0:
+            self._credit.set()
+
+    def grant(self, credits: int):
+        self.credits += credits
+        if self.credits > 0:
+            self._credit.set()
+
+    async def take(self):
+        """Consome um crédito, esperando o cliente conceder mais se preciso."""
+        while self.credits <= 0:
+            self._credit.clear()
+            await self._credit.wait()
+        self.credits -= 1
+
+
+class MuxConnection:
+    """Uma conexão WebSocket com vários canais.
+
+    Mensagens de controle (JSON em frames de texto ou binários), todas com `op`:
+
+    - `open`: `channel`, `session_id`, `credits`, `backpressure` e
+      `last_event_id` opcionais; com `last_event_id` retoma o turno atual
+    - `send`: `channel`, `message`, `pin`, `coalesce_ms`, `coalesce_bytes`
+    - `interrupt`, `clear` e `close`: `channel`
+    - `credit`: `channel` e `credits` a somar
+
+    Respostas de controle (`opened`, `interrupted`, `cleared`, `closed` e
+    `error`) saem sempre como texto.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        turns,
+        handler,
+        replays,
+        client_ip: Optional[str] = None,
+        api_key: Optional[str] = None,
+        binary: bool = False,
+        credits: int = 64,
+        max_channels: int = 100,
+    ):
+        self.websocket = websocket
+        self.turns = turns
+        self.handler = handler
+        self.replays = replays
+        self.client_ip = client_ip
+        self.api_key = api_key
+        self.binary = binary
+        self.credits = credits
+        self.max_channels = max_channels
+        self.channels: Dict[int, Channel] = {}
+        self._next_channel = 1
+        # Um único escritor: os canais só enfileiram frames prontos
+        self._out: "asyncio.Queue[Any]" = asyncio.Queue()
+
+    @classmethod
+    def from_env(cls, websocket, turns, handler, replays, **kwargs) -> "MuxConnection":
+        """Cria a conexão com os limites das variáveis de ambiente."""
+        return cls(
+            websocket,
+            turns,
+            handler,
+            replays,
+            credits=int(os.getenv("WS_CHANNEL_CREDITS", "64")),
+            max_channels=int(os.getenv("WS_MAX_CHANNELS", "100")),
+            **kwargs,
+        )
+
+    async def run(self):
+        """Atende a conexão até o cliente desconectar."""
+        writer = asyncio.create_task(self._write())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                raw = message.get("text")
+                if raw is None:
+                    raw = message.get("bytes") or b""
+                try:
+                    request = json.loads(raw)
+                    if not isinstance(request, dict):
+                        raise ValueError
+                except ValueError:
+                    self._reply({"op": "error", "error": "Mensagem de controle inválida"})
+                    continue
+                try:
+                    await self._dispatch(request)
+                except MuxError as e:
+                    reply = {"op": "error", "error": str(e)}
+                    if request.get("channel") is not None:
+                        reply["channel"] = request["channel"]
+                    if e.retry_after is not None:
+                        reply["retry_after"] = e.retry_after
+                    self._reply(reply)
+        finally:
+            # Os turnos continuam; sem assinantes, o registro os cancela depois
+            tasks = [channel.task for channel in self.channels.values()] + [writer]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.channels.clear()
+
+    async def _dispatch(self, request: Dict[str, Any]):
+        op = request.get("op")
+        if op == "open":
+            await self._open(request)
+            return
+        channel_id = request.get("channel")
+        channel = self.channels.get(channel_id) if isinstance(channel_id, int) else None
+        if channel is None:
+            raise MuxError("Canal não aberto")
+        if op == "send":
+            self._send(channel, request)
+        elif op == "credit":
+            credits = request.get("credits")
+            if not isinstance(credits, int) or credits <= 0:
+                raise MuxError("credits deve ser um inteiro positivo")
+            channel.grant(credits)
+        elif op == "interrupt":
+            session_id = channel.session_id
+            if not await self.turns.interrupt(session_id):
+                await self._reject_if_running_elsewhere(session_id)
+                if not await self.handler.store.exists(session_id):
+                    raise MuxError("Session not found")
+            self._reply({"op": "interrupted", "channel": channel.id, "session_id": session_id})
+        elif op == "clear":
+            await self.handler.clear_session(channel.session_id)
+            self._reply({"op": "cleared", "channel": channel.id, "session_id": channel.session_id})
+        elif op == "close":
+            del self.channels[channel.id]
+            channel.task.cancel()
+            self._reply({"op": "closed", "channel": channel.id, "session_id": channel.session_id})
+        else:
+            raise MuxError(f"Operação desconhecida: {op}")
+
+    async def _reject_if_running_elsewhere(self, session_id: str):
+        """Erro se o turno da sessão está em andamento em outra réplica."""
+        store = self.handler.store
+        if session_id not in await store.busy([session_id]):
+            return
+        meta = await store.get_meta(session_id) or {}
+        raise MuxError(f"Turno em andamento na réplica {meta.get('replica') or 'desconhecida'}")
+
+    async def _open(self, request: Dict[str, Any]):
+        channel_id = request.get("channel")
+        if channel_id is None:
+            while self._next_channel in self.channels:
+                self._next_channel += 1
+            channel_id = self._next_channel
+        elif not isinstance(channel_id, int) or not 0 < channel_id < 2 ** 32:
+            raise MuxError("channel deve ser um inteiro entre 1 e 2^32-1")
+        if channel_id in self.channels:
+            raise MuxError("Canal já aberto")
+        if len(self.channels) >= self.max_channels:
+            raise MuxError(f"Máximo de {self.max_channels} canais por conexão")
+        policy = request.get("backpressure")
+        if policy is not None and policy not in BACKPRESSURE_POLICIES:
+            raise MuxError("backpressure deve ser pause, coalesce ou drop")
+        credits = request.get("credits", self.credits)
+        if not isinstance(credits, int) or credits < 0:
+            raise MuxError("credits deve ser um inteiro não negativo")
+
+        session_id = request.get("session_id") or str(uuid.uuid4())
+        last_event_id = request.get("last_event_id")
+        turn = self.replays.get(session_id) if isinstance(last_event_id, int) else None
+        if isinstance(last_event_id, int) and turn is None:
+            # Retomada de um turno de outra réplica: o buffer não está aqui
+            await self._reject_if_running_elsewhere(session_id)
+        channel = self.channels[channel_id] = Channel(channel_id, session_id, credits, policy)
+        channel.task = asyncio.create_task(self._pump(channel))
+        self._reply({"op": "opened", "channel": channel_id, "session_id": session_id})
+        if turn is not None:
+            channel.sources.put_nowait(turn.subscribe(last_event_id, policy))
+
+    def _send(self, channel: Channel, request: Dict[str, Any]):
+        message = request.get("message")
+        if not isinstance(message, str) or not message:
+            raise MuxError("message é obrigatório")
+        # Mesmos limites dos campos de POST /api/chat
+        coalesce_ms = request.get("coalesce_ms")
+        if coalesce_ms is not None and (not isinstance(coalesce_ms, int) or coalesce_ms < 0):
+            raise MuxError("coalesce_ms deve ser um inteiro não negativo")
+        coalesce_bytes = request.get("coalesce_bytes")
+        if coalesce_bytes is not None and (not isinstance(coalesce_bytes, int) or coalesce_bytes <= 0):
+            raise MuxError("coalesce_bytes deve ser um inteiro positivo")
+        try:
+            run = self.turns.submit(
+                channel.session_id,
+                message,
+                self.client_ip,
+                coalesce_ms,
+                coalesce_bytes,
+                bool(request.get("pin")),
+                self.api_key,
+            )
+        except (QueueFullError, BudgetExceededError) as e:
+            raise MuxError(str(e), e.retry_after)
+        except SessionLimitError as e:
+            raise MuxError(str(e))
+        channel.sources.put_nowait(self.turns.stream(run, channel.policy))
+
+    async def _pump(self, channel: Channel):
+        """Repassa os turnos do canal em ordem, um evento por crédito."""
+        while True:
+            source = await channel.sources.get()
+            try:
+                async for frame in source:
+                    await channel.take()
+                    event_id, payload = parse_frame(frame)
+                    self._out.put_nowait(self._encode(channel.id, event_id, payload))
+            finally:
+                await source.aclose()
+
+    def _encode(self, channel_id: int, event_id: Optional[int], payload: bytes):
+        if self.binary:
+            return BINARY_HEADER.pack(channel_id, event_id or 0) + payload
+        if event_id is None:
+            return b'{"channel":%d,"event":%b}' % (channel_id, payload)
+        return b'{"channel":%d,"id":%d,"event":%b}' % (channel_id, event_id, payload)
+
+    def _reply(self, message: Dict[str, Any]):
+        self._out.put_nowait(dumps(message).decode())
+
+    async def _write(self):
+        while True:
+            item = await self._out.get()
+            if isinstance(item, str):
+                await self.websocket.send_text(item)
+            elif self.binary:
+                await self.websocket.send_bytes(item)
+            else:
+                await self.websocket.send_text(item.decode())